@@ -11,6 +11,8 @@ function Chatroom({ onClose, goalInfo = null }) {
     const [newMessage, setNewMessage] = useState('');
     const [isLoading, setIsLoading] = useState(false);
     const [chatHistory, setChatHistory] = useState([]);
+    // 伺服器端對話ID，歷史訊息由後端保存，只需傳送新訊息
+    const [sessionId, setSessionId] = useState(null);
     const messagesEndRef = useRef(null);
 
     // 固定的用戶ID
@@ -70,7 +72,7 @@ function Chatroom({ onClose, goalInfo = null }) {
             // 準備API請求數據
             const requestData = {
                 message: newMessage,
-                chat_history: chatHistory.slice(-10) // 只發送最近10條記錄，避免過長
+                session_id: sessionId // 第一次為 null，由後端建立新對話
             };
 
             // 如果有目標信息，使用特定的任務助手API
@@ -78,6 +80,7 @@ function Chatroom({ onClose, goalInfo = null }) {
 
             if (goalInfo) {
                 endpoint = `${API_BASE_URL}/users/${USER_ID}/chat/task-helper`;
+                delete requestData.session_id;
                 requestData.goal_name = goalInfo.eventName;
                 requestData.goal_deadline = goalInfo.eventDeadLine;
 
@@ -102,6 +105,10 @@ function Chatroom({ onClose, goalInfo = null }) {
 
             // 檢查API回應
             if (data.status === 'success') {
+                if (data.session_id) {
+                    setSessionId(data.session_id);
+                }
+
                 // 添加機器人回覆到UI
                 const botReply = {
                     id: messages.length + 2,
@@ -14,12 +14,9 @@ db = firestore.client()
 
 import requests
 import os
-from mistralai import Mistral
 from dotenv import load_dotenv
+from llm_model import gateway
 load_dotenv()
-api_key = os.getenv("MISTRAL_API_KEY")
-model = "open-mistral-7b"
-client = Mistral(api_key=api_key)
 
 # ====test====
 # 配置日誌
@@ -41,6 +38,8 @@ from ai_agent.routes import agent_bp
 from habits_building.routes import habit_building_bp
 from file_manage.routes import upload_bp
 from working_habits.routes import working_habits_bp
+from job_queue.routes import job_bp
+from monitoring.routes import monitoring_bp
 
 # from learning_resource.routes import resource_bp
 app.register_blueprint(article_bp, url_prefix='/api')
@@ -50,6 +49,22 @@ app.register_blueprint(agent_bp, url_prefix='/api')
 app.register_blueprint(habit_building_bp, url_prefix='/api')
 app.register_blueprint(upload_bp, url_prefix='/api')
 app.register_blueprint(working_habits_bp, url_prefix='/api')
+app.register_blueprint(job_bp, url_prefix='/api')
+app.register_blueprint(monitoring_bp, url_prefix='/api')
+
+# 每個路由的延遲/錯誤指標與 /metrics（Prometheus 格式，不加 /api 前綴）
+from monitoring import metrics
+metrics.init_app(app)
+
+# orjson 序列化，並依 Accept-Encoding 以 gzip/brotli 壓縮較大的回應
+from utils import json_codec
+json_codec.init_app(app)
+
+# 啟動背景任務 worker 並恢復未完成的任務
+# （debug 模式下只在重載器的子程序啟動，避免同一任務被兩個程序執行）
+from job_queue.services import start_job_workers
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    start_job_workers()
 
 # app.register_blueprint(resource_bp, url_prefix='/api')
     
@@ -76,9 +91,9 @@ def generate_schedule():
 """
 
     try:
-        response = client.chat.complete(
-            model = model,
-            messages = [{"role": "user", "content": prompt}]
+        response = gateway.complete(
+            [{"role": "user", "content": prompt}],
+            endpoint = 'schedule'  # 首選 open-mistral-7b，由模型路由器決定
         )
         message = response.choices[0].message.content
         return jsonify({'schedule': message}), 200
@@ -2,6 +2,9 @@
 from flask import Blueprint, request, jsonify
 from article_reminder.services import create_article_reminder_service
 from article_reminder.services import create_article_reminder_service, get_all_article_reminders_service
+from utils import live_view
+from utils.etag import conditional_get
+from utils.json_codec import json_response
 
 article_bp = Blueprint('article', __name__)
 
@@ -12,6 +15,10 @@ def create_article_reminder(user_id):
     return jsonify(result), status_code
 
 @article_bp.route('/users/<string:user_id>/article_reminders', methods=['GET'])
+@conditional_get('reminders')
 def get_all_article_reminders(user_id):
+    live = live_view.read(user_id, 'reminders')
+    if live is not None:
+        return json_response(live, stream_key='reminders')
     result, status_code = get_all_article_reminders_service(user_id)
     return jsonify(result), status_code
\ No newline at end of file
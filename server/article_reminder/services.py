@@ -1,6 +1,8 @@
 # article_reminder/services.py
 from firebase_admin import firestore
 from datetime import datetime
+from utils.etag import bump_versions
+from utils.read_cache import invalidate, reminders_tag
 
 def validate_article_data(data):
     required_fields = ['eventName', 'eventDeadLine', 'eventMode']
@@ -15,12 +17,17 @@ def create_article_reminder_service(user_id, data):
         reminders_ref = db.collection(f'users/{user_id}/articleReminders')
         deadline_str = data['eventDeadLine']  # 例如 "2025-05-03"
         deadline_date = datetime.strptime(deadline_str, "%Y-%m-%d")
-        new_doc = reminders_ref.add({
+        new_doc_ref = reminders_ref.document()
+        batch = db.batch()
+        batch.set(new_doc_ref, {
             'eventName': data['eventName'],
             'eventDeadLine': deadline_date,
             'eventMode': data['eventMode']
         })
-        return {'id': new_doc[1].id}, 201
+        bump_versions(batch, db, user_id, 'reminders')
+        batch.commit()
+        invalidate(reminders_tag(user_id), commit_time=batch.commit_time, collections=('articleReminders',))
+        return {'id': new_doc_ref.id}, 201
     except ValueError as e:
         return {'error': str(e)}, 400
     except Exception as e:
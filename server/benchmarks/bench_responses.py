@@ -0,0 +1,126 @@
+# benchmarks/bench_responses.py
+"""
+比較目標列表回應在不同序列化與壓縮方式下的大小與耗時
+
+以 10 / 100 / 1000 個目標（每個目標 TASKS_PER_GOAL 個任務）的合成帳號，量測：
+- baseline：原本的做法，逐欄位 isoformat() 後以 json.dumps（與 Flask 預設 jsonify 相同的
+  ensure_ascii、sort_keys 設定）輸出
+- encode_json：utils/json_codec 的序列化（有 orjson 時使用 orjson，時間戳在序列化時轉換）
+- 首段耗時：分段輸出時送出第一段前的耗時
+- gzip / br：壓縮後的大小與壓縮耗時（br 需安裝 brotli）
+
+在 server/ 目錄下執行：python -m benchmarks.bench_responses [--repeat 5]
+"""
+import argparse
+import copy
+import gzip
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+from utils import json_codec
+
+GOAL_COUNTS = (10, 100, 1000)
+TASKS_PER_GOAL = 20
+
+
+class FakeTimestamp(datetime):
+    """模擬 Firestore 回傳的 DatetimeWithNanoseconds（datetime 子類別）"""
+
+
+def _timestamp(dt):
+    return FakeTimestamp(dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second, dt.microsecond,
+                         tzinfo=timezone.utc)
+
+
+def make_account(goal_count):
+    """產生與 get_all_goals_service 結構相同、時間戳尚未轉換的合成資料"""
+    base = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    goals = []
+    for g in range(goal_count):
+        created = base + timedelta(hours=g)
+        goals.append({
+            'id': f'goal{g:05}',
+            'eventName': f'學習目標 {g}：完成線上課程與專題',
+            'eventDescription': '每天安排固定時間閱讀教材、完成練習並整理筆記，最後做一個小專題。',
+            'eventMode': 'ai',
+            'eventDeadLine': _timestamp(created + timedelta(days=30)),
+            'createdAt': _timestamp(created),
+            'totalTasks': TASKS_PER_GOAL,
+            'learningLinks': [{'title': f'參考資料 {i}', 'url': f'https://example.com/{g}/{i}'} for i in range(3)],
+            'generator': 'llm',
+            'tasks': [
+                {
+                    'id': f'task{t + 1:03}',
+                    'task_name': f'第 {t + 1} 天：閱讀章節並完成練習題',
+                    'due_date': _timestamp(created + timedelta(days=t)),
+                    'priority': ('high', 'medium', 'low')[t % 3],
+                    'dependencies': [f'第 {t} 天：閱讀章節並完成練習題'] if t else [],
+                    'status': 'completed' if t < 5 else 'pending',
+                    'order': t + 1,
+                    'createdAt': _timestamp(created),
+                }
+                for t in range(TASKS_PER_GOAL)
+            ],
+        })
+    return {'goals': goals}
+
+
+def baseline(payload):
+    """原本的路徑：服務逐欄位 isoformat()，再由 jsonify 以預設設定序列化"""
+    for goal in payload['goals']:
+        for field in ('eventDeadLine', 'createdAt'):
+            if goal.get(field):
+                goal[field] = goal[field].isoformat()
+        for task in goal['tasks']:
+            for field in ('due_date', 'createdAt'):
+                if task.get(field):
+                    task[field] = task[field].isoformat()
+    return json.dumps(payload, ensure_ascii=True, sort_keys=True).encode('utf-8')
+
+
+def _best_ms(fn, repeat, prepare=None):
+    best = None
+    result = None
+    for _ in range(repeat):
+        arg = prepare() if prepare else None
+        started = time.perf_counter()
+        result = fn(arg) if prepare else fn()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run(repeat):
+    serializer = 'orjson' if json_codec.orjson is not None else 'json'
+    print(f'encode_json 使用 {serializer}；brotli {"可用" if json_codec.brotli is not None else "未安裝"}')
+    header = f"{'goals':>6} {'tasks':>7} | {'baseline KB':>11} {'ms':>8} | {'encode KB':>9} {'ms':>8} {'first ms':>8}" \
+             f" | {'gzip KB':>8} {'ms':>7} | {'br KB':>7} {'ms':>7}"
+    print(header)
+    print('-' * len(header))
+
+    for goal_count in GOAL_COUNTS:
+        account = make_account(goal_count)
+
+        base_ms, base_body = _best_ms(baseline, repeat, prepare=lambda: copy.deepcopy(account))
+        fast_ms, fast_body = _best_ms(lambda: json_codec.encode_json(account), repeat)
+        first_ms, _ = _best_ms(lambda: next(json_codec.iter_json_list(account, 'goals')), repeat)
+        gzip_ms, gzip_body = _best_ms(
+            lambda: gzip.compress(fast_body, compresslevel=json_codec.COMPRESS_GZIP_LEVEL), repeat
+        )
+        if json_codec.brotli is not None:
+            br_ms, br_body = _best_ms(lambda: json_codec.compress(fast_body, 'br'), repeat)
+            br_cols = f'{len(br_body) / 1024:>7.1f} {br_ms:>7.2f}'
+        else:
+            br_cols = f"{'-':>7} {'-':>7}"
+
+        print(f'{goal_count:>6} {goal_count * TASKS_PER_GOAL:>7} | '
+              f'{len(base_body) / 1024:>11.1f} {base_ms:>8.2f} | '
+              f'{len(fast_body) / 1024:>9.1f} {fast_ms:>8.2f} {first_ms:>8.2f} | '
+              f'{len(gzip_body) / 1024:>8.1f} {gzip_ms:>7.2f} | {br_cols}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='每項量測重複次數（取最快一次）')
+    run(parser.parse_args().repeat)
@@ -1,6 +1,16 @@
 # chat_bot/routes.py
-from flask import Blueprint, request, jsonify
-from chat_bot.services import get_chatbot_response_service, get_task_helper_response_service
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from chat_bot.services import (
+    get_chatbot_response_service,
+    get_task_helper_response_service,
+    stream_chatbot_response_service,
+    stream_task_helper_response_service,
+    chat_with_session_service,
+    stream_chat_with_session_service,
+    get_session_messages_service,
+)
+from chat_bot.session_store import create_session, SessionNotFoundError
+from utils.sse import SSE_HEADERS
 import logging
 
 chat_bp = Blueprint('chat', __name__)
@@ -19,6 +29,12 @@ def get_chat_response(user_id):
             {"role": "assistant", "content": "之前的助手回覆"}
         ]
     }
+
+    或使用伺服器端對話（只傳新訊息，session_id 為 null 時建立新對話）:
+    {
+        "message": "用戶訊息",
+        "session_id": "對話ID"
+    }
     """
     try:
         data = request.json
@@ -27,12 +43,18 @@ def get_chat_response(user_id):
             return jsonify({"error": "缺少必要參數 'message'", "status": "error"}), 400
 
         message = data.get('message')
+
+        if 'session_id' in data:
+            result, status_code = chat_with_session_service(user_id, message, data.get('session_id'))
+            return jsonify(result), status_code
+
         chat_history = data.get('chat_history', [])
 
         # 獲取回覆
         result, status_code = get_chatbot_response_service(
             message=message,
-            chat_history=chat_history
+            chat_history=chat_history,
+            user_id=user_id
         )
 
         return jsonify(result), status_code
@@ -92,4 +114,84 @@ def get_task_help(user_id):
             "response": "處理請求時發生錯誤",
             "status": "error",
             "error": str(e)
-        }), 500
\ No newline at end of file
+        }), 500
+
+
+@chat_bp.route('/users/<string:user_id>/chat/stream', methods=['POST'])
+def stream_chat_response(user_id):
+    """
+    以 Server-Sent Events 串流聊天機器人回覆
+
+    請求參數同 /chat；回應事件：
+    - event: token  data: {"content": "..."}
+    - event: done   data: {"usage": {...}, "timing": {...}}
+    - event: error  data: {"error": "..."}
+    """
+    data = request.json
+
+    if not data or 'message' not in data:
+        return jsonify({"error": "缺少必要參數 'message'", "status": "error"}), 400
+
+    if 'session_id' in data:
+        try:
+            events = stream_chat_with_session_service(user_id, data.get('message'), data.get('session_id'))
+        except SessionNotFoundError as e:
+            return jsonify({"error": str(e), "status": "error"}), 404
+        return Response(stream_with_context(events), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+    events = stream_chatbot_response_service(
+        message=data.get('message'),
+        chat_history=data.get('chat_history', []),
+        user_id=user_id
+    )
+    return Response(stream_with_context(events), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+
+@chat_bp.route('/users/<string:user_id>/chat/task-helper/stream', methods=['POST'])
+def stream_task_help(user_id):
+    """
+    以 Server-Sent Events 串流任務助手回覆
+
+    請求參數同 /chat/task-helper；回應事件同 /chat/stream
+    """
+    data = request.json
+
+    if not data or 'message' not in data:
+        return jsonify({"error": "缺少必要參數 'message'", "status": "error"}), 400
+
+    events = stream_task_helper_response_service(
+        message=data.get('message'),
+        goal_name=data.get('goal_name'),
+        goal_deadline=data.get('goal_deadline'),
+        task_list=data.get('tasks', [])
+    )
+    return Response(stream_with_context(events), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+
+@chat_bp.route('/users/<string:user_id>/chat/sessions', methods=['POST'])
+def create_chat_session(user_id):
+    """建立伺服器端對話，回傳 session_id"""
+    try:
+        return jsonify({"session_id": create_session(user_id)}), 201
+    except Exception as e:
+        logging.error(f"Route Error: {str(e)}")
+        return jsonify({"error": str(e), "status": "error"}), 500
+
+
+@chat_bp.route('/users/<string:user_id>/chat/sessions/<string:session_id>/messages', methods=['GET'])
+def get_chat_session_messages(user_id, session_id):
+    """
+    分頁取得對話歷史
+
+    查詢參數:
+    - before: 上一頁回傳的 next_cursor（省略則從最新訊息開始）
+    - limit: 每頁筆數（預設 50，最多 200）
+    """
+    try:
+        before = request.args.get('before', type=int)
+        limit = min(request.args.get('limit', default=50, type=int), 200)
+        result, status_code = get_session_messages_service(user_id, session_id, before, limit)
+        return jsonify(result), status_code
+    except Exception as e:
+        logging.error(f"Route Error: {str(e)}")
+        return jsonify({"error": str(e), "status": "error"}), 500
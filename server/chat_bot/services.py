@@ -1,21 +1,36 @@
 # chat_bot/services.py
 import logging
-from llm_model.chat_services import get_chatbot_response, get_task_helper_response
+from llm_model.chat_services import (
+    get_chatbot_response,
+    get_task_helper_response,
+    stream_chatbot_response,
+    stream_task_helper_response,
+)
+from utils.sse import format_sse
+from chat_bot.session_store import (
+    SessionNotFoundError,
+    create_session,
+    get_history,
+    append_messages,
+    get_messages_page,
+)
 
 
-def get_chatbot_response_service(message, chat_history=None):
+def get_chatbot_response_service(message, chat_history=None, user_id=None):
     """
     使用 Mistral 生成聊天機器人回覆(服務層)
 
     :param message: 用戶的訊息
     :param chat_history: 之前的對話歷史 [{"role": "user"/"assistant", "content": "message"}, ...]
+    :param user_id: 使用者ID（用於快取舊訊息摘要）
     :return: 含有回复内容的字典和狀態碼的元組
     """
     try:
         # 調用 llm_model/chat_services.py 中的方法
         result = get_chatbot_response(
             user_message=message,
-            chat_history=chat_history
+            chat_history=chat_history,
+            conversation_key=user_id
         )
 
         # 記錄回應以便調試
@@ -32,6 +47,67 @@ def get_chatbot_response_service(message, chat_history=None):
         }, 500
 
 
+def _open_session(user_id, session_id):
+    """取得（或建立）伺服器端對話，回傳 (session_id, 歷史訊息)"""
+    if not session_id:
+        return create_session(user_id), []
+    return session_id, get_history(user_id, session_id)
+
+
+def chat_with_session_service(user_id, message, session_id=None):
+    """
+    以伺服器端保存的對話生成回覆(服務層)；用戶端只需傳送新訊息與 session_id
+
+    :param user_id: 使用者ID
+    :param message: 用戶的訊息
+    :param session_id: 對話ID，為空時建立新對話
+    :return: 含有回复内容（與 session_id）的字典和狀態碼的元組
+    """
+    try:
+        session_id, history = _open_session(user_id, session_id)
+
+        result = get_chatbot_response(
+            user_message=message,
+            chat_history=history,
+            conversation_key=f'{user_id}:{session_id}'
+        )
+
+        # 只有成功的回合才寫入對話
+        if result.get('status') == 'success':
+            append_messages(user_id, session_id, [
+                {'role': 'user', 'content': message},
+                {'role': 'assistant', 'content': result['response']}
+            ])
+
+        logging.info(f"聊天機器人回應: {result['response'][:100]}...")
+        return {**result, 'session_id': session_id}, 200
+
+    except SessionNotFoundError as e:
+        return {"error": str(e), "status": "error"}, 404
+    except Exception as e:
+        logging.error(f"Chat Session Service Error: {str(e)}", exc_info=True)
+        return {
+            "response": f"抱歉，我現在無法回答您的問題。請稍後再試。",
+            "status": "error",
+            "error": str(e)
+        }, 500
+
+
+def get_session_messages_service(user_id, session_id, before=None, limit=50):
+    """
+    分頁取得伺服器端對話的歷史訊息(服務層)
+
+    :return: 訊息分頁字典和狀態碼的元組
+    """
+    try:
+        return {'session_id': session_id, **get_messages_page(user_id, session_id, before, limit)}, 200
+    except SessionNotFoundError as e:
+        return {"error": str(e), "status": "error"}, 404
+    except Exception as e:
+        logging.error(f"Chat History Service Error: {str(e)}", exc_info=True)
+        return {"error": str(e), "status": "error"}, 500
+
+
 def get_task_helper_response_service(message, goal_name=None, goal_deadline=None, task_list=None):
     """
     使用 Mistral 為特定目標提供任務建議和幫助(服務層)
@@ -66,4 +142,90 @@ def get_task_helper_response_service(message, goal_name=None, goal_deadline=None
             "response": f"抱歉，我現在無法回答您的問題。請稍後再試。",
             "status": "error",
             "error": str(e)
-        }, 500
\ No newline at end of file
+        }, 500
+
+
+def _sse_stream(events, label, on_complete=None, extra=None):
+    """
+    把 LLM 串流事件轉成 SSE 文字；用戶端斷線時關閉上游串流
+
+    :param events: _stream_completion 產生的事件產生器
+    :param label: 日誌用的名稱
+    :param on_complete: 串流完整結束時以完整回覆文字呼叫的函式
+    :param extra: 附加在 done 事件中的欄位
+    """
+    parts = []
+    try:
+        for event in events:
+            if event["type"] == "token":
+                parts.append(event["content"])
+                yield format_sse("token", {"content": event["content"]})
+            else:
+                logging.info(f"{label} 串流完成: {event['timing']}, usage={event['usage']}")
+                if on_complete:
+                    on_complete("".join(parts))
+                yield format_sse("done", {"usage": event["usage"], "timing": event["timing"], **(extra or {})})
+    except GeneratorExit:
+        logging.info(f"{label} 用戶端已斷線，取消上游請求")
+        raise
+    except Exception as e:
+        logging.error(f"{label} 串流錯誤: {str(e)}", exc_info=True)
+        yield format_sse("error", {"error": str(e), "status": "error"})
+    finally:
+        events.close()
+
+
+def stream_chatbot_response_service(message, chat_history=None, user_id=None):
+    """
+    串流版聊天機器人回覆(服務層)，回傳 SSE 文字產生器
+
+    :param message: 用戶的訊息
+    :param chat_history: 之前的對話歷史
+    :param user_id: 使用者ID（用於快取舊訊息摘要）
+    """
+    events = stream_chatbot_response(
+        user_message=message,
+        chat_history=chat_history,
+        conversation_key=user_id
+    )
+    return _sse_stream(events, "聊天機器人")
+
+
+def stream_chat_with_session_service(user_id, message, session_id=None):
+    """
+    串流版 chat_with_session_service，回傳 SSE 文字產生器；完整回覆送完後才寫入對話
+
+    :raises SessionNotFoundError: 對話不存在
+    """
+    session_id, history = _open_session(user_id, session_id)
+
+    def save_turn(reply):
+        append_messages(user_id, session_id, [
+            {'role': 'user', 'content': message},
+            {'role': 'assistant', 'content': reply}
+        ])
+
+    events = stream_chatbot_response(
+        user_message=message,
+        chat_history=history,
+        conversation_key=f'{user_id}:{session_id}'
+    )
+    return _sse_stream(events, "聊天機器人", on_complete=save_turn, extra={'session_id': session_id})
+
+
+def stream_task_helper_response_service(message, goal_name=None, goal_deadline=None, task_list=None):
+    """
+    串流版任務助手回覆(服務層)，回傳 SSE 文字產生器
+
+    :param message: 用戶的訊息
+    :param goal_name: 當前目標名稱（如果有）
+    :param goal_deadline: 目標截止日期（如果有）
+    :param task_list: 當前目標的任務列表（如果有）
+    """
+    events = stream_task_helper_response(
+        user_message=message,
+        goal_name=goal_name,
+        goal_deadline=goal_deadline,
+        task_list=task_list
+    )
+    return _sse_stream(events, "任務助手")
@@ -0,0 +1,233 @@
+# chat_bot/session_store.py
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from utils.cache import TTLCache
+
+load_dotenv()
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CHAT_SESSION_DB = os.getenv('CHAT_SESSION_DB', os.path.abspath(os.path.join(BASE_DIR, '..', 'chat_sessions.sqlite3')))
+CHAT_SESSION_IDLE_TTL = int(os.getenv('CHAT_SESSION_IDLE_TTL', str(30 * 60)))  # 熱資料閒置多久移出記憶體（秒）
+CHAT_SESSION_RETENTION = int(os.getenv('CHAT_SESSION_RETENTION', str(30 * 24 * 3600)))  # 冷資料保留多久（秒）
+CHAT_SESSION_HOT_SIZE = int(os.getenv('CHAT_SESSION_HOT_SIZE', '500'))
+CHAT_SESSION_PURGE_INTERVAL = int(os.getenv('CHAT_SESSION_PURGE_INTERVAL', '3600'))  # 背景清除過期對話的間隔（秒）
+
+# 熱資料：(user_id, session_id) -> 依序排列的訊息列表
+_hot_sessions = TTLCache(maxsize=CHAT_SESSION_HOT_SIZE, ttl=CHAT_SESSION_IDLE_TTL)
+_write_lock = threading.Lock()
+_db_ready = False
+_purger = None
+_purger_lock = threading.Lock()
+
+
+class SessionNotFoundError(Exception):
+    """找不到指定的對話"""
+
+
+@contextmanager
+def _connect():
+    global _db_ready
+    conn = sqlite3.connect(CHAT_SESSION_DB, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    try:
+        if not _db_ready:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chat_sessions (
+                    user_id TEXT NOT NULL,
+                    session_id TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_active REAL NOT NULL,
+                    PRIMARY KEY (user_id, session_id)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chat_messages (
+                    user_id TEXT NOT NULL,
+                    session_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (user_id, session_id, seq)
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_chat_sessions_last_active ON chat_sessions(last_active)')
+            _db_ready = True
+        yield conn
+    finally:
+        conn.close()
+
+
+def _purge_expired():
+    """
+    刪除超過保留期限的對話（冷資料的 TTL 淘汰）
+
+    依 last_active 索引找出過期對話，每個資料表只執行一次 DELETE，兩者在同一個交易中完成。
+
+    :return: 刪除的對話數
+    """
+    cutoff = time.time() - CHAT_SESSION_RETENTION
+    with _write_lock, _connect() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'DELETE FROM chat_messages WHERE (user_id, session_id) IN '
+                '(SELECT user_id, session_id FROM chat_sessions WHERE last_active < ?)', (cutoff,)
+            )
+            purged = conn.execute('DELETE FROM chat_sessions WHERE last_active < ?', (cutoff,)).rowcount
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    if purged:
+        logging.info(f"已清除 {purged} 個過期的對話")
+    return purged
+
+
+def _purge_loop():
+    while True:
+        try:
+            _purge_expired()
+        except Exception as e:
+            logging.error(f"清除過期對話失敗: {str(e)}", exc_info=True)
+        time.sleep(CHAT_SESSION_PURGE_INTERVAL)
+
+
+def _start_purger():
+    """第一次建立對話時啟動背景清除執行緒，不在請求路徑上刪除資料"""
+    global _purger
+    with _purger_lock:
+        if _purger is None:
+            _purger = threading.Thread(target=_purge_loop, name='chat-session-purger', daemon=True)
+            _purger.start()
+
+
+def create_session(user_id):
+    """
+    建立新的對話
+
+    :param user_id: 使用者ID
+    :return: 對話ID
+    """
+    session_id = uuid.uuid4().hex
+    now = time.time()
+    with _write_lock, _connect() as conn:
+        conn.execute(
+            'INSERT INTO chat_sessions (user_id, session_id, created_at, last_active) VALUES (?, ?, ?, ?)',
+            (user_id, session_id, now, now)
+        )
+    _start_purger()
+    _hot_sessions.set((user_id, session_id), [])
+    return session_id
+
+
+def get_history(user_id, session_id):
+    """
+    取得對話的完整訊息（先查記憶體，未命中再從 SQLite 載入）
+
+    :return: [{"role": ..., "content": ...}, ...]
+    :raises SessionNotFoundError: 對話不存在
+    """
+    key = (user_id, session_id)
+    messages = _hot_sessions.get(key)
+    if messages is None:
+        with _connect() as conn:
+            exists = conn.execute(
+                'SELECT 1 FROM chat_sessions WHERE user_id = ? AND session_id = ?', key
+            ).fetchone()
+            if not exists:
+                raise SessionNotFoundError(f'找不到對話 {session_id}')
+            rows = conn.execute(
+                'SELECT role, content FROM chat_messages WHERE user_id = ? AND session_id = ? ORDER BY seq', key
+            ).fetchall()
+        messages = [{'role': row['role'], 'content': row['content']} for row in rows]
+
+    # 重新寫入以延長閒置期限
+    _hot_sessions.set(key, messages)
+    return list(messages)
+
+
+def append_messages(user_id, session_id, new_messages):
+    """
+    以附加方式寫入新訊息（不會改寫既有訊息）
+
+    :param new_messages: [{"role": ..., "content": ...}, ...]
+    :raises SessionNotFoundError: 對話不存在
+    """
+    key = (user_id, session_id)
+    now = time.time()
+    with _write_lock, _connect() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            updated = conn.execute(
+                'UPDATE chat_sessions SET last_active = ? WHERE user_id = ? AND session_id = ?',
+                (now, user_id, session_id)
+            ).rowcount
+            if not updated:
+                raise SessionNotFoundError(f'找不到對話 {session_id}')
+
+            last_seq = conn.execute(
+                'SELECT COALESCE(MAX(seq), 0) FROM chat_messages WHERE user_id = ? AND session_id = ?', key
+            ).fetchone()[0]
+            conn.executemany(
+                'INSERT INTO chat_messages (user_id, session_id, seq, role, content, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(user_id, session_id, last_seq + i, msg['role'], msg['content'], now)
+                 for i, msg in enumerate(new_messages, 1)]
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        cached = _hot_sessions.get(key)
+        if cached is not None:
+            _hot_sessions.set(key, cached + [{'role': m['role'], 'content': m['content']} for m in new_messages])
+
+
+def get_messages_page(user_id, session_id, before=None, limit=50):
+    """
+    分頁讀取對話訊息（由新到舊翻頁，每頁內依時間排序）
+
+    :param before: 只取 seq 小於此值的訊息（上一頁回傳的 next_cursor）
+    :param limit: 每頁筆數
+    :return: {"messages": [...], "next_cursor": 下一頁游標或 None}
+    :raises SessionNotFoundError: 對話不存在
+    """
+    with _connect() as conn:
+        exists = conn.execute(
+            'SELECT 1 FROM chat_sessions WHERE user_id = ? AND session_id = ?', (user_id, session_id)
+        ).fetchone()
+        if not exists:
+            raise SessionNotFoundError(f'找不到對話 {session_id}')
+
+        rows = conn.execute(
+            'SELECT seq, role, content, created_at FROM chat_messages '
+            'WHERE user_id = ? AND session_id = ? AND seq < ? ORDER BY seq DESC LIMIT ?',
+            (user_id, session_id, before if before is not None else 2 ** 62, limit + 1)
+        ).fetchall()
+
+    has_more = len(rows) > limit
+    rows = list(reversed(rows[:limit]))
+    return {
+        'messages': [
+            {
+                'seq': row['seq'],
+                'role': row['role'],
+                'content': row['content'],
+                'createdAt': datetime.utcfromtimestamp(row['created_at']).isoformat()
+            }
+            for row in rows
+        ],
+        'next_cursor': rows[0]['seq'] if has_more and rows else None
+    }
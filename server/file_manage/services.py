@@ -2,12 +2,24 @@ import os
 from datetime import datetime
 from firebase_admin import firestore
 from werkzeug.utils import secure_filename
+from utils.firestore_queries import user_collection_group, paginate
+from utils.etag import bump_versions
+from utils.read_cache import invalidate, files_tag
 
 UPLOAD_FOLDER = 'uploads'  # 存檔案的資料夾
+FILES_PAGE_MAX = int(os.getenv('FILES_PAGE_MAX', '100'))
+
+def goal_accepts_files(db, user_id, goal_id):
+    """目標存在且未標記刪除（等待背景清除的目標不再列出或接收檔案）"""
+    goal = db.collection(f'users/{user_id}/goalBreakdown').document(goal_id).get(field_paths=['deletedAt'])
+    return goal.exists and not (goal.to_dict() or {}).get('deletedAt')
+
 
 def upload_file_to_goal_service(user_id, goal_id, title, file):
     try:
         db = firestore.client()
+        if not goal_accepts_files(db, user_id, goal_id):
+            return {'error': '目標不存在'}, 404
 
         # 確認資料夾存在，沒有就建立
         if not os.path.exists(UPLOAD_FOLDER):
@@ -32,10 +44,91 @@ def upload_file_to_goal_service(user_id, goal_id, title, file):
             'storageType': 'local'
         }
 
-        files_ref = db.collection(f'users/{user_id}/goalBreakdown/{goal_id}/files')
-        files_ref.add(file_data)
+        batch = db.batch()
+        batch.set(db.collection(f'users/{user_id}/goalBreakdown/{goal_id}/files').document(), file_data)
+        bump_versions(batch, db, user_id, 'files')
+        batch.commit()
+        invalidate(files_tag(user_id))
 
         return {'message': '檔案已成功儲存並寫入資料庫'}, 200
 
     except Exception as e:
-        return {'error': str(e)}, 500
\ No newline at end of file
+        return {'error': str(e)}, 500
+
+_GONE = object()  # 不存在或已標記刪除的目標
+
+
+def _load_goal_names(db, user_id, goal_ids, goal_names):
+    """
+    以一次 get_all 讀取尚未查過的目標名稱，寫入 goal_names
+
+    :param goal_names: {目標ID: eventName}；不存在或已標記刪除的目標記為 _GONE
+    """
+    missing = [goal_id for goal_id in dict.fromkeys(goal_ids) if goal_id not in goal_names]
+    if not missing:
+        return
+    goals_ref = db.collection(f'users/{user_id}/goalBreakdown')
+    for goal_doc in db.get_all([goals_ref.document(goal_id) for goal_id in missing],
+                               field_paths=['eventName', 'deletedAt']):
+        goal_data = (goal_doc.to_dict() or {}) if goal_doc.exists else None
+        goal_names[goal_doc.id] = _GONE if goal_data is None or goal_data.get('deletedAt') \
+            else goal_data.get('eventName')
+
+
+def get_all_files_service(user_id, limit=None, cursor=None):
+    """
+    取得使用者所有目標下的檔案（新上傳的在前）
+
+    以單一 collection group 查詢在 Firestore 端依 uploadTime 排序，只讀取出現在結果中的
+    目標名稱；已刪除目標留下的檔案在分頁截斷前就被略過，不佔頁面名額。
+
+    :param limit: 每頁筆數；指定時回傳 nextCursor
+    :param cursor: 上一頁回傳的 nextCursor
+    """
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            return {'error': 'limit 必須為整數'}, 400
+        if not 1 <= limit <= FILES_PAGE_MAX:
+            return {'error': f'limit 必須介於 1 到 {FILES_PAGE_MAX}'}, 400
+
+    try:
+        db = firestore.client()
+        query = (user_collection_group(db, user_id, 'goalBreakdown', 'files')
+                 .order_by('uploadTime', direction=firestore.Query.DESCENDING))
+
+        goal_names = {}
+
+        def live_files(file_docs):
+            # 已標記刪除的目標視同不存在，其檔案一併略過
+            _load_goal_names(db, user_id, [doc.reference.parent.parent.id for doc in file_docs], goal_names)
+            return [doc for doc in file_docs if goal_names[doc.reference.parent.parent.id] is not _GONE]
+
+        next_cursor = None
+        if limit is not None:
+            try:
+                files_docs, next_cursor = paginate(db, query, user_id, limit, cursor, filter_docs=live_files)
+            except ValueError as e:
+                return {'error': str(e)}, 400
+        else:
+            files_docs = live_files(list(query.stream()))
+
+        files = []
+        for doc in files_docs:
+            goal_id = doc.reference.parent.parent.id
+            file_data = doc.to_dict()
+            file_data['id'] = doc.id
+            file_data['goalId'] = goal_id
+            file_data['goalName'] = goal_names[goal_id]
+            if file_data.get('uploadTime'):
+                file_data['uploadTime'] = file_data['uploadTime'].isoformat()
+            files.append(file_data)
+
+        result = {'files': files}
+        if limit is not None:
+            result['nextCursor'] = next_cursor
+        return result, 200
+
+    except Exception as e:
+        return {'error': str(e)}, 500
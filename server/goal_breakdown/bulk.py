@@ -0,0 +1,277 @@
+# goal_breakdown/bulk.py
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from firebase_admin import firestore
+
+from goal_breakdown.fast_decomposer import FAST_MODES
+from goal_breakdown.services import (
+    validate_goal_data,
+    prepare_tasks,
+    fast_breakdown,
+    build_goal_doc,
+    build_task_doc,
+    SEARCH_TIMEOUT,
+    FIRESTORE_BATCH_LIMIT,
+    GOAL_COLLECTIONS,
+)
+from llm_model.circuit_breaker import mistral_breaker
+from llm_model.context_builder import count_tokens
+from llm_model.llm_services import generate_packed_structured_output
+from llm_server.google_search import get_learning_links_from_google
+from utils.concurrency import start_branch
+from utils.etag import bump_versions
+from utils.read_cache import invalidate, goals_tag
+
+BULK_MAX_GOALS = int(os.getenv('BULK_MAX_GOALS', '200'))
+BULK_WORKERS = int(os.getenv('BULK_WORKERS', '4'))                        # 同時進行的 LLM 拆解數
+BULK_PACK_MAX_GOALS = int(os.getenv('BULK_PACK_MAX_GOALS', '5'))          # 一次 LLM 呼叫最多合併幾個目標
+BULK_PACK_TOKEN_BUDGET = int(os.getenv('BULK_PACK_TOKEN_BUDGET', '6000'))  # 合併呼叫的輸入 + 預估輸出 token 上限
+BULK_SMALL_GOAL_TOKENS = int(os.getenv('BULK_SMALL_GOAL_TOKENS', '300'))  # 描述在此 token 數以下才視為可合併的小目標
+
+_TOKENS_PER_TASK = 40       # 每個輸出任務的預估 token 數
+_PROMPT_OVERHEAD_TOKENS = 600  # 合併提示詞本身（規則、結構、習慣）
+
+
+class BulkValidationError(ValueError):
+    """批次內有無效的目標，附帶各筆的錯誤"""
+
+    def __init__(self, errors):
+        super().__init__('批次中有無效的目標')
+        self.errors = errors
+
+
+def _parse_ndjson(text):
+    """每行一個目標"""
+    goals = []
+    for line_no, line in enumerate(text.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            goals.append(json.loads(line))
+        except json.JSONDecodeError:
+            raise ValueError(f"第 {line_no} 行不是有效的 JSON")
+    return goals
+
+
+def parse_bulk_body(raw, content_type):
+    """
+    解析批次請求內容：JSON 陣列、{"goals": [...]} 或 NDJSON（每行一個目標）
+
+    依 Content-Type 判斷：*ndjson* 逐行解析，application/json 整份解析；
+    未指定或其他類型時先整份解析，失敗再逐行解析。
+
+    :raises ValueError: 內容無法解析
+    """
+    text = raw.decode('utf-8') if isinstance(raw, bytes) else raw
+    content_type = (content_type or '').lower()
+    if 'ndjson' in content_type:
+        return _parse_ndjson(text)
+
+    is_json = 'json' in content_type
+    try:
+        body = json.loads(text)
+    except json.JSONDecodeError as e:
+        if is_json:
+            raise ValueError(f"JSON 解析失敗: {str(e)}")
+        return _parse_ndjson(text)
+
+    if isinstance(body, dict) and 'goals' in body:
+        goals = body['goals']
+    elif isinstance(body, dict) and not is_json:
+        # 未標示類型、只有一行的 NDJSON
+        goals = [body]
+    else:
+        goals = body
+    if not isinstance(goals, list):
+        raise ValueError("請求內容必須為目標陣列")
+    return goals
+
+
+def validate_bulk_goals(goals):
+    """
+    在開始任何拆解前驗證全部目標
+
+    :raises BulkValidationError: 任一目標無效（附上每筆的索引與錯誤）
+    """
+    if not goals:
+        raise ValueError("批次中沒有任何目標")
+    if len(goals) > BULK_MAX_GOALS:
+        raise ValueError(f"單次最多匯入 {BULK_MAX_GOALS} 個目標")
+
+    errors = []
+    for index, goal in enumerate(goals):
+        try:
+            if not isinstance(goal, dict):
+                raise ValueError('目標必須為物件')
+            validate_goal_data(goal)
+        except ValueError as e:
+            errors.append({'index': index, 'error': str(e)})
+    if errors:
+        raise BulkValidationError(errors)
+
+
+def _estimate_tokens(goal, created_at):
+    """預估一個目標在合併呼叫中佔用的 token（輸入描述 + 預估輸出任務）"""
+    span_days = (datetime.strptime(goal['eventDeadLine'], "%Y-%m-%d") - created_at).days + 1
+    expected_tasks = max(1, min(span_days, 30))
+    return count_tokens(f"{goal['eventName']} {goal['eventDescription']}") + expected_tasks * _TOKENS_PER_TASK
+
+
+def _plan_units(goals, created_at):
+    """
+    把目標分組：小目標依 token 預算合併成一次 LLM 呼叫，大目標各自一組
+
+    :return: [[目標索引, ...], ...]
+    """
+    # 快速模式的目標不需要 LLM，只按數量分組
+    fast = [index for index, goal in enumerate(goals) if goal['eventMode'] in FAST_MODES]
+    units = [fast[i:i + BULK_PACK_MAX_GOALS] for i in range(0, len(fast), BULK_PACK_MAX_GOALS)]
+
+    pack, pack_tokens = [], _PROMPT_OVERHEAD_TOKENS
+    for index, goal in enumerate(goals):
+        if goal['eventMode'] in FAST_MODES:
+            continue
+        tokens = _estimate_tokens(goal, created_at)
+        if count_tokens(goal['eventDescription']) > BULK_SMALL_GOAL_TOKENS \
+                or tokens + _PROMPT_OVERHEAD_TOKENS > BULK_PACK_TOKEN_BUDGET:
+            units.append([index])
+            continue
+        if len(pack) >= BULK_PACK_MAX_GOALS or pack_tokens + tokens > BULK_PACK_TOKEN_BUDGET:
+            units.append(pack)
+            pack, pack_tokens = [], _PROMPT_OVERHEAD_TOKENS
+        pack.append(index)
+        pack_tokens += tokens
+    if pack:
+        units.append(pack)
+    return units
+
+
+def _decompose_unit(goals, indexes, created_at, user_habits):
+    """
+    拆解一組目標並取得學習資源，LLM 失敗或斷路器斷開的目標改用本地規則拆解
+
+    :return: [(目標索引, 拆解結果, generator, learningLinks), ...]
+    """
+    # 搜尋只在處理該組時送出，避免一次佔滿共用的 I/O 執行緒池
+    search_branches = [
+        start_branch('google_search', get_learning_links_from_google,
+                     f"{goals[i]['eventName']} {goals[i]['eventDescription']}", max_results=3)
+        for i in indexes
+    ]
+
+    if goals[indexes[0]]['eventMode'] in FAST_MODES:
+        responses = [{'error': '快速模式'}] * len(indexes)
+    elif mistral_breaker.is_open:
+        responses = [{'error': '斷路器已斷開'}] * len(indexes)
+    else:
+        responses = generate_packed_structured_output([goals[i] for i in indexes], created_at, user_habits)
+
+    outcomes = []
+    for index, response, branch in zip(indexes, responses, search_branches):
+        if 'error' in response:
+            if goals[index]['eventMode'] not in FAST_MODES:
+                logging.warning(f"批次目標 #{index} LLM 拆解失敗: {response['error']}，改用快速拆解")
+            response, generator = fast_breakdown(goals[index], created_at, user_habits), 'rule_based'
+        else:
+            generator = 'llm'
+        learning_links = branch.result(timeout=SEARCH_TIMEOUT, default=[])
+        outcomes.append((index, response, generator, learning_links))
+    return outcomes
+
+
+def _commit_chunked(db, user_id, writes):
+    """
+    以每批至多 500 筆的 Firestore batch 提交寫入，每批同時遞增 goals 版本
+
+    :return: 最後一批的提交時間
+    """
+    commit_time = None
+    chunk_size = FIRESTORE_BATCH_LIMIT - 1  # 保留一筆給版本計數器
+    for start in range(0, len(writes), chunk_size):
+        batch = db.batch()
+        for ref, data in writes[start:start + chunk_size]:
+            batch.set(ref, data)
+        bump_versions(batch, db, user_id, 'goals')
+        batch.commit()
+        commit_time = batch.commit_time
+    return commit_time
+
+
+def bulk_create_goals(user_id, goals):
+    """
+    批次建立目標；逐一產生每個目標的結果（完成一組就送出一組）
+
+    呼叫前需先以 validate_bulk_goals 驗證。
+
+    :return: 產生 {"index", "status", "id", "taskCount", "generator"} 或
+        {"index", "status", "error"}，最後產生 {"done": True, "created", "failed"}
+    """
+    created_at = datetime.utcnow()
+    db = firestore.client()
+
+    # 習慣只讀一次，供所有目標共用
+    from working_habits.services import get_working_habits
+    try:
+        user_habits = get_working_habits(user_id)
+    except Exception as e:
+        logging.warning(f"讀取使用者習慣失敗，不帶習慣繼續: {str(e)}")
+        user_habits = []
+
+    counts = {'created': 0, 'failed': 0}
+
+    def write_outcomes(outcomes):
+        """寫入一組完成的目標（任務在前、主文檔在後），並回傳各目標的結果"""
+        writes, results = [], []
+        for index, response, generator, learning_links in outcomes:
+            goal = goals[index]
+            tasks = prepare_tasks(response.get('tasks', []), datetime.strptime(goal['eventDeadLine'], "%Y-%m-%d"))
+            main_doc_ref = db.collection(f'users/{user_id}/goalBreakdown').document()
+            for order, (task, due_date) in enumerate(tasks, 1):
+                writes.append((main_doc_ref.collection('tasks').document(f'task{order:03}'),
+                               build_task_doc(task, due_date, order, main_doc_ref.id)))
+            writes.append((main_doc_ref, build_goal_doc(goal, len(tasks), learning_links, generator, tasks)))
+            results.append({
+                'index': index,
+                'status': 201,
+                'id': main_doc_ref.id,
+                'taskCount': len(tasks),
+                'generator': generator
+            })
+        commit_time = None
+        try:
+            commit_time = _commit_chunked(db, user_id, writes)
+        except Exception as e:
+            logging.error(f"批次寫入失敗: {str(e)}", exc_info=True)
+            return [{'index': r['index'], 'status': 500, 'error': f'寫入失敗: {str(e)}'} for r in results]
+        finally:
+            # 分塊寫入失敗時也可能已寫入部分目標（此時沒有提交時間）
+            invalidate(goals_tag(user_id), commit_time=commit_time, collections=GOAL_COLLECTIONS)
+        return results
+
+    def emit(results):
+        for result in results:
+            counts['created' if result['status'] == 201 else 'failed'] += 1
+        return results
+
+    units = _plan_units(goals, created_at)
+    pool = ThreadPoolExecutor(max_workers=BULK_WORKERS, thread_name_prefix='bulk-goal')
+    try:
+        futures = {pool.submit(_decompose_unit, goals, unit, created_at, user_habits): unit for unit in units}
+        for future in as_completed(futures):
+            try:
+                outcomes = future.result()
+            except Exception as e:
+                logging.error(f"批次拆解失敗: {str(e)}", exc_info=True)
+                yield from emit([{'index': i, 'status': 500, 'error': f'伺服器錯誤: {str(e)}'}
+                                 for i in futures[future]])
+                continue
+            yield from emit(write_outcomes(outcomes))
+    finally:
+        # 用戶端中途斷線時，取消尚未開始的拆解
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    yield {'done': True, **counts}
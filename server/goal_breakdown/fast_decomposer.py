@@ -0,0 +1,114 @@
+# goal_breakdown/fast_decomposer.py
+import re
+from datetime import datetime, timedelta
+
+# 觸發快速拆解的 eventMode
+FAST_MODES = ('instant', 'fast', '快速')
+
+# 各種頻率描述對應的每週任務數
+_WEEKLY_FREQUENCY = {
+    'low': 1,
+    'medium': 3,
+    'high': 7,
+    '不規律，偶爾進行': 0.5,
+    '每月1-2次': 0.35,
+    '每月3-4次': 0.8,
+    '每週1次': 1,
+    '每週2-3次': 2.5,
+    '每週4-5次': 4.5,
+    '每天1次': 7,
+    '每天2次': 7,
+    '每天多次': 7,
+    '每天3次以上': 7,
+}
+_INTENSITY_FACTOR = {'low': 0.75, 'medium': 1.0, 'high': 1.25}
+DEFAULT_WEEKLY_TASKS = 3
+MIN_TASKS = 3
+MAX_TASKS = 60
+
+# 各階段：(名稱, 佔整體時程比例, 優先級)
+_PHASES = (
+    ('準備', 0.2, 'high'),
+    ('執行', 0.6, 'medium'),
+    ('檢討', 0.2, 'low'),
+)
+
+
+def _weekly_tasks(user_habits):
+    """從使用者習慣推算每週的任務數"""
+    rates = []
+    factors = []
+    for habit in user_habits or []:
+        frequency = habit.get('frequency') or habit.get('ideal_working_f') or habit.get('current_working_F')
+        if frequency in _WEEKLY_FREQUENCY:
+            rates.append(_WEEKLY_FREQUENCY[frequency])
+        if habit.get('intensity') in _INTENSITY_FACTOR:
+            factors.append(_INTENSITY_FACTOR[habit['intensity']])
+
+    rate = sum(rates) / len(rates) if rates else DEFAULT_WEEKLY_TASKS
+    factor = sum(factors) / len(factors) if factors else 1.0
+    return rate * factor
+
+
+def _split_description(event_description):
+    """把描述切成幾個重點，作為執行階段的任務主題"""
+    parts = [p.strip() for p in re.split(r'[，,。;；\n、]+', event_description or '') if p.strip()]
+    return parts or [None]
+
+
+def generate_fast_breakdown(event_name, event_deadline, created_at, event_description, user_habits=None):
+    """
+    不呼叫 LLM，以規則在毫秒內產生任務骨架（輸出格式同 generate_structured_output）
+
+    依使用者習慣的頻率與強度決定任務數，平均分布於創建日期與截止日期之間，
+    並依階段（準備/執行/檢討）指定優先級，最後一個任務固定為高優先級的收尾任務。
+
+    :param event_name: 目標名稱
+    :param event_deadline: 截止日期 (格式: YYYY-MM-DD)
+    :param created_at: 目標創建時間 (datetime物件)
+    :param event_description: 目標詳細描述
+    :param user_habits: 使用者的習慣列表
+    :return: {"tasks": [...]}
+    """
+    deadline_date = datetime.strptime(event_deadline, "%Y-%m-%d").date()
+    created_date = created_at.date()
+    span_days = (deadline_date - created_date).days
+    if span_days <= 0:
+        raise ValueError("截止日期必須晚於創建時間")
+
+    # 任務數：依每週頻率換算，至多一天一個任務
+    count = round(_weekly_tasks(user_habits) * span_days / 7)
+    count = min(max(MIN_TASKS, min(MAX_TASKS, count)), span_days + 1)
+
+    topics = _split_description(event_description)
+    tasks = []
+    previous_name = None
+    phase_start = 0.0
+    for phase_name, share, priority in _PHASES:
+        phase_end = phase_start + share
+        first = round(count * phase_start)
+        last = round(count * phase_end)
+        for order in range(first, last):
+            topic = topics[(order - first) % len(topics)] if phase_name == '執行' else None
+            step = order - first + 1
+            if topic:
+                task_name = f"{phase_name}：{topic}（{event_name} 第 {step} 部分）"
+            else:
+                task_name = f"{phase_name}：{event_name}（第 {step} 部分）"
+
+            due_date = created_date + timedelta(days=round(span_days * (order + 1) / count))
+            tasks.append({
+                'task_name': task_name,
+                'due_date': due_date.strftime('%Y-%m-%d'),
+                'priority': priority,
+                'dependencies': [previous_name] if previous_name else [],
+            })
+            previous_name = task_name
+        phase_start = phase_end
+
+    # 最後一個任務改為收尾交付，並提高優先級
+    tasks[-1]['task_name'] = f"完成並交付：{event_name}"
+    tasks[-1]['priority'] = 'high'
+    tasks[-1]['due_date'] = deadline_date.strftime('%Y-%m-%d')
+
+    return {'tasks': tasks}
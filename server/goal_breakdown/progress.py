@@ -0,0 +1,252 @@
+# goal_breakdown/progress.py
+import logging
+from datetime import datetime
+
+from firebase_admin import firestore
+
+from utils.etag import bump_versions
+from utils.read_cache import invalidate, goals_tag, goal_tag
+
+COMPLETED = 'completed'
+
+# 目標主文檔上的進度欄位
+#   completedTasks / pendingTasks：已完成 / 未完成的任務數
+#   pendingByDue：{截止日 YYYY-MM-DD: 未完成任務數}，讀取時據此算出 overdueTasks
+#   completedByDay：{完成日 YYYY-MM-DD: 完成任務數}
+PROGRESS_FIELDS = ('completedTasks', 'pendingTasks', 'pendingByDue', 'completedByDay')
+
+_BACKFILL_BATCH = 500  # 補寫任務 goalId 時每個 batch 的寫入數（含版本計數器）
+
+
+def day_key(value):
+    """日期的分桶鍵（UTC 日期）"""
+    return value.strftime('%Y-%m-%d')
+
+
+def initial_progress(tasks):
+    """
+    新建目標時的進度欄位（所有任務皆為未完成）
+
+    :param tasks: prepare_tasks 的結果 [(任務, due_date), ...]
+    """
+    pending_by_due = {}
+    for _, due_date in tasks:
+        key = day_key(due_date)
+        pending_by_due[key] = pending_by_due.get(key, 0) + 1
+    return {
+        'completedTasks': 0,
+        'pendingTasks': len(tasks),
+        'pendingByDue': pending_by_due,
+        'completedByDay': {},
+    }
+
+
+def added_tasks_delta(due_dates):
+    """
+    追加未完成任務時要合併寫入目標文檔的遞增量（用於 set(..., merge=True)）
+    """
+    pending_by_due = {}
+    for due_date in due_dates:
+        key = day_key(due_date)
+        pending_by_due[key] = pending_by_due.get(key, 0) + 1
+    return {
+        'pendingTasks': firestore.Increment(len(due_dates)),
+        'pendingByDue': {key: firestore.Increment(count) for key, count in pending_by_due.items()},
+    }
+
+
+def status_change_counts(task_data, new_status, now):
+    """
+    任務狀態改變時，目標進度欄位的變化量與任務本身要寫入的欄位
+
+    只有在「完成」與「未完成」之間切換才影響計數器。
+
+    :param task_data: 任務目前的資料（需含 status、due_date，已完成的任務另有 completedAt）
+    :return: (變化量 {"completedTasks": 1, "pendingByDue": {日期: -1}, ...} 或 None, 任務的更新欄位)
+    """
+    was_completed = task_data.get('status') == COMPLETED
+    is_completed = new_status == COMPLETED
+    task_update = {'status': new_status}
+    if was_completed == is_completed:
+        return None, task_update
+
+    sign = 1 if is_completed else -1
+    counts = {'completedTasks': sign, 'pendingTasks': -sign}
+    due_date = task_data.get('due_date')
+    if due_date:
+        counts['pendingByDue'] = {day_key(due_date): -sign}
+
+    if is_completed:
+        task_update['completedAt'] = now
+        counts['completedByDay'] = {day_key(now): 1}
+    else:
+        task_update['completedAt'] = firestore.DELETE_FIELD
+        completed_at = task_data.get('completedAt')
+        if completed_at:
+            counts['completedByDay'] = {day_key(completed_at): -1}
+    return counts, task_update
+
+
+def blind_status_update(new_status, now):
+    """
+    不讀取任務時的更新欄位（不維護計數器的目標使用）
+
+    無法得知原本是否已完成，標記完成時一律以 now 作為 completedAt。
+    """
+    if new_status == COMPLETED:
+        return {'status': new_status, 'completedAt': now}
+    return {'status': new_status, 'completedAt': firestore.DELETE_FIELD}
+
+
+def add_counts(total, counts):
+    """把一筆變化量累加到 total（同一批多個任務合併成一次目標文檔寫入）"""
+    for field, value in counts.items():
+        if isinstance(value, dict):
+            bucket = total.setdefault(field, {})
+            for key, count in value.items():
+                bucket[key] = bucket.get(key, 0) + count
+        else:
+            total[field] = total.get(field, 0) + value
+    return total
+
+
+def as_increments(counts):
+    """變化量轉為 firestore.Increment（用於 set(..., merge=True)），略過為 0 的項目"""
+    delta = {}
+    for field, value in counts.items():
+        if isinstance(value, dict):
+            bucket = {key: firestore.Increment(count) for key, count in value.items() if count}
+            if bucket:
+                delta[field] = bucket
+        elif value:
+            delta[field] = firestore.Increment(value)
+    return delta
+
+
+def status_change_delta(task_data, new_status, now):
+    """
+    任務狀態改變時，目標文檔的遞增量與任務本身要寫入的欄位
+
+    :return: (目標文檔的遞增量或 None, 任務的更新欄位)
+    """
+    counts, task_update = status_change_counts(task_data, new_status, now)
+    return (as_increments(counts) if counts else None), task_update
+
+
+def with_overdue(goal_data, today=None):
+    """
+    依 pendingByDue 算出 overdueTasks（截止日早於今天的未完成任務數）
+
+    逾期與否隨時間改變，無法在寫入時維護，因此在讀取時計算。
+    """
+    pending_by_due = goal_data.get('pendingByDue')
+    if isinstance(pending_by_due, dict):
+        today_key = day_key(today or datetime.utcnow())
+        goal_data['overdueTasks'] = sum(count for key, count in pending_by_due.items() if key < today_key and count > 0)
+    return goal_data
+
+
+# ---------- 修復 ----------
+
+def count_progress(task_docs):
+    """由任務文件重新計算進度欄位"""
+    progress = {'completedTasks': 0, 'pendingTasks': 0, 'pendingByDue': {}, 'completedByDay': {}}
+    for task_doc in task_docs:
+        task = task_doc.to_dict()
+        if task.get('status') == COMPLETED:
+            progress['completedTasks'] += 1
+            if task.get('completedAt'):
+                key = day_key(task['completedAt'])
+                progress['completedByDay'][key] = progress['completedByDay'].get(key, 0) + 1
+        else:
+            progress['pendingTasks'] += 1
+            if task.get('due_date'):
+                key = day_key(task['due_date'])
+                progress['pendingByDue'][key] = progress['pendingByDue'].get(key, 0) + 1
+    return progress
+
+
+def _comparable(progress):
+    """比較用：分桶中計數為 0 的鍵視同不存在"""
+    return {
+        field: ({key: count for key, count in (progress.get(field) or {}).items() if count}
+                if field in ('pendingByDue', 'completedByDay') else progress.get(field))
+        for field in PROGRESS_FIELDS
+    }
+
+
+def recount_goal_progress(db, user_id, goal_id):
+    """
+    重新計算一個目標的進度欄位，與現存值不同時覆寫
+
+    在交易中讀取任務與目標，避免與同時進行的狀態更新互相覆蓋。
+    順便為舊任務補上 goalId（分頁的目標列表以它查詢任務）。
+
+    :return: (是否有修正, 補上 goalId 的任務數)
+    """
+    goal_ref = db.collection(f'users/{user_id}/goalBreakdown').document(goal_id)
+    tasks_query = goal_ref.collection('tasks').select(['status', 'due_date', 'completedAt', 'goalId'])
+
+    @firestore.transactional
+    def recount(transaction):
+        goal_doc = goal_ref.get(transaction=transaction)
+        if not goal_doc.exists:
+            return False, []
+        task_docs = list(tasks_query.stream(transaction=transaction))
+        progress = count_progress(task_docs)
+        drifted = _comparable(goal_doc.to_dict()) != _comparable(progress)
+        if drifted:
+            # 以 update 整個覆寫兩個分桶欄位，清掉殘留的鍵
+            transaction.update(goal_ref, progress)
+            bump_versions(transaction, db, user_id, 'goals')
+        return drifted, [doc.reference for doc in task_docs if doc.to_dict().get('goalId') != goal_id]
+
+    transaction = db.transaction()
+    drifted, missing_goal_id = recount(transaction)
+    if drifted:
+        invalidate(goals_tag(user_id), goal_tag(user_id, goal_id),
+                   commit_time=getattr(transaction, 'commit_time', None), collections=('goalBreakdown',))
+    if missing_goal_id:
+        _backfill_goal_id(db, user_id, goal_id, missing_goal_id)
+    return drifted, len(missing_goal_id)
+
+
+def _backfill_goal_id(db, user_id, goal_id, task_refs):
+    """為缺少 goalId 的任務補上欄位（任務已被刪除時整批失敗，交由下次修復重試）"""
+    chunk_size = _BACKFILL_BATCH - 1
+    for start in range(0, len(task_refs), chunk_size):
+        batch = db.batch()
+        for ref in task_refs[start:start + chunk_size]:
+            batch.update(ref, {'goalId': goal_id})
+        bump_versions(batch, db, user_id, 'goals')
+        batch.commit()
+        invalidate(goals_tag(user_id), goal_tag(user_id, goal_id),
+                   commit_time=batch.commit_time, collections=('goalBreakdown/tasks',))
+
+
+def repair_progress_service(user_id, payload):
+    """
+    背景任務：重新計算使用者所有目標（或指定目標）的進度欄位，並補上舊任務的 goalId
+
+    :param payload: {"goalIds": [...]}，省略時處理全部目標
+    :return: ({"checked", "repaired", "backfilledTasks", "failed"}, 200)
+    """
+    db = firestore.client()
+    goal_ids = (payload or {}).get('goalIds')
+    if not goal_ids:
+        goal_ids = [doc.id for doc in db.collection(f'users/{user_id}/goalBreakdown').select([]).stream()]
+
+    repaired, failed, backfilled = [], [], 0
+    for goal_id in goal_ids:
+        try:
+            drifted, backfilled_tasks = recount_goal_progress(db, user_id, goal_id)
+            backfilled += backfilled_tasks
+            if drifted:
+                repaired.append(goal_id)
+        except Exception as e:
+            logging.error(f"目標 {goal_id} 進度重算失敗: {str(e)}", exc_info=True)
+            failed.append(goal_id)
+
+    if repaired:
+        logging.warning(f"使用者 {user_id} 有 {len(repaired)} 個目標的進度計數器已修正")
+    return {'checked': len(goal_ids), 'repaired': repaired, 'backfilledTasks': backfilled, 'failed': failed}, 200
@@ -0,0 +1,108 @@
+# goal_breakdown/purge.py
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from firebase_admin import firestore
+
+from file_manage.services import UPLOAD_FOLDER
+from job_queue.services import report_progress
+
+load_dotenv()
+
+GOAL_PURGE_CHUNK = int(os.getenv('GOAL_PURGE_CHUNK', '300'))                # 每輪查詢並刪除的文件數
+GOAL_PURGE_BLOB_WORKERS = int(os.getenv('GOAL_PURGE_BLOB_WORKERS', '4'))    # 同時刪除本機檔案的執行緒數
+GOAL_PURGE_WRITE_ATTEMPTS = int(os.getenv('GOAL_PURGE_WRITE_ATTEMPTS', '5'))  # 單筆刪除失敗時的嘗試次數
+
+
+def _remove_blob(file_data):
+    """
+    刪除上傳檔案在本機的實體檔案；檔案已不存在視為成功（清除中斷後重跑）
+
+    只刪除位於 uploads 資料夾、檔名與紀錄相符的檔案。
+
+    :return: 是否實際刪除了檔案
+    """
+    path = file_data.get('filePath')
+    if file_data.get('storageType') != 'local' or not path:
+        return False
+    if os.path.basename(path) != file_data.get('fileName') \
+            or os.path.basename(os.path.dirname(path)) != os.path.basename(UPLOAD_FOLDER):
+        logging.warning(f"略過不在上傳資料夾內的檔案: {path}")
+        return False
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _purge_collection(writer, failures, query, progress, key, before_delete=None):
+    """
+    分輪刪除一個子集合：每輪讀取 GOAL_PURGE_CHUNK 筆，交給 BulkWriter 並行刪除後 flush
+
+    :param before_delete: 刪除文件前對整輪文件執行的處理（如刪除實體檔案）
+    """
+    while True:
+        docs = list(query.limit(GOAL_PURGE_CHUNK).stream())
+        if not docs:
+            return
+        if before_delete is not None:
+            before_delete(docs)
+        for doc in docs:
+            writer.delete(doc.reference)
+        writer.flush()
+        if failures:
+            raise RuntimeError(f"{len(failures)} 筆刪除失敗: {failures[0].message}")
+        progress[key] += len(docs)
+        report_progress(progress)
+
+
+def purge_goal_service(user_id, payload):
+    """
+    背景任務：清除已標記刪除的目標，包含任務、檔案紀錄與上傳的實體檔案
+
+    每一步都只處理還存在的資料，中斷後重新執行會從剩下的部分繼續；
+    目標主文檔最後才刪除，在此之前讀取端都以 deletedAt 將其隱藏。
+
+    :param payload: {"goalId": 目標ID}
+    :return: ({"goalId", "tasks", "files", "blobs"}, 200)
+    """
+    goal_id = payload['goalId']
+    db = firestore.client()
+    goal_ref = db.collection(f'users/{user_id}/goalBreakdown').document(goal_id)
+
+    goal = goal_ref.get(field_paths=['deletedAt'])
+    if goal.exists and not (goal.to_dict() or {}).get('deletedAt'):
+        # 只清除已標記刪除的目標
+        return {'error': '目標未標記為刪除'}, 409
+
+    progress = {'goalId': goal_id, 'tasks': 0, 'files': 0, 'blobs': 0}
+    failures = []
+
+    def on_write_error(failure, _writer):
+        if failure.attempts < GOAL_PURGE_WRITE_ATTEMPTS:
+            return True
+        failures.append(failure)
+        return False
+
+    def remove_blobs(file_docs):
+        # 先刪實體檔案再刪紀錄，中斷時紀錄還在，重跑仍找得到檔案
+        with ThreadPoolExecutor(max_workers=GOAL_PURGE_BLOB_WORKERS) as executor:
+            progress['blobs'] += sum(executor.map(_remove_blob, [doc.to_dict() for doc in file_docs]))
+
+    writer = db.bulk_writer()
+    writer.on_write_error(on_write_error)
+    try:
+        _purge_collection(writer, failures, goal_ref.collection('files'), progress, 'files', remove_blobs)
+        _purge_collection(writer, failures, goal_ref.collection('tasks').select([]), progress, 'tasks')
+        writer.delete(goal_ref)
+        writer.flush()
+        if failures:
+            raise RuntimeError(f"刪除目標主文檔失敗: {failures[0].message}")
+    finally:
+        writer.close()
+
+    logging.info(f"目標 {goal_id} 已清除：{progress['tasks']} 個任務、{progress['files']} 個檔案")
+    return progress, 200
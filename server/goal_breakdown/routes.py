@@ -1,52 +1,192 @@
 # app/goal_breakdown/routes.py
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 from goal_breakdown.services import (
     create_goal_breakdown_service,
+    stream_goal_breakdown_service,
     get_tasks_service,
     get_all_goals_service,
     get_goal_service,
     update_task_status_service,
+    parse_task_status_updates,
+    bulk_update_task_status_service,
+    validate_goal_data,
 )
+from goal_breakdown.progress import repair_progress_service
+from goal_breakdown.purge import purge_goal_service
+from goal_breakdown.bulk import parse_bulk_body, validate_bulk_goals, bulk_create_goals, BulkValidationError
+from utils import live_view
+from utils.etag import conditional_get
+from utils.json_codec import json_response
+from utils.read_cache import cached_response, goals_tag, goal_tag
+from utils.sse import SSE_HEADERS
+from job_queue.services import register_job_handler, enqueue_job, wants_async, JobQueueFullError
 
+import json
 import logging
 
 breakdown_bp = Blueprint('goal', __name__)
 
+register_job_handler('goal_breakdown', create_goal_breakdown_service)
+register_job_handler('goal_progress_repair', repair_progress_service)
+register_job_handler('goal_purge', purge_goal_service)
+
 @breakdown_bp.route('/users/<string:user_id>/goal_breakdown', methods=['POST'])
 def create_goal_breakdown(user_id):
     data = request.json
+
+    # 非同步模式：先驗證，再交給背景 worker，立即回傳 202 與任務ID
+    if wants_async(request):
+        try:
+            validate_goal_data(data)
+            job_id = enqueue_job(user_id, 'goal_breakdown', data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except JobQueueFullError as e:
+            return jsonify({'error': str(e)}), 503
+        return jsonify({
+            'jobId': job_id,
+            'status': 'queued',
+            'statusUrl': f'/api/users/{user_id}/jobs/{job_id}'
+        }), 202
+
     result, status_code = create_goal_breakdown_service(user_id, data)
     return jsonify(result), status_code
 
+@breakdown_bp.route('/users/<string:user_id>/goal_breakdown/stream', methods=['POST'])
+def stream_goal_breakdown(user_id):
+    """
+    串流建立目標（SSE）：每個任務一產生就推送，同時分批寫入 Firestore
+
+    事件：goal（目標ID）、task（每個任務）、done（統計）、error
+    """
+    data = request.json
+    try:
+        validate_goal_data(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    events = stream_goal_breakdown_service(user_id, data)
+    return Response(stream_with_context(events), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+@breakdown_bp.route('/users/<string:user_id>/goal_breakdown/bulk', methods=['POST'])
+def bulk_create_goal_breakdown(user_id):
+    """
+    批次建立目標
+
+    請求內容為目標陣列（application/json）或每行一個目標（application/x-ndjson），
+    全部驗證通過才開始建立；回應以 NDJSON 逐行送出每個目標完成時的結果，最後一行為統計。
+    """
+    try:
+        goals = parse_bulk_body(request.get_data(), request.content_type)
+        validate_bulk_goals(goals)
+    except BulkValidationError as e:
+        return jsonify({'error': str(e), 'errors': e.errors}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def generate():
+        for result in bulk_create_goals(user_id, goals):
+            yield json.dumps(result, ensure_ascii=False) + '\n'
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers=SSE_HEADERS
+    )
+
+@breakdown_bp.route('/users/<string:user_id>/goal_breakdown/progress/repair', methods=['POST'])
+def repair_goal_progress(user_id):
+    """
+    以背景任務重新計算目標的進度計數器（completedTasks、pendingTasks 與分桶）
+
+    請求內容可帶 {"goalIds": [...]} 只處理指定目標，省略時處理全部目標。
+    """
+    payload = request.get_json(silent=True) or {}
+    goal_ids = payload.get('goalIds')
+    if goal_ids is not None and not (isinstance(goal_ids, list) and all(isinstance(i, str) for i in goal_ids)):
+        return jsonify({'error': 'goalIds 必須為字串陣列'}), 400
+    try:
+        job_id = enqueue_job(user_id, 'goal_progress_repair', {'goalIds': goal_ids})
+    except JobQueueFullError as e:
+        return jsonify({'error': str(e)}), 503
+    return jsonify({
+        'jobId': job_id,
+        'status': 'queued',
+        'statusUrl': f'/api/users/{user_id}/jobs/{job_id}'
+    }), 202
+
 @breakdown_bp.route('/users/<string:user_id>/goal_breakdown/<string:goal_id>/tasks', methods=['GET'])
+@conditional_get('goals')
 def get_tasks(user_id, goal_id):
     try:
-        result, status_code = get_tasks_service(user_id, goal_id)
-        return jsonify(result), status_code
+        live = live_view.read(user_id, 'tasks', goal_id)
+        if live is not None:
+            return json_response(live)
+        return cached_response(
+            ('tasks', user_id, goal_id), [goal_tag(user_id, goal_id)],
+            lambda: get_tasks_service(user_id, goal_id)
+        )
     except Exception as e:
         logging.error(f"Route Error: {str(e)}")
         return jsonify({'error': '伺服器錯誤'}), 500
 
 # 新增的路由 - 獲取所有目標及其任務
 @breakdown_bp.route('/users/<string:user_id>/goal_breakdown_all', methods=['GET'])
+@conditional_get('goals')
 def get_all_goals(user_id):
     try:
-        result, status_code = get_all_goals_service(user_id)
-        return jsonify(result), status_code
+        live = live_view.read(user_id, 'goals') if not request.args else None
+        if live is not None:
+            return json_response(live, stream_key='goals')
+        fields = request.args.get('fields')
+        return cached_response(
+            ('goals', user_id, tuple(sorted(request.args.items(multi=True)))), [goals_tag(user_id)],
+            lambda: get_all_goals_service(
+                user_id,
+                limit=request.args.get('limit'),
+                cursor=request.args.get('cursor'),
+                order_by=request.args.get('order_by'),
+                fields=fields.split(',') if fields is not None else None,
+                include_tasks=request.args.get('include_tasks', 'all')
+            ),
+            stream_key='goals'
+        )
     except Exception as e:
         logging.error(f"Route Error: {str(e)}")
         return jsonify({'error': '伺服器錯誤'}), 500
 
 # 新增的路由 - 獲取單個目標詳情
 @breakdown_bp.route('/users/<string:user_id>/goal_breakdown/<string:goal_id>', methods=['GET'])
+@conditional_get('goals')
 def get_goal(user_id, goal_id):
     try:
-        result, status_code = get_goal_service(user_id, goal_id)
-        return jsonify(result), status_code
+        live = live_view.read(user_id, 'goal', goal_id)
+        if live is not None:
+            return json_response(live)
+        return cached_response(
+            ('goal', user_id, goal_id), [goal_tag(user_id, goal_id)],
+            lambda: get_goal_service(user_id, goal_id)
+        )
     except Exception as e:
         logging.error(f"Route Error: {str(e)}")
         return jsonify({'error': '伺服器錯誤'}), 500
     
+@breakdown_bp.route('/users/<string:user_id>/goal_breakdown/<string:goal_id>/tasks', methods=['PATCH'])
+def bulk_update_task_status(user_id, goal_id):
+    """
+    批次更新任務狀態
+
+    請求內容為 [{"task_id": ..., "status": ...}, ...]（或 {"updates": [...]}），
+    回應依請求順序列出每筆的結果。
+    """
+    try:
+        updates = parse_task_status_updates(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    result, status_code = bulk_update_task_status_service(user_id, goal_id, updates)
+    return jsonify(result), status_code
+
 @breakdown_bp.route('/users/<string:user_id>/goal_breakdown/<string:goal_id>/tasks/<string:task_id>', methods=['PATCH'])
 def update_task_status(user_id, goal_id, task_id):
     try:
@@ -66,8 +206,22 @@ def update_task_status(user_id, goal_id, task_id):
 
 @breakdown_bp.route('/users/<string:user_id>/goal_breakdown/<string:goal_id>', methods=['DELETE'])
 def delete_goal(user_id, goal_id):
-    """刪除特定目標及其所有任務"""
+    """
+    刪除特定目標：立即標記為已刪除並回 202，任務、檔案與上傳的實體檔案由背景任務清除
+    """
     from goal_breakdown.services import delete_goal_service
 
     result, status_code = delete_goal_service(user_id, goal_id)
-    return jsonify(result), status_code
\ No newline at end of file
+    if status_code != 202:
+        return jsonify(result), status_code
+    try:
+        job_id = enqueue_job(user_id, 'goal_purge', {'goalId': goal_id})
+    except JobQueueFullError as e:
+        # 目標已標記刪除，稍後再次呼叫 DELETE 即可重新排入清除
+        return jsonify({'error': str(e)}), 503
+    return jsonify({
+        **result,
+        'jobId': job_id,
+        'status': 'queued',
+        'statusUrl': f'/api/users/{user_id}/jobs/{job_id}'
+    }), 202
\ No newline at end of file
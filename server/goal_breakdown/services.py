@@ -1,9 +1,60 @@
 # goal_breakdown/services.py
 from datetime import datetime
 from firebase_admin import firestore
-from llm_model.llm_services import generate_structured_output
+from google.api_core.exceptions import FailedPrecondition, NotFound
+from llm_model.llm_services import generate_structured_output, stream_structured_output
+from llm_model.circuit_breaker import mistral_breaker
+from goal_breakdown.fast_decomposer import generate_fast_breakdown, FAST_MODES
 from llm_server.google_search import get_learning_links_from_google
+from utils.concurrency import start_branch
+from goal_breakdown.progress import (
+    PROGRESS_FIELDS,
+    initial_progress,
+    added_tasks_delta,
+    status_change_counts,
+    status_change_delta,
+    blind_status_update,
+    add_counts,
+    as_increments,
+    with_overdue,
+)
+from utils.firestore_queries import user_collection_group, paginate
+from utils.read_cache import invalidate, goals_tag, goal_tag, files_tag
+from utils.etag import bump_versions
+from utils.sse import format_sse
 import logging
+import os
+
+# 各 I/O 分支的時間上限（秒）
+HABITS_TIMEOUT = float(os.getenv('GOAL_HABITS_TIMEOUT', '5'))
+SEARCH_TIMEOUT = float(os.getenv('GOAL_SEARCH_TIMEOUT', '8'))
+LLM_TIMEOUT = float(os.getenv('GOAL_LLM_TIMEOUT', '90'))
+
+# 串流拆解時每累積幾個任務寫入一次 Firestore
+STREAM_WRITE_BATCH = int(os.getenv('GOAL_STREAM_WRITE_BATCH', '5'))
+
+# 批次更新任務狀態
+TASK_UPDATE_MAX = int(os.getenv('TASK_UPDATE_MAX', '2000'))         # 單次請求最多更新的任務數
+TASK_UPDATE_ATTEMPTS = int(os.getenv('TASK_UPDATE_ATTEMPTS', '3'))  # 任務在讀取後被修改時，每批的嘗試次數
+FIRESTORE_BATCH_LIMIT = 500
+FIRESTORE_IN_LIMIT = 30  # 單一 in 篩選最多的值數
+_TASK_PROGRESS_FIELDS = ['status', 'due_date', 'completedAt']
+
+# 目標與其任務所在的集合（見 utils/read_cache.invalidate 的 collections）
+GOAL_COLLECTIONS = ('goalBreakdown', 'goalBreakdown/tasks')
+
+# 目標列表的分頁與投影
+GOALS_PAGE_MAX = int(os.getenv('GOALS_PAGE_MAX', '100'))
+GOAL_ORDER_FIELDS = {
+    'createdAt': firestore.Query.DESCENDING,
+    'eventDeadLine': firestore.Query.ASCENDING,
+}
+GOAL_LIST_FIELDS = (
+    'eventName', 'eventDeadLine', 'eventMode', 'eventDescription',
+    'createdAt', 'totalTasks', 'learningLinks', 'generator', 'generating',
+    *PROGRESS_FIELDS, 'overdueTasks'
+)
+INCLUDE_TASKS_MODES = ('all', 'summary', 'none')
 
 
 def validate_goal_data(data):
@@ -22,6 +73,75 @@ def validate_goal_data(data):
 
     return True
 
+def prepare_tasks(raw_tasks, deadline):
+    """
+    檢查任務結構並轉換日期，無效的任務記錄警告後略過
+
+    :param raw_tasks: LLM（或快速拆解）產生的任務列表
+    :param deadline: 目標截止日期 (datetime)
+    :return: [(任務字典, due_date datetime), ...]
+    """
+    prepared = []
+    required_task_fields = ['task_name', 'due_date', 'priority']
+    for index, task in enumerate(raw_tasks, 1):
+        if not all(field in task for field in required_task_fields):
+            logging.warning(f"任務 #{index} 缺少必要字段，已略過")
+            continue
+
+        try:
+            due_date = datetime.strptime(task['due_date'], "%Y-%m-%d")
+        except (TypeError, ValueError):
+            logging.warning(f"任務 #{index} 的日期格式無效，已略過")
+            continue
+
+        if due_date > deadline:
+            logging.warning(f"任務 #{index} 的截止日期晚於目標截止日期，已調整")
+            due_date = deadline
+
+        prepared.append((task, due_date))
+    return prepared
+
+def fast_breakdown(data, created_at, user_habits):
+    """以本地規則拆解目標（快速模式與 LLM 失敗時的備援）"""
+    return generate_fast_breakdown(
+        event_name=data['eventName'],
+        event_deadline=data['eventDeadLine'],
+        created_at=created_at,
+        event_description=data['eventDescription'],
+        user_habits=user_habits
+    )
+
+def build_goal_doc(data, task_count, learning_links, generator, tasks=()):
+    """
+    目標主文檔的資料
+
+    :param tasks: prepare_tasks 的結果，用來初始化進度計數器（串流建立時為空，之後逐批遞增）
+    """
+    return {
+        'eventName': data['eventName'],
+        'eventDeadLine': datetime.strptime(data['eventDeadLine'], "%Y-%m-%d"),
+        'eventMode': data['eventMode'],
+        'eventDescription': data['eventDescription'],
+        'createdAt': firestore.SERVER_TIMESTAMP,
+        'totalTasks': task_count,
+        "learningLinks":learning_links,
+        'generator': generator,
+        **initial_progress(tasks)
+    }
+
+def build_task_doc(task, due_date, index, goal_id):
+    """tasks 子集合中單一任務的資料（goalId 供 collection group 查詢依目標篩選）"""
+    return {
+        'goalId': goal_id,
+        'task_name': task['task_name'],
+        'due_date': due_date,
+        'priority': task['priority'].lower(),
+        'dependencies': task.get('dependencies', []),
+        'status': 'pending',
+        'order': index,
+        'createdAt': firestore.SERVER_TIMESTAMP
+    }
+
 def create_goal_breakdown_service(user_id, data):
     """同步處理流程（完整版）"""
 
@@ -30,27 +150,46 @@ def create_goal_breakdown_service(user_id, data):
         # 階段 1：強化驗證
         validate_goal_data(data)
 
-        # 獲取使用者習慣資料
-        from working_habits.services import get_working_habits
-        user_habits = get_working_habits(user_id)
-        print(user_habits)
-
-        # 階段 2：呼叫 LLM 生成任務
-        llm_response = generate_structured_output(
-            event_name=data['eventName'],
-            event_deadline=data['eventDeadLine'],
-            created_at=created_at,  # 傳入創建時間
-            event_description=data['eventDescription'],
-            user_habits=user_habits  # 傳入使用者習慣
-        )
-        
-        # 使用 eventName + eventDescription 組成搜尋查詢
+        # 搜尋只需要 eventName/eventDescription，先送出讓它與習慣讀取、LLM 呼叫重疊
         query = f"{data['eventName']} {data['eventDescription']}"
-        learning_links = get_learning_links_from_google(query, max_results=3)
-        # 處理 LLM 錯誤
-        if 'error' in llm_response:
-            logging.error(f"LLM Error: {llm_response['error']}")
-            raise ValueError(f"任務生成失敗: {llm_response['error']}")
+        search_branch = start_branch('google_search', get_learning_links_from_google, query, max_results=3)
+
+        # 獲取使用者習慣資料（失敗或逾時則不帶習慣繼續）
+        from working_habits.services import get_working_habits
+        habits_branch = start_branch('working_habits', get_working_habits, user_id)
+        user_habits = habits_branch.result(timeout=HABITS_TIMEOUT, default=[])
+        logging.debug(f"使用者習慣: {user_habits}")
+
+        # 階段 2：生成任務
+        # 「快速」模式或 LLM 斷路器斷開時，直接使用本地規則拆解
+        use_fast = data['eventMode'] in FAST_MODES or mistral_breaker.is_open
+        llm_response = None
+        if not use_fast:
+            llm_branch = start_branch(
+                'llm_generate',
+                generate_structured_output,
+                event_name=data['eventName'],
+                event_deadline=data['eventDeadLine'],
+                created_at=created_at,  # 傳入創建時間
+                event_description=data['eventDescription'],
+                user_habits=user_habits  # 傳入使用者習慣
+            )
+            llm_response = llm_branch.result(timeout=LLM_TIMEOUT, default={'error': '任務生成逾時'})
+
+            # LLM 失敗或逾時，改用本地規則拆解，避免使用者什麼都拿不到
+            if 'error' in llm_response:
+                logging.error(f"LLM Error: {llm_response['error']}，改用快速拆解")
+                use_fast = True
+
+        if use_fast:
+            llm_response = fast_breakdown(data, created_at, user_habits)
+        generator = 'rule_based' if use_fast else 'llm'
+
+        # 搜尋較慢或失敗時以空的 learningLinks 降級，不拖住目標建立
+        learning_links = search_branch.result(timeout=SEARCH_TIMEOUT, default=[])
+
+        # 個別無效的任務只略過，不讓整批失敗（LLM 輸出已先經本地修復）
+        tasks = prepare_tasks(llm_response.get('tasks', []), datetime.strptime(data['eventDeadLine'], "%Y-%m-%d"))
 
         # 階段 3：準備 Firestore 數據
         db = firestore.client()
@@ -59,54 +198,24 @@ def create_goal_breakdown_service(user_id, data):
 
         # 建立主文檔
         main_doc_ref = db.collection(f'users/{user_id}/goalBreakdown').document()
-        main_data = {
-            'eventName': data['eventName'],
-            'eventDeadLine': datetime.strptime(data['eventDeadLine'], "%Y-%m-%d"),
-            'eventMode': data['eventMode'],
-            'eventDescription': data['eventDescription'],
-            'createdAt': firestore.SERVER_TIMESTAMP,
-            'totalTasks': len(llm_response.get('tasks', [])),
-            "learningLinks":learning_links
-        }
-        batch.set(main_doc_ref, main_data)
+        batch.set(main_doc_ref, build_goal_doc(data, len(tasks), learning_links, generator, tasks))
 
         # 建立tasks子集合
-        tasks = llm_response.get('tasks', [])
-        for index, task in enumerate(tasks, 1):
-            # 驗證任務結構
-            required_task_fields = ['task_name', 'due_date', 'priority']
-            if not all(field in task for field in required_task_fields):
-                raise ValueError(f"任務 #{index} 缺少必要字段")
-
-            # 轉換日期格式
-            try:
-                due_date = datetime.strptime(task['due_date'], "%Y-%m-%d")
-                if due_date > main_data['eventDeadLine']:
-                    raise ValueError(f"任務 #{index} 的截止日期不得晚於目標截止日期")
-            except ValueError:
-                raise ValueError(f"任務 #{index} 的日期格式無效")
-
-            # 建立任務文檔
+        for index, (task, due_date) in enumerate(tasks, 1):
             task_doc_ref = main_doc_ref.collection('tasks').document(f'task{index:03}')
-            task_data = {
-                'task_name': task['task_name'],
-                'due_date': due_date,
-                'priority': task['priority'].lower(),
-                'dependencies': task.get('dependencies', []),
-                'status': 'pending',
-                'order': index,
-                'createdAt': firestore.SERVER_TIMESTAMP
-            }
-            batch.set(task_doc_ref, task_data)
+            batch.set(task_doc_ref, build_task_doc(task, due_date, index, main_doc_ref.id))
+        bump_versions(batch, db, user_id, 'goals')
 
         # 提交批次寫入
         batch.commit()
+        invalidate(goals_tag(user_id), commit_time=batch.commit_time, collections=GOAL_COLLECTIONS)
 
         return {
             'id': main_doc_ref.id,
             'taskCount': len(tasks),
-            'firstTaskDue': tasks[0]['due_date'] if tasks else None,
-            'learningLinks': learning_links
+            'firstTaskDue': tasks[0][0]['due_date'] if tasks else None,
+            'learningLinks': learning_links,
+            'generator': generator
         }, 201
 
     except ValueError as e:
@@ -118,28 +227,167 @@ def create_goal_breakdown_service(user_id, data):
 
 
 
+def stream_goal_breakdown_service(user_id, data):
+    """
+    串流版的目標拆解，回傳 SSE 文字產生器（呼叫前需先以 validate_goal_data 驗證）
+
+    先建立目標主文檔，LLM 每產生一個任務就推送給用戶端，並每 STREAM_WRITE_BATCH 個寫入一次；
+    全部完成（或用戶端斷線）後再更新 totalTasks 與 learningLinks。
+    LLM 在產生任何任務前失敗時，改用本地規則拆解。
+
+    事件：goal（目標ID）、task（每個任務）、done（統計）、error
+    """
+    created_at = datetime.utcnow()
+    query = f"{data['eventName']} {data['eventDescription']}"
+    search_branch = start_branch('google_search', get_learning_links_from_google, query, max_results=3)
+
+    from working_habits.services import get_working_habits
+    habits_branch = start_branch('working_habits', get_working_habits, user_id)
+    user_habits = habits_branch.result(timeout=HABITS_TIMEOUT, default=[])
+
+    deadline = datetime.strptime(data['eventDeadLine'], "%Y-%m-%d")
+    db = firestore.client()
+    main_doc_ref = db.collection(f'users/{user_id}/goalBreakdown').document()
+    try:
+        batch = db.batch()
+        batch.set(main_doc_ref, {**build_goal_doc(data, 0, [], None), 'generating': True})
+        bump_versions(batch, db, user_id, 'goals')
+        batch.commit()
+        invalidate(goals_tag(user_id), commit_time=batch.commit_time, collections=('goalBreakdown',))
+    except Exception as e:
+        logging.error(f"建立目標失敗: {str(e)}", exc_info=True)
+        yield format_sse('error', {'error': f'伺服器錯誤: {str(e)}'})
+        return
+
+    state = {'count': 0, 'pending': [], 'generator': 'llm', 'finalized': False}
+
+    def flush():
+        if state['pending']:
+            batch = db.batch()
+            for ref, task_data in state['pending']:
+                batch.set(ref, task_data)
+            # 進度計數器與任務在同一個 batch 中遞增
+            batch.set(main_doc_ref, added_tasks_delta([task_data['due_date'] for _, task_data in state['pending']]),
+                      merge=True)
+            bump_versions(batch, db, user_id, 'goals')
+            batch.commit()
+            state['pending'] = []
+            invalidate(goals_tag(user_id), goal_tag(user_id, main_doc_ref.id),
+                       commit_time=batch.commit_time, collections=GOAL_COLLECTIONS)
+
+    def add_task(raw_task):
+        """寫入佇列並回傳要推送的 SSE；無效的任務回傳 None"""
+        prepared = prepare_tasks([raw_task], deadline)
+        if not prepared:
+            return None
+        task, due_date = prepared[0]
+        state['count'] += 1
+        index = state['count']
+        task_id = f'task{index:03}'
+        state['pending'].append((main_doc_ref.collection('tasks').document(task_id), build_task_doc(task, due_date, index, main_doc_ref.id)))
+        if len(state['pending']) >= STREAM_WRITE_BATCH:
+            flush()
+        return format_sse('task', {
+            'id': task_id,
+            'order': index,
+            'task_name': task['task_name'],
+            'due_date': task['due_date'],
+            'priority': task['priority'].lower(),
+            'dependencies': task.get('dependencies', []),
+            'status': 'pending'
+        })
+
+    def finalize(learning_links):
+        flush()
+        batch = db.batch()
+        batch.update(main_doc_ref, {
+            'totalTasks': state['count'],
+            'learningLinks': learning_links,
+            'generator': state['generator'],
+            'generating': firestore.DELETE_FIELD
+        })
+        bump_versions(batch, db, user_id, 'goals')
+        batch.commit()
+        invalidate(goals_tag(user_id), goal_tag(user_id, main_doc_ref.id),
+                   commit_time=batch.commit_time, collections=('goalBreakdown',))
+        state['finalized'] = True
+
+    try:
+        yield format_sse('goal', {'id': main_doc_ref.id})
+
+        llm_error = None
+        if data['eventMode'] in FAST_MODES or mistral_breaker.is_open:
+            llm_error = '快速模式或斷路器已斷開'
+        else:
+            try:
+                for event in stream_structured_output(
+                        event_name=data['eventName'],
+                        event_deadline=data['eventDeadLine'],
+                        created_at=created_at,
+                        event_description=data['eventDescription'],
+                        user_habits=user_habits
+                ):
+                    if event['type'] == 'task':
+                        message = add_task(event['task'])
+                        if message:
+                            yield message
+            except Exception as e:
+                llm_error = str(e)
+                logging.error(f"串流拆解失敗（已產生 {state['count']} 個任務）: {llm_error}")
+
+        # 還沒有任何任務時改用本地規則拆解；已有部分任務則保留已產生的部分
+        partial = llm_error is not None and state['count'] > 0
+        if llm_error is not None and state['count'] == 0:
+            state['generator'] = 'rule_based'
+            for task in fast_breakdown(data, created_at, user_habits)['tasks']:
+                message = add_task(task)
+                if message:
+                    yield message
+
+        learning_links = search_branch.result(timeout=SEARCH_TIMEOUT, default=[])
+        finalize(learning_links)
+        yield format_sse('done', {
+            'id': main_doc_ref.id,
+            'taskCount': state['count'],
+            'learningLinks': learning_links,
+            'generator': state['generator'],
+            'partial': partial
+        })
+    except GeneratorExit:
+        logging.info(f"目標 {main_doc_ref.id} 串流拆解：用戶端已斷線，保留已產生的 {state['count']} 個任務")
+        raise
+    except Exception as e:
+        logging.error(f"串流拆解錯誤: {str(e)}", exc_info=True)
+        yield format_sse('error', {'error': f'伺服器錯誤: {str(e)}'})
+    finally:
+        if not state['finalized']:
+            try:
+                finalize([])
+            except Exception as e:
+                logging.error(f"目標 {main_doc_ref.id} 收尾寫入失敗: {str(e)}", exc_info=True)
+
+
 def get_tasks_service(user_id, goal_id):
     """取得特定目標分解下的所有任務"""
     try:
         db = firestore.client()
 
+        # 已標記刪除的目標在背景清除前，任務也不再回傳
+        goal_doc = db.collection(f'users/{user_id}/goalBreakdown').document(goal_id).get(field_paths=['deletedAt'])
+        if goal_doc.exists and (goal_doc.to_dict() or {}).get('deletedAt'):
+            return {'error': '目標不存在'}, 404
+
         # 構建 tasks 子集合的參考路徑
         tasks_ref = db.collection(f'users/{user_id}/goalBreakdown/{goal_id}/tasks')
 
         # 執行查詢
         docs = tasks_ref.stream()
 
-        # 轉換資料格式
+        # 轉換資料格式（Timestamp 由回應層序列化為 ISO 字串，見 utils/json_codec）
         tasks = []
         for doc in docs:
             task_data = doc.to_dict()
 
-            # 轉換 Firestore Timestamp 為 ISO 字串
-            if 'due_date' in task_data:
-                task_data['due_date'] = task_data['due_date'].isoformat()
-            if 'createdAt' in task_data:
-                task_data['createdAt'] = task_data['createdAt'].isoformat()
-
             tasks.append({
                 'id': doc.id,
                 **task_data
@@ -152,51 +400,139 @@ def get_tasks_service(user_id, goal_id):
         return {'error': f'資料庫查詢失敗: {str(e)}'}, 500
 
 
-def get_all_goals_service(user_id):
-    """獲取用戶所有目標及其任務"""
+def _summarize_tasks(task_docs):
+    """只用 status / due_date 計算任務摘要：總數、各狀態數量、最近一個未完成任務的截止日"""
+    by_status = {}
+    next_due = None
+    for task_doc in task_docs:
+        task_data = task_doc.to_dict()
+        status = task_data.get('status', 'pending')
+        by_status[status] = by_status.get(status, 0) + 1
+        due_date = task_data.get('due_date')
+        if status != 'completed' and due_date and (next_due is None or due_date < next_due):
+            next_due = due_date
+    return {
+        'total': sum(by_status.values()),
+        'byStatus': by_status,
+        'nextDue': next_due
+    }
+
+
+def _parse_goal_list_options(limit, order_by, fields, include_tasks):
+    """
+    驗證目標列表的查詢參數
+
+    :raises ValueError: 參數無效
+    """
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise ValueError('limit 必須為整數')
+        if not 1 <= limit <= GOALS_PAGE_MAX:
+            raise ValueError(f'limit 必須介於 1 到 {GOALS_PAGE_MAX}')
+    if order_by is not None and order_by not in GOAL_ORDER_FIELDS:
+        raise ValueError(f"order_by 只支援 {', '.join(GOAL_ORDER_FIELDS)}")
+    if include_tasks not in INCLUDE_TASKS_MODES:
+        raise ValueError(f"include_tasks 只支援 {', '.join(INCLUDE_TASKS_MODES)}")
+    if fields is not None:
+        fields = [field.strip() for field in fields if field.strip()]
+        unknown = [field for field in fields if field not in GOAL_LIST_FIELDS]
+        if unknown:
+            raise ValueError(f"不支援的欄位: {', '.join(unknown)}")
+    return limit, order_by, fields
+
+
+def _without_deleted(goal_docs):
+    """略過已標記刪除、等待背景清除的目標"""
+    return [doc for doc in goal_docs if not (doc.to_dict() or {}).get('deletedAt')]
+
+
+def get_all_goals_service(user_id, limit=None, cursor=None, order_by=None, fields=None, include_tasks='all'):
+    """
+    獲取用戶的目標及其任務
+
+    不帶任何參數時維持原本行為：回傳全部目標與完整任務。
+    任務改以單一 collection group 查詢取得後依目標分組，不再逐一目標查詢子集合。
+
+    :param limit: 每頁目標數；指定時依 order_by 排序並回傳 nextCursor
+    :param cursor: 上一頁回傳的 nextCursor
+    :param order_by: createdAt（新到舊）或 eventDeadLine（近到遠）
+    :param fields: 只回傳的目標欄位（Firestore 端投影）
+    :param include_tasks: all（完整任務）、summary（任務摘要）或 none
+    """
+    try:
+        limit, order_by, fields = _parse_goal_list_options(limit, order_by, fields, include_tasks)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
     try:
         db = firestore.client()
 
-        # 獲取所有目標
-        goals_ref = db.collection(f'users/{user_id}/goalBreakdown')
-        goals_docs = goals_ref.stream()
+        query = db.collection(f'users/{user_id}/goalBreakdown')
+        if limit is not None or order_by is not None:
+            order_by = order_by or 'createdAt'
+            query = query.order_by(order_by, direction=GOAL_ORDER_FIELDS[order_by])
+        if fields is not None:
+            # overdueTasks 由 pendingByDue 在讀取時算出
+            selected = set(fields) - {'overdueTasks'} | ({'pendingByDue'} if 'overdueTasks' in fields else set())
+            query = query.select(sorted(selected | {'deletedAt'} | ({order_by} if order_by else set())))
+
+        next_cursor = None
+        if limit is not None:
+            try:
+                goals_docs, next_cursor = paginate(db, query, user_id, limit, cursor, filter_docs=_without_deleted)
+            except ValueError as e:
+                return {'error': str(e)}, 400
+        else:
+            goals_docs = list(query.stream())
 
-        goals = []
+        goals = {}
         for doc in goals_docs:
             goal_data = doc.to_dict()
-            goal_id = doc.id
-
-            # 轉換時間戳為ISO字符串
-            for field in ['eventDeadLine', 'createdAt']:
-                if field in goal_data and goal_data[field]:
-                    goal_data[field] = goal_data[field].isoformat()
-
-            # 獲取該目標下的所有任務
-            tasks_ref = db.collection(f'users/{user_id}/goalBreakdown/{goal_id}/tasks')
-            tasks_docs = tasks_ref.stream()
-
-            tasks = []
-            for task_doc in tasks_docs:
-                task_data = task_doc.to_dict()
-
-                # 轉換時間戳為ISO字符串
-                for field in ['due_date', 'createdAt']:
-                    if field in task_data and task_data[field]:
-                        task_data[field] = task_data[field].isoformat()
-
-                tasks.append({
-                    'id': task_doc.id,
-                    **task_data
-                })
-
-            # 將目標和任務合併
-            goals.append({
-                'id': goal_id,
-                **goal_data,
-                'tasks': tasks
-            })
-
-        return {'goals': goals}, 200
+            if goal_data.get('deletedAt'):
+                continue
+            goal_data = with_overdue(goal_data)
+            if fields is not None:
+                goal_data = {field: goal_data[field] for field in fields if field in goal_data}
+            goals[doc.id] = {'id': doc.id, **goal_data}
+
+        if include_tasks != 'none' and goals:
+            task_fields = ['status', 'due_date'] if include_tasks == 'summary' else None
+            tasks_query = user_collection_group(db, user_id, 'goalBreakdown', 'tasks')
+            if task_fields is not None:
+                tasks_query = tasks_query.select(task_fields)
+            if limit is not None:
+                # 分頁時本頁目標依建立時間或截止日排序，ID 並不連續，改以任務上的 goalId 篩選；
+                # 每次 in 查詢至多 FIRESTORE_IN_LIMIT 個目標（需 tasks 的 goalId + __name__ collection group 索引）
+                page_ids = list(goals)
+                tasks_streams = [
+                    tasks_query.where('goalId', 'in', page_ids[start:start + FIRESTORE_IN_LIMIT]).stream()
+                    for start in range(0, len(page_ids), FIRESTORE_IN_LIMIT)
+                ]
+            else:
+                tasks_streams = [tasks_query.stream()]
+
+            tasks_by_goal = {goal_id: [] for goal_id in goals}
+            for task_docs in tasks_streams:
+                for task_doc in task_docs:
+                    goal_id = task_doc.reference.parent.parent.id
+                    if goal_id in tasks_by_goal:
+                        tasks_by_goal[goal_id].append(task_doc)
+
+            for goal_id, task_docs in tasks_by_goal.items():
+                if include_tasks == 'summary':
+                    goals[goal_id]['taskSummary'] = _summarize_tasks(task_docs)
+                else:
+                    goals[goal_id]['tasks'] = [
+                        {'id': task_doc.id, **task_doc.to_dict()}
+                        for task_doc in task_docs
+                    ]
+
+        result = {'goals': list(goals.values())}
+        if limit is not None:
+            result['nextCursor'] = next_cursor
+        return result, 200
 
     except Exception as e:
         logging.error(f"Service Error: {str(e)}", exc_info=True)
@@ -214,16 +550,13 @@ def get_goal_service(user_id, goal_id):
         if not goal_doc.exists:
             return {'error': '目標不存在'}, 404
 
-        # 獲取數據
+        # 獲取數據（Timestamp 由回應層序列化為 ISO 字串）
         goal_data = goal_doc.to_dict()
-
-        # 轉換時間戳為ISO字符串
-        for field in ['eventDeadLine', 'createdAt']:
-            if field in goal_data and goal_data[field]:
-                goal_data[field] = goal_data[field].isoformat()
+        if goal_data.get('deletedAt'):
+            return {'error': '目標不存在'}, 404
 
         # 返回數據
-        return goal_data, 200
+        return with_overdue(goal_data), 200
 
     except Exception as e:
         logging.error(f"Service Error: {str(e)}", exc_info=True)
@@ -234,13 +567,34 @@ def update_task_status_service(user_id, goal_id, task_id, new_status):
         db = firestore.client()
         task_ref = db.collection(f'users/{user_id}/goalBreakdown/{goal_id}/tasks').document(task_id)
 
-        task = task_ref.get()
-        if not task.exists:
-            return {'error': '任務不存在'}, 404
+        goal_ref = db.collection(f'users/{user_id}/goalBreakdown').document(goal_id)
 
-        task_ref.update({
-            'status': new_status
-        })
+        # 任務狀態與目標的進度計數器在同一個交易中更新
+        @firestore.transactional
+        def apply(transaction):
+            """回傳寫入的集合；任務不存在時回傳 None"""
+            task = task_ref.get(transaction=transaction)
+            if not task.exists:
+                return None
+            goal = goal_ref.get(transaction=transaction)
+            if goal.exists and (goal.to_dict() or {}).get('deletedAt'):
+                # 已標記刪除的目標等待背景清除，不再更新
+                return None
+            delta, task_update = status_change_delta(task.to_dict(), new_status, datetime.utcnow())
+            transaction.update(task_ref, task_update)
+            bump_versions(transaction, db, user_id, 'goals')
+            # 尚未有計數器的舊目標不遞增（由修復任務補上），避免從 0 開始算出負數
+            if delta and goal.exists and 'pendingTasks' in (goal.to_dict() or {}):
+                transaction.set(goal_ref, delta, merge=True)
+                return GOAL_COLLECTIONS
+            return ('goalBreakdown/tasks',)
+
+        transaction = db.transaction()
+        written = apply(transaction)
+        if written is None:
+            return {'error': '任務不存在'}, 404
+        invalidate(goals_tag(user_id), goal_tag(user_id, goal_id),
+                   commit_time=getattr(transaction, 'commit_time', None), collections=written)
 
         return {'message': '任務狀態已更新'}, 200
 
@@ -249,36 +603,174 @@ def update_task_status_service(user_id, goal_id, task_id, new_status):
         return {'error': f'更新失敗: {str(e)}'}, 500
 
 
-def delete_goal_service(user_id, goal_id):
-    """刪除特定目標及其所有相關任務"""
+def parse_task_status_updates(body):
+    """
+    解析批次更新任務狀態的請求內容：[{"task_id", "status"}, ...] 或 {"updates": [...]}
+
+    :raises ValueError: 格式錯誤、超過上限或任務ID重複
+    :return: [(task_id, status), ...]
+    """
+    updates = body.get('updates') if isinstance(body, dict) else body
+    if not isinstance(updates, list) or not updates:
+        raise ValueError('請求內容必須為非空的 {task_id, status} 陣列')
+    if len(updates) > TASK_UPDATE_MAX:
+        raise ValueError(f'單次最多更新 {TASK_UPDATE_MAX} 個任務')
+
+    parsed, seen = [], set()
+    for index, item in enumerate(updates):
+        task_id = item.get('task_id') if isinstance(item, dict) else None
+        new_status = item.get('status') if isinstance(item, dict) else None
+        if not isinstance(task_id, str) or not task_id or not isinstance(new_status, str) or not new_status:
+            raise ValueError(f'第 {index} 筆必須包含 task_id 與 status')
+        if task_id in seen:
+            raise ValueError(f'任務 {task_id} 重複出現')
+        seen.add(task_id)
+        parsed.append((task_id, new_status))
+    return parsed
+
+
+def _write_task_status_blind(db, user_id, goal_ref, chunk):
+    """
+    不讀取任務直接以一個 batch 更新狀態，以 exists 前置條件確保任務存在
+
+    :raises NotFound: 這批中有任務不存在（整批未寫入；部分後端回報為 FailedPrecondition）
+    :return: {task_id: (200, None)}
+    """
+    tasks_ref = goal_ref.collection('tasks')
+    now = datetime.utcnow()
+    batch = db.batch()
+    for task_id, new_status in chunk:
+        batch.update(tasks_ref.document(task_id), blind_status_update(new_status, now),
+                     option=db.write_option(exists=True))
+    bump_versions(batch, db, user_id, 'goals')
+    batch.commit()
+    invalidate(goals_tag(user_id), goal_tag(user_id, goal_ref.id), commit_time=batch.commit_time,
+               collections=('goalBreakdown/tasks',))
+    return {task_id: (200, None) for task_id, _ in chunk}
+
+
+def _apply_task_status_chunk(db, user_id, goal_ref, chunk, track_progress):
+    """
+    以一個 batch 更新一批任務，目標的進度計數器在同一個 batch 中遞增
+
+    先以一次 get_all 取回這批任務計算計數器所需的欄位，寫入時以 update_time 前置條件
+    確保任務仍存在且讀取後未被修改，計數器因此與實際覆寫的狀態一致。
+    不維護計數器的目標不需要讀取，直接寫入；整批因任務不存在被拒時才改走讀取路徑逐筆標記 404。
+
+    :raises FailedPrecondition: 有任務在讀取後被修改（整批未寫入）
+    :return: {task_id: (HTTP 狀態碼, 錯誤訊息或 None)}
+    """
+    if not track_progress:
+        try:
+            return _write_task_status_blind(db, user_id, goal_ref, chunk)
+        except (NotFound, FailedPrecondition):
+            # 前置條件不成立的錯誤只針對整批，改讀取任務找出是哪幾筆
+            pass
+
+    tasks_ref = goal_ref.collection('tasks')
+    refs = [tasks_ref.document(task_id) for task_id, _ in chunk]
+    snapshots = {snapshot.id: snapshot for snapshot in db.get_all(refs, field_paths=_TASK_PROGRESS_FIELDS)}
+
+    now = datetime.utcnow()
+    batch = db.batch()
+    results, counts, writes = {}, {}, 0
+    for ref, (task_id, new_status) in zip(refs, chunk):
+        snapshot = snapshots.get(task_id)
+        if snapshot is None or not snapshot.exists:
+            results[task_id] = (404, '任務不存在')
+            continue
+        change, task_update = status_change_counts(snapshot.to_dict(), new_status, now)
+        if change:
+            add_counts(counts, change)
+        batch.update(ref, task_update, option=db.write_option(last_update_time=snapshot.update_time))
+        results[task_id] = (200, None)
+        writes += 1
+
+    delta = as_increments(counts) if track_progress else None
+    if delta:
+        batch.set(goal_ref, delta, merge=True)
+    if writes:
+        bump_versions(batch, db, user_id, 'goals')
+        batch.commit()
+        invalidate(goals_tag(user_id), goal_tag(user_id, goal_ref.id), commit_time=batch.commit_time,
+                   collections=GOAL_COLLECTIONS if delta else ('goalBreakdown/tasks',))
+    return results
+
+
+def bulk_update_task_status_service(user_id, goal_id, updates):
+    """
+    批次更新同一個目標下多個任務的狀態
+
+    每個 batch 至多 FIRESTORE_BATCH_LIMIT 筆寫入（含目標文檔與版本計數器），批與批之間各自提交；
+    某一批的任務在讀取後被修改時重讀該批重試，仍失敗則該批標記為 409。
+
+    :param updates: parse_task_status_updates 的結果
+    :return: ({"results": [{"task_id", "status", "error"?}], "updated", "failed"}, 200)，
+        results 依請求順序排列，其中 status 為該筆的 HTTP 狀態碼
+    """
     try:
         db = firestore.client()
-        batch = db.batch()
+        goal_ref = db.collection(f'users/{user_id}/goalBreakdown').document(goal_id)
+        goal = goal_ref.get(field_paths=['pendingTasks', 'deletedAt'])
+        if not goal.exists or (goal.to_dict() or {}).get('deletedAt'):
+            return {'error': '目標不存在'}, 404
+        # 尚未有計數器的舊目標不遞增（由修復任務補上）
+        track_progress = 'pendingTasks' in (goal.to_dict() or {})
+
+        outcomes = {}
+        chunk_size = FIRESTORE_BATCH_LIMIT - 2  # 保留給目標文檔的計數器與版本計數器
+        for start in range(0, len(updates), chunk_size):
+            chunk = updates[start:start + chunk_size]
+            for attempt in range(1, TASK_UPDATE_ATTEMPTS + 1):
+                try:
+                    outcomes.update(_apply_task_status_chunk(db, user_id, goal_ref, chunk, track_progress))
+                    break
+                except FailedPrecondition:
+                    if attempt == TASK_UPDATE_ATTEMPTS:
+                        logging.warning(f"目標 {goal_id} 的任務持續被同時修改，放棄 {len(chunk)} 筆更新")
+                        outcomes.update({task_id: (409, '任務在更新期間被修改，請重試') for task_id, _ in chunk})
+                except Exception as e:
+                    logging.error(f"批次更新任務狀態錯誤: {str(e)}", exc_info=True)
+                    outcomes.update({task_id: (500, f'更新失敗: {str(e)}') for task_id, _ in chunk})
+                    break
+
+        results = []
+        for task_id, _ in updates:
+            code, error = outcomes[task_id]
+            results.append({'task_id': task_id, 'status': code, **({'error': error} if error else {})})
+        updated = sum(1 for result in results if result['status'] == 200)
+
+        return {'results': results, 'updated': updated, 'failed': len(results) - updated}, 200
+
+    except Exception as e:
+        logging.error(f"批次更新任務狀態錯誤: {str(e)}", exc_info=True)
+        return {'error': f'更新失敗: {str(e)}'}, 500
+
+
+def delete_goal_service(user_id, goal_id):
+    """
+    將目標標記為已刪除（讀取端立即隱藏），任務、檔案等由背景任務 purge_goal_service 清除
 
-        # 獲取目標文檔參考
+    已標記過的目標維持原本的 deletedAt，可重複呼叫以重新排入清除。
+    """
+    try:
+        db = firestore.client()
         goal_ref = db.collection(f'users/{user_id}/goalBreakdown').document(goal_id)
-        goal_doc = goal_ref.get()
+        goal_doc = goal_ref.get(field_paths=['deletedAt'])
 
         # 檢查目標是否存在
         if not goal_doc.exists:
             return {'error': '目標不存在'}, 404
 
-        # 獲取目標下所有任務
-        tasks_ref = db.collection(f'users/{user_id}/goalBreakdown/{goal_id}/tasks')
-        tasks = tasks_ref.stream()
-
-        # 將所有任務添加到批量刪除操作中
-        for task in tasks:
-            task_ref = tasks_ref.document(task.id)
-            batch.delete(task_ref)
-
-        # 將目標文檔添加到批量刪除操作
-        batch.delete(goal_ref)
-
-        # 執行批量刪除
-        batch.commit()
+        if not (goal_doc.to_dict() or {}).get('deletedAt'):
+            batch = db.batch()
+            batch.update(goal_ref, {'deletedAt': firestore.SERVER_TIMESTAMP})
+            bump_versions(batch, db, user_id, 'goals', 'files')
+            batch.commit()
+            invalidate(goals_tag(user_id), goal_tag(user_id, goal_id), files_tag(user_id),
+                       commit_time=batch.commit_time, collections=('goalBreakdown',))
 
-        return {'message': '目標及其所有任務已成功刪除'}, 200
+        return {'message': '目標已刪除，任務與檔案將在背景清除'}, 202
 
     except Exception as e:
         logging.error(f"刪除目標錯誤: {str(e)}", exc_info=True)
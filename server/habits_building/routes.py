@@ -1,16 +1,38 @@
 # app/habits_building/routes.py
 from flask import Blueprint, request, jsonify
 from habits_building.services import create_habit_building_service
-from habits_building.services import get_habits_with_tasks_service
+from habits_building.services import get_habits_with_tasks_service, validate_habit_data
+from utils import live_view
+from utils.etag import conditional_get
+from utils.json_codec import json_response
+from utils.read_cache import cached_response, habits_tag
+from job_queue.services import register_job_handler, enqueue_job, wants_async, JobQueueFullError
 import logging
 
 habit_building_bp = Blueprint('habit_building',__name__)
 
+register_job_handler('habit_building', create_habit_building_service)
+
 @habit_building_bp.route('/users/<string:user_id>/habit_building',methods=['POST'])
 def create_habit_building(user_id):
     data = request.json
 
     try:
+        # 非同步模式：先驗證，再交給背景 worker，立即回傳 202 與任務ID
+        if wants_async(request):
+            try:
+                validate_habit_data(data)
+                job_id = enqueue_job(user_id, 'habit_building', data)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            except JobQueueFullError as e:
+                return jsonify({'error': str(e)}), 503
+            return jsonify({
+                'jobId': job_id,
+                'status': 'queued',
+                'statusUrl': f'/api/users/{user_id}/jobs/{job_id}'
+            }), 202
+
         result, status_code = create_habit_building_service(user_id, data)
         return jsonify(result), status_code
     
@@ -19,10 +41,21 @@ def create_habit_building(user_id):
         return jsonify({'error': '伺服器錯誤'}), 500
     
 @habit_building_bp.route('/users/<string:user_id>/habit_building', methods=['GET'])
+@conditional_get('habits')
 def get_user_habits(user_id):
     try:
-        result, status_code = get_habits_with_tasks_service(user_id)
-        return jsonify(result), status_code
+        live = live_view.read(user_id, 'habits') if not request.args else None
+        if live is not None:
+            return json_response(live, stream_key='habits')
+        return cached_response(
+            ('habits', user_id, tuple(sorted(request.args.items(multi=True)))), [habits_tag(user_id)],
+            lambda: get_habits_with_tasks_service(
+                user_id,
+                limit=request.args.get('limit'),
+                cursor=request.args.get('cursor')
+            ),
+            stream_key='habits'
+        )
     except Exception as e:
         logging.error(f"Habit Route GET Error: {str(e)}", exc_info=True)
         return jsonify({'error': '伺服器錯誤'}), 500
\ No newline at end of file
@@ -2,8 +2,17 @@
 from datetime import datetime
 from firebase_admin import firestore
 from datetime import datetime, timedelta
+from goal_breakdown.services import prepare_tasks
 from llm_model.llm_services import generate_tasks_for_habit_building
+from utils.firestore_queries import user_collection_group, paginate
+from utils.etag import bump_versions
+from utils.read_cache import invalidate, habits_tag
 import logging
+import os
+
+HABITS_PAGE_MAX = int(os.getenv('HABITS_PAGE_MAX', '100'))
+HABIT_ID_PREFIX = 'buildinghabit'
+HABIT_COUNTER_FIELD = 'habitBuilding'  # users/{user_id}/meta/counters 中最後配置的習慣序號
 
 def validate_habit_data(data):
     required_fields = ['name','frequency','intensity']
@@ -22,65 +31,84 @@ def validate_habit_data(data):
     
     return True
 
-def create_habit_building_service(user_id, data):
-    try:
-        validate_habit_data(data)
-
-        db = firestore.client()
-        habit_building_ref = db.collection(f'users/{user_id}/habit_building')  # CollectionReference
-
-
-
-        # 找出目前 habit_building 中最大的 ID 序號
-        existing_docs = habit_building_ref.stream()
+def _max_habit_index(habit_docs):
+    """舊資料尚無計數器時，由現有的 buildinghabitNN 找出最大序號"""
+    max_index = 0
+    for doc in habit_docs:
+        if doc.id.startswith(HABIT_ID_PREFIX):
+            try:
+                max_index = max(max_index, int(doc.id[len(HABIT_ID_PREFIX):]))
+            except ValueError:
+                continue
+    return max_index
+
+
+def _write_habit(db, user_id, habit_data, tasks):
+    """
+    在同一個交易中配置習慣ID並寫入習慣與所有任務
+
+    ID 由 users/{user_id}/meta/counters 的 habitBuilding 計數器遞增取得，
+    同時建立的習慣不會拿到相同的ID；只有尚未建立計數器的使用者需要掃描一次現有習慣。
+
+    :param tasks: prepare_tasks 的結果 [(任務, due_date), ...]
+    :return: (習慣ID, 提交時間)
+    """
+    habit_building_ref = db.collection(f'users/{user_id}/habit_building')
+    counters_ref = db.document(f'users/{user_id}/meta/counters')
+
+    @firestore.transactional
+    def allocate_and_write(transaction):
+        counters = counters_ref.get(transaction=transaction)
+        last_index = (counters.to_dict() or {}).get(HABIT_COUNTER_FIELD) if counters.exists else None
+        if last_index is None:
+            last_index = _max_habit_index(habit_building_ref.select([]).stream(transaction=transaction))
+
+        habit_id = f"{HABIT_ID_PREFIX}{last_index + 1:02}"  # 例如：buildinghabit01, buildinghabit02, ...
+        habit_doc_ref = habit_building_ref.document(habit_id)
+        transaction.set(counters_ref, {HABIT_COUNTER_FIELD: last_index + 1}, merge=True)
+        transaction.create(habit_doc_ref, habit_data)
+        for i, (task, due_date) in enumerate(tasks, start=1):
+            transaction.set(habit_doc_ref.collection('tasks').document(f"task{i:02}"), {**task, 'due_date': due_date})
+        bump_versions(transaction, db, user_id, 'habits')
+        return habit_id
 
-        max_index = 0
-        for doc in existing_docs:
-            doc_id = doc.id
-            if doc_id.startswith("buildinghabit"): 
-                try:
-                    index = int(doc_id.replace("buildinghabit",""))
-                    if index > max_index:
-                        max_index = index
-                except ValueError:
-                    continue
+    transaction = db.transaction()
+    habit_id = allocate_and_write(transaction)
+    return habit_id, getattr(transaction, 'commit_time', None)
 
-        new_index = max_index + 1
-        habit_id = f"buildinghabit{new_index:02}"  # 例如：buildinghabit01, buildinghabit02, ...
 
+def create_habit_building_service(user_id, data):
+    try:
+        validate_habit_data(data)
 
         #  設定建立時間與截止日 ( 21天? 養成一個習慣)
         created_at = datetime.now()
-        deadline = (created_at + timedelta(days=21)).strftime('%Y-%m-%d')
-        # 寫入資料
-        habit_building_data = {
-            'name': data['name'],
-            'frequency': data['frequency'],
-            'intensity': data['intensity'],
-            'createAt' : created_at
-
-        }
+        deadline = created_at + timedelta(days=21)
 
-        # 用 document(habit_id) 建立特定 ID 的 document
-        habit_doc_ref = habit_building_ref.document(habit_id)
-        habit_doc_ref.set(habit_building_data)
-        
-       # 呼叫 LLM 拆解任務
+       # 呼叫 LLM 拆解任務；失敗時不寫入任何資料
         task_result = generate_tasks_for_habit_building(
             habit_name=data['name'],
             frequency=data['frequency'],
             intensity=data['intensity'],
             created_at=created_at,
-            deadline=deadline
+            deadline=deadline.strftime('%Y-%m-%d')
         )
         if 'error' in task_result:
             return {'error': task_result['error']}, 500
 
-        # 寫入任務到子集合 tasks
-        tasks_ref = habit_doc_ref.collection('tasks')
-        for i, task in enumerate(task_result.get('tasks', []), start=1):
-            task_id = f"task{str(i).zfill(2)}"
-            tasks_ref.document(task_id).set(task)
+        # 任務日期轉為 datetime 儲存（讀取時由回應層輸出 ISO 字串），無效的任務略過
+        tasks = prepare_tasks(task_result.get('tasks', []), deadline)
+
+        habit_building_data = {
+            'name': data['name'],
+            'frequency': data['frequency'],
+            'intensity': data['intensity'],
+            'createAt' : created_at
+        }
+
+        # 習慣與任務一次寫入
+        habit_id, commit_time = _write_habit(firestore.client(), user_id, habit_building_data, tasks)
+        invalidate(habits_tag(user_id), commit_time=commit_time, collections=('habit_building', 'habit_building/tasks'))
 
         return {'id': habit_id, 'message': '習慣與任務建立成功'}, 201
     
@@ -91,33 +119,63 @@ def create_habit_building_service(user_id, data):
         logging.error(f"Service Error: {str(e)}", exc_info=True)
         return {'error': '伺服器錯誤'}, 500
     
-def get_habits_with_tasks_service(user_id):
+def get_habits_with_tasks_service(user_id, limit=None, cursor=None):
+    """
+    取得使用者的習慣及其任務
+
+    任務以單一 collection group 查詢取得，再依所屬習慣一次分組，不再逐一習慣查詢。
+
+    :param limit: 每頁習慣數；指定時回傳 nextCursor
+    :param cursor: 上一頁回傳的 nextCursor
+    """
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            return {'error': 'limit 必須為整數'}, 400
+        if not 1 <= limit <= HABITS_PAGE_MAX:
+            return {'error': f'limit 必須介於 1 到 {HABITS_PAGE_MAX}'}, 400
+
     try:
         db = firestore.client()
         habits_ref = db.collection(f'users/{user_id}/habit_building')
-        habit_docs = habits_ref.stream()
 
-        habit_list = []
+        next_cursor = None
+        if limit is not None:
+            try:
+                habit_docs, next_cursor = paginate(db, habits_ref, user_id, limit, cursor)
+            except ValueError as e:
+                return {'error': str(e)}, 400
+        else:
+            habit_docs = list(habits_ref.stream())
 
+        habits = {}
         for doc in habit_docs:
             habit_data = doc.to_dict()
-            habit_id = doc.id
-
-            # 讀取對應的 tasks 子集合
-            tasks_ref = habits_ref.document(habit_id).collection('tasks')
-            task_docs = tasks_ref.stream()
-            tasks = [{**task_doc.to_dict(), 'id': task_doc.id} for task_doc in task_docs]
-
-            habit_list.append({
-                'id': habit_id,
+            habits[doc.id] = {
+                'id': doc.id,
                 'name': habit_data.get('name'),
                 'frequency': habit_data.get('frequency'),
                 'intensity': habit_data.get('intensity'),
                 'createAt': habit_data.get('createAt'),
-                'tasks': tasks
-            })
-
-        return {'habits': habit_list}, 200
+                'tasks': []
+            }
+
+        if habits:
+            # 分頁時只查詢本頁習慣ID區間內的任務
+            tasks_query = user_collection_group(
+                db, user_id, 'habit_building', 'tasks',
+                *((min(habits), max(habits)) if limit is not None else ())
+            )
+            for task_doc in tasks_query.stream():
+                habit = habits.get(task_doc.reference.parent.parent.id)
+                if habit is not None:
+                    habit['tasks'].append({**task_doc.to_dict(), 'id': task_doc.id})
+
+        result = {'habits': list(habits.values())}
+        if limit is not None:
+            result['nextCursor'] = next_cursor
+        return result, 200
 
     except Exception as e:
         logging.error(f"Fetch Habits Error: {str(e)}", exc_info=True)
@@ -0,0 +1,19 @@
+# job_queue/routes.py
+from flask import Blueprint, jsonify
+from job_queue.services import get_job
+import logging
+
+job_bp = Blueprint('job', __name__)
+
+
+@job_bp.route('/users/<string:user_id>/jobs/<string:job_id>', methods=['GET'])
+def get_job_status(user_id, job_id):
+    """查詢背景任務狀態（queued/running/succeeded/failed）與執行結果"""
+    try:
+        job = get_job(user_id, job_id)
+        if job is None:
+            return jsonify({'error': '任務不存在'}), 404
+        return jsonify(job), 200
+    except Exception as e:
+        logging.error(f"Job Route Error: {str(e)}", exc_info=True)
+        return jsonify({'error': '伺服器錯誤'}), 500
@@ -0,0 +1,298 @@
+# job_queue/services.py
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+JOB_QUEUE_DB = os.getenv('JOB_QUEUE_DB', os.path.abspath(os.path.join(BASE_DIR, '..', 'jobs.sqlite3')))
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))  # 背景 worker 數量上限
+JOB_MAX_PENDING = int(os.getenv('JOB_MAX_PENDING', '200'))  # 佇列中允許的最大待處理任務數
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '60'))  # 執行中任務的租約長度，過期未續約視為執行者已停止
+JOB_HEARTBEAT_INTERVAL = int(os.getenv('JOB_HEARTBEAT_INTERVAL', '15'))  # 續約並回收過期任務的間隔（秒）
+
+JOB_STATUSES = ('queued', 'running', 'succeeded', 'failed')
+
+_handlers = {}
+_db_ready = False
+_executor = None
+_executor_lock = threading.Lock()
+_current = threading.local()  # worker 執行緒目前處理的任務ID（供 report_progress 使用）
+_heartbeat = None
+_OWNER = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'  # 本程序在 owner 欄位中的識別
+
+
+class JobQueueFullError(Exception):
+    """佇列已滿，暫時無法接受新任務"""
+
+
+def register_job_handler(kind, handler):
+    """
+    註冊背景任務的處理函式
+
+    :param kind: 任務種類，例如 'goal_breakdown'
+    :param handler: 處理函式，簽名為 handler(user_id, payload) -> (result, status_code)
+    """
+    _handlers[kind] = handler
+
+
+def wants_async(req):
+    """判斷請求是否要求以背景任務方式處理（?async=true 或 Prefer: respond-async）"""
+    if req.args.get('async', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return 'respond-async' in req.headers.get('Prefer', '').lower()
+
+
+@contextmanager
+def _connect():
+    conn = sqlite3.connect(JOB_QUEUE_DB, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def _init_db():
+    global _db_ready
+    if _db_ready:
+        return
+    with _connect() as conn:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                http_status INTEGER,
+                result TEXT,
+                error TEXT,
+                progress TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)')
+        # 舊版資料庫沒有 progress、owner、lease_until 欄位
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+        for column, column_type in (('progress', 'TEXT'), ('owner', 'TEXT'), ('lease_until', 'REAL')):
+            if column not in columns:
+                conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+    _db_ready = True
+
+
+def _now():
+    return datetime.utcnow().isoformat()
+
+
+def _get_executor():
+    global _executor, _heartbeat
+    with _executor_lock:
+        if _executor is None:
+            _init_db()
+            _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='job-worker')
+            _heartbeat = threading.Thread(target=_heartbeat_loop, name='job-heartbeat', daemon=True)
+            _heartbeat.start()
+        return _executor
+
+
+def _renew_leases():
+    """延長本程序執行中任務的租約"""
+    with _connect() as conn:
+        conn.execute(
+            "UPDATE jobs SET lease_until = ? WHERE owner = ? AND status = 'running'",
+            (time.time() + JOB_LEASE_SECONDS, _OWNER)
+        )
+
+
+def _requeue_expired():
+    """
+    把租約已過期（執行者已停止續約）的執行中任務重新排入佇列
+
+    其他程序仍在執行、持續續約的任務不受影響。
+
+    :return: 重新排入佇列的任務數
+    """
+    with _connect() as conn:
+        return conn.execute(
+            "UPDATE jobs SET status = 'queued', owner = NULL, lease_until = NULL, updated_at = ? "
+            "WHERE status = 'running' AND (lease_until IS NULL OR lease_until < ?)",
+            (_now(), time.time())
+        ).rowcount
+
+
+def _submit_queued(executor):
+    """
+    把所有待處理任務交給 worker；同一任務被多個程序提交時，_run_job 的條件搶佔保證只會執行一次
+
+    :return: 提交的任務數
+    """
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at"
+        ).fetchall()
+    for row in rows:
+        executor.submit(_run_job, row['id'])
+    return len(rows)
+
+
+def _heartbeat_loop():
+    while True:
+        time.sleep(JOB_HEARTBEAT_INTERVAL)
+        try:
+            _renew_leases()
+            requeued = _requeue_expired()
+            if requeued:
+                logging.warning(f"已重新排入 {requeued} 個租約過期的背景任務")
+                _submit_queued(_executor)
+        except Exception as e:
+            logging.error(f"背景任務續約失敗: {str(e)}", exc_info=True)
+
+
+def enqueue_job(user_id, kind, payload):
+    """
+    將任務寫入持久化佇列並交給背景 worker 執行
+
+    :param user_id: 使用者ID
+    :param kind: 任務種類（需先以 register_job_handler 註冊）
+    :param payload: 任務參數（需可 JSON 序列化）
+    :return: 任務ID
+    """
+    if kind not in _handlers:
+        raise ValueError(f'未知的任務種類: {kind}')
+
+    executor = _get_executor()
+    job_id = uuid.uuid4().hex
+    now = _now()
+
+    # 計數與寫入在同一個陳述式中完成，同時送出的請求不會讓佇列超過上限
+    with _connect() as conn:
+        inserted = conn.execute(
+            'INSERT INTO jobs (id, user_id, kind, payload, status, created_at, updated_at) '
+            "SELECT ?, ?, ?, ?, 'queued', ?, ? "
+            "WHERE (SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')) < ?",
+            (job_id, user_id, kind, json.dumps(payload, ensure_ascii=False), now, now, JOB_MAX_PENDING)
+        ).rowcount
+    if not inserted:
+        raise JobQueueFullError('背景任務佇列已滿，請稍後再試')
+
+    executor.submit(_run_job, job_id)
+    logging.info(f"任務已排入佇列: {kind} {job_id} (user={user_id})")
+    return job_id
+
+
+def get_job(user_id, job_id):
+    """
+    取得任務狀態
+
+    :param user_id: 使用者ID
+    :param job_id: 任務ID
+    :return: 任務資訊字典，找不到則回傳 None
+    """
+    _init_db()
+    with _connect() as conn:
+        row = conn.execute(
+            'SELECT * FROM jobs WHERE id = ? AND user_id = ?', (job_id, user_id)
+        ).fetchone()
+
+    if row is None:
+        return None
+
+    return {
+        'id': row['id'],
+        'kind': row['kind'],
+        'status': row['status'],
+        'httpStatus': row['http_status'],
+        'result': json.loads(row['result']) if row['result'] else None,
+        'error': row['error'],
+        'progress': json.loads(row['progress']) if row['progress'] else None,
+        'attempts': row['attempts'],
+        'createdAt': row['created_at'],
+        'updatedAt': row['updated_at'],
+    }
+
+
+def report_progress(progress):
+    """
+    在處理函式中回報目前進度，可由 GET /jobs/<id> 的 progress 欄位查詢
+
+    不在背景任務中呼叫時（例如同步執行）不做任何事。
+
+    :param progress: 進度資訊（需可 JSON 序列化）
+    """
+    job_id = getattr(_current, 'job_id', None)
+    if job_id is None:
+        return
+    with _connect() as conn:
+        conn.execute(
+            'UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ?',
+            (json.dumps(progress, ensure_ascii=False, default=str), _now(), job_id)
+        )
+
+
+def _run_job(job_id):
+    # 以條件更新搶佔任務，確保同一任務只會被執行一次；執行期間由 _heartbeat_loop 續約
+    with _connect() as conn:
+        claimed = conn.execute(
+            "UPDATE jobs SET status = 'running', attempts = attempts + 1, owner = ?, lease_until = ?, updated_at = ? "
+            "WHERE id = ? AND status = 'queued'",
+            (_OWNER, time.time() + JOB_LEASE_SECONDS, _now(), job_id)
+        ).rowcount
+        if not claimed:
+            return
+        row = conn.execute('SELECT user_id, kind, payload FROM jobs WHERE id = ?', (job_id,)).fetchone()
+
+    handler = _handlers.get(row['kind'])
+    _current.job_id = job_id
+    try:
+        if handler is None:
+            raise ValueError(f"未知的任務種類: {row['kind']}")
+        result, status_code = handler(row['user_id'], json.loads(row['payload']))
+        status = 'succeeded' if status_code < 400 else 'failed'
+        error = result.get('error') if isinstance(result, dict) else None
+    except Exception as e:
+        logging.error(f"背景任務執行失敗 {job_id}: {str(e)}", exc_info=True)
+        result, status_code, status, error = None, 500, 'failed', str(e)
+    finally:
+        _current.job_id = None
+
+    # 租約過期後任務可能已被重新排入佇列、由其他程序接手，此時不覆寫其狀態
+    with _connect() as conn:
+        finished = conn.execute(
+            'UPDATE jobs SET status = ?, http_status = ?, result = ?, error = ?, lease_until = NULL, updated_at = ? '
+            "WHERE id = ? AND owner = ? AND status = 'running'",
+            (status, status_code, json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+             error, _now(), job_id, _OWNER)
+        ).rowcount
+    if not finished:
+        logging.warning(f"背景任務 {job_id} 的租約已失效，捨棄本次結果")
+        return
+    logging.info(f"背景任務完成: {row['kind']} {job_id} -> {status}")
+
+
+def start_job_workers():
+    """
+    啟動背景 worker，並恢復尚未完成的任務
+
+    只有租約已過期的執行中任務（執行的程序已停止）會重新排入佇列；
+    其他程序仍在執行的任務保持不動。
+    """
+    executor = _get_executor()
+    _requeue_expired()
+    recovered = _submit_queued(executor)
+    if recovered:
+        logging.info(f"已恢復 {recovered} 個未完成的背景任務")
@@ -4,7 +4,6 @@ import requests
 from typing import List, Dict, Any, Optional, TypedDict, Annotated
 from datetime import datetime
 from dotenv import load_dotenv
-from langchain_mistralai import ChatMistralAI
 from langchain.tools import Tool
 from langchain_community.tools import DuckDuckGoSearchRun
 from langgraph.graph import StateGraph, END, START
@@ -12,6 +11,8 @@ from langgraph.prebuilt import ToolNode
 from langgraph.checkpoint.memory import MemorySaver
 import logging
 
+from llm_model import gateway
+
 # 設置日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -41,13 +42,8 @@ class TaskManagementLangGraphAgent:
         """初始化 Agent"""
         self.user_id = user_id
 
-        # 初始化 Mistral LLM
-        self.llm = ChatMistralAI(
-            mistral_api_key=os.getenv("MISTRAL_API_KEY"),
-            model="open-mistral-nemo",
-            temperature=0.1,
-            max_retries=2,
-        )
+        # 共用閘道的 Mistral LLM（並行上限、限速與重試由閘道處理）
+        self.llm = gateway.get_langchain_llm()
 
         # 初始化工具
         self.tools = self._initialize_tools()
@@ -323,7 +319,7 @@ class TaskManagementLangGraphAgent:
                             context += f"- {msg['type']}: {msg['content']}\n"
 
                     # 使用 LLM 生成自然語言回應
-                    llm_response = self.llm.invoke(f"""
+                    llm_response = gateway.invoke_langchain(f"""
 你是一個任務管理助手。請根據以下資訊回答用戶問題：
 
 {context}
@@ -353,6 +349,7 @@ class TaskManagementLangGraphAgent:
 
             response = requests.get(
                 f"{API_BASE_URL}/users/{self.user_id}/goal_breakdown_all",
+                params={'fields': 'eventName,eventDeadLine'},
                 timeout=60
             )
 
@@ -394,9 +391,10 @@ class TaskManagementLangGraphAgent:
     def _get_goal_detail(self, goal_identifier: str) -> str:
         """獲取特定目標的詳細資訊"""
         try:
-            # 先獲取所有目標來找到對應的ID
+            # 先獲取所有目標來找到對應的ID（只需要名稱，不取任務）
             all_goals_response = requests.get(
                 f"{API_BASE_URL}/users/{self.user_id}/goal_breakdown_all",
+                params={'include_tasks': 'none', 'fields': 'eventName'},
                 timeout=60
             )
 
@@ -449,9 +447,10 @@ class TaskManagementLangGraphAgent:
     def _get_tasks(self, goal_identifier: str) -> str:
         """獲取特定目標的任務列表"""
         try:
-            # 先獲取所有目標來找到對應的ID
+            # 先獲取所有目標來找到對應的ID（只需要名稱，不取任務）
             all_goals_response = requests.get(
                 f"{API_BASE_URL}/users/{self.user_id}/goal_breakdown_all",
+                params={'include_tasks': 'none', 'fields': 'eventName'},
                 timeout=60
             )
 
@@ -469,7 +468,14 @@ class TaskManagementLangGraphAgent:
                 if not target_goal:
                     return f"❌ 找不到名稱包含 '{goal_identifier}' 的目標。"
 
-                tasks = target_goal.get('tasks', [])
+                tasks_response = requests.get(
+                    f"{API_BASE_URL}/users/{self.user_id}/goal_breakdown/{target_goal['id']}/tasks",
+                    timeout=60
+                )
+                if tasks_response.status_code != 200:
+                    return f"❌ 獲取任務失敗：{tasks_response.text}"
+
+                tasks = tasks_response.json().get('tasks', [])
                 if not tasks:
                     return f"📋 目標「{target_goal['eventName']}」目前沒有任何任務。"
 
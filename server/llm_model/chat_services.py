@@ -1,32 +1,41 @@
 # llm_model/chat_services.py
 import os
 import json
-from mistralai import Mistral
+import time
 from flask import jsonify
 from dotenv import load_dotenv
+from llm_model.context_builder import build_context
+from llm_model import gateway
 
 load_dotenv()
 
-# 初始化 Mistral 客戶端
-client = Mistral(api_key=os.getenv("MISTRAL_API_KEY"))
+# 聊天回覆的一般長度（max_tokens 只是上限），供模型路由估算耗時
+CHAT_EXPECTED_OUTPUT_TOKENS = int(os.getenv('CHAT_EXPECTED_OUTPUT_TOKENS', '400'))
 
+def _summarize_history(previous_summary: str, new_turns: str) -> str:
+    """把較舊的對話折疊進滾動摘要"""
+    prompt = f"""請將以下對話內容整合進既有摘要，保留使用者的目標、偏好、已做的決定與未解決的問題。
+以繁體中文條列輸出，不超過 200 字。
 
-def get_chatbot_response(
-        user_message: str,
-        chat_history: list = None,
-        system_prompt: str = None
-) -> dict:
-    """
-    使用 Mistral 生成聊天機器人回覆
+既有摘要：
+{previous_summary or '（無）'}
 
-    :param user_message: 用戶的訊息
-    :param chat_history: 之前的對話歷史 [{"role": "user"/"assistant", "content": "message"}, ...]
-    :param system_prompt: 自訂系統提示詞
-    :return: 含有回复内容的字典
-    """
-    try:
-        # 預設系統提示詞 - 增強格式化和繁體中文支援
-        default_system_prompt = """
+新增對話：
+{new_turns}"""
+
+    response = gateway.complete(
+        [{"role": "user", "content": prompt}],
+        endpoint="chat_summary",
+        max_tokens=400,
+        temperature=0.2
+    )
+    return response.choices[0].message.content.strip()
+
+
+def _build_chat_messages(user_message, chat_history=None, system_prompt=None, conversation_key=None, endpoint='chat'):
+    """組合一般聊天的訊息列表（系統提示詞 + 聊天歷史 + 最新訊息）"""
+    # 預設系統提示詞 - 增強格式化和繁體中文支援
+    default_system_prompt = """
         你是一個智能任務管理助手，目的是幫助用戶管理目標和任務。請提供簡短、有幫助且格式化的回答。
 
         你可以幫助用戶：
@@ -60,24 +69,47 @@ def get_chatbot_response(
         請保持回答簡潔、友好且實用。使用繁體中文回覆。
         """
 
-        system_prompt = system_prompt or default_system_prompt
-        chat_history = chat_history or []
+    system_prompt = system_prompt or default_system_prompt
 
-        # 構建消息結構
-        messages = [{"role": "system", "content": system_prompt}]
+    # 在 token 預算內組合：系統提示詞 + 舊訊息摘要 + 最近訊息 + 最新訊息
+    messages = build_context(
+        system_prompt,
+        chat_history or [],
+        user_message,
+        endpoint=endpoint,
+        key=conversation_key,
+        summarize=_summarize_history
+    )
 
-        # 添加聊天歷史
-        for msg in chat_history:
-            if msg["role"] in ["user", "assistant"]:
-                messages.append(msg)
+    return messages
 
-        # 添加最新的用戶消息
-        messages.append({"role": "user", "content": user_message})
+
+def get_chatbot_response(
+        user_message: str,
+        chat_history: list = None,
+        system_prompt: str = None,
+        conversation_key: str = None,
+        coalesce: bool = True
+) -> dict:
+    """
+    使用 Mistral 生成聊天機器人回覆
+
+    :param user_message: 用戶的訊息
+    :param chat_history: 之前的對話歷史 [{"role": "user"/"assistant", "content": "message"}, ...]
+    :param system_prompt: 自訂系統提示詞
+    :param conversation_key: 摘要快取的命名空間（使用者ID或伺服器端對話ID）
+    :param coalesce: 是否與進行中的相同請求（如重複送出）共用同一次 LLM 呼叫
+    :return: 含有回复内容的字典
+    """
+    try:
+        messages = _build_chat_messages(user_message, chat_history, system_prompt, conversation_key)
 
         # 呼叫 Mistral API
-        response = client.chat.complete(
-            model="open-mistral-nemo",  # 或者您偏好的模型
-            messages=messages,
+        response = gateway.complete(
+            messages,
+            endpoint="chat",  # 模型由路由器依輸入大小與延遲目標決定
+            expected_output_tokens=CHAT_EXPECTED_OUTPUT_TOKENS,
+            coalesce=coalesce,
             max_tokens=800,  # 增加token數以支援更長的格式化回覆
             temperature=0.7
         )
@@ -98,40 +130,26 @@ def get_chatbot_response(
         }
 
 
-def get_task_helper_response(
-        user_message: str,
-        goal_name: str = None,
-        goal_deadline: str = None,
-        task_list: list = None
-) -> dict:
-    """
-    使用 Mistral 為特定目標提供任務建議和幫助
+def _build_task_helper_messages(user_message, goal_name=None, goal_deadline=None, task_list=None):
+    """組合任務助手的訊息列表（含目標與任務背景的系統提示詞）"""
+    # 構建任務相關上下文
+    context = ""
+    if goal_name:
+        context += f"**當前目標**: {goal_name}\n"
+    if goal_deadline:
+        context += f"**截止日期**: {goal_deadline}\n"
+    if task_list and len(task_list) > 0:
+        context += "**當前任務**:\n"
+        for idx, task in enumerate(task_list):
+            task_name = task.get("task_name", "未命名任務")
+            due_date = task.get("due_date", "無截止日期")
+            priority = task.get("priority", "未設置優先級")
 
-    :param user_message: 用戶的訊息
-    :param goal_name: 當前目標名稱（如果有）
-    :param goal_deadline: 目標截止日期（如果有）
-    :param task_list: 當前目標的任務列表（如果有）
-    :return: 含有回复内容的字典
-    """
-    try:
-        # 構建任務相關上下文
-        context = ""
-        if goal_name:
-            context += f"**當前目標**: {goal_name}\n"
-        if goal_deadline:
-            context += f"**截止日期**: {goal_deadline}\n"
-        if task_list and len(task_list) > 0:
-            context += "**當前任務**:\n"
-            for idx, task in enumerate(task_list):
-                task_name = task.get("task_name", "未命名任務")
-                due_date = task.get("due_date", "無截止日期")
-                priority = task.get("priority", "未設置優先級")
-
-                priority_text = "高" if priority == "high" else "中" if priority == "medium" else "低"
-                context += f"{idx + 1}. [{priority_text}優先級] {task_name} (期限: {due_date})\n"
-
-        # 系統提示詞 - 增強格式化和繁體中文支援
-        system_prompt = f"""
+            priority_text = "高" if priority == "high" else "中" if priority == "medium" else "低"
+            context += f"{idx + 1}. [{priority_text}優先級] {task_name} (期限: {due_date})\n"
+
+    # 系統提示詞 - 增強格式化和繁體中文支援
+    system_prompt = f"""
         你是一個智能任務管理助手，專門協助用戶完成目標和任務。請使用格式化的方式回覆。
 
         使用者目前的背景資訊：
@@ -149,13 +167,35 @@ def get_task_helper_response(
         如果用戶詢問任務順序或規劃，請提供具體的排序建議，包括任務名稱、優先級和截止日期。
         """
 
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_message}
+    ]
+
+
+def get_task_helper_response(
+        user_message: str,
+        goal_name: str = None,
+        goal_deadline: str = None,
+        task_list: list = None
+) -> dict:
+    """
+    使用 Mistral 為特定目標提供任務建議和幫助
+
+    :param user_message: 用戶的訊息
+    :param goal_name: 當前目標名稱（如果有）
+    :param goal_deadline: 目標截止日期（如果有）
+    :param task_list: 當前目標的任務列表（如果有）
+    :return: 含有回复内容的字典
+    """
+    try:
+        messages = _build_task_helper_messages(user_message, goal_name, goal_deadline, task_list)
+
         # 調用 Mistral API
-        response = client.chat.complete(
-            model="open-mistral-nemo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ],
+        response = gateway.complete(
+            messages,
+            endpoint="task_helper",
+            expected_output_tokens=CHAT_EXPECTED_OUTPUT_TOKENS,
             max_tokens=800,  # 增加token數以支援更長的格式化回覆
             temperature=0.7
         )
@@ -173,4 +213,81 @@ def get_task_helper_response(
             "response": f"抱歉，我現在無法回答您的問題。錯誤：{str(e)}",
             "status": "error",
             "error": str(e)
-        }
\ No newline at end of file
+        }
+
+
+def _stream_completion(messages: list, endpoint: str):
+    """
+    以 Mistral 串流 API 逐段產生回覆
+
+    產生的事件：
+    - {"type": "token", "content": "..."}：每段新產生的文字
+    - {"type": "done", "usage": {...}, "timing": {...}}：完成時的用量與耗時
+
+    呼叫端關閉此產生器（例如用戶端斷線）時，會一併關閉上游的 HTTP 串流。
+    """
+    started_at = time.perf_counter()
+    first_token_at = None
+    usage = None
+
+    stream = gateway.stream(
+        messages,
+        endpoint=endpoint,
+        expected_output_tokens=CHAT_EXPECTED_OUTPUT_TOKENS,
+        max_tokens=800,
+        temperature=0.7
+    )
+    try:
+        for event in stream:
+            chunk = event.data
+            if chunk.usage:
+                usage = {
+                    "prompt_tokens": chunk.usage.prompt_tokens,
+                    "completion_tokens": chunk.usage.completion_tokens,
+                    "total_tokens": chunk.usage.total_tokens
+                }
+            if not chunk.choices:
+                continue
+
+            content = chunk.choices[0].delta.content
+            if content:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                yield {"type": "token", "content": content}
+    finally:
+        stream.close()
+
+    finished_at = time.perf_counter()
+    yield {
+        "type": "done",
+        "usage": usage,
+        "timing": {
+            "first_token_ms": round((first_token_at - started_at) * 1000, 1) if first_token_at else None,
+            "total_ms": round((finished_at - started_at) * 1000, 1)
+        }
+    }
+
+
+def stream_chatbot_response(
+        user_message: str,
+        chat_history: list = None,
+        system_prompt: str = None,
+        conversation_key: str = None
+):
+    """
+    串流版的 get_chatbot_response，參數相同，回傳事件產生器（見 _stream_completion）
+    """
+    messages = _build_chat_messages(user_message, chat_history, system_prompt, conversation_key, endpoint='chat_stream')
+    return _stream_completion(messages, 'chat_stream')
+
+
+def stream_task_helper_response(
+        user_message: str,
+        goal_name: str = None,
+        goal_deadline: str = None,
+        task_list: list = None
+):
+    """
+    串流版的 get_task_helper_response，參數相同，回傳事件產生器（見 _stream_completion）
+    """
+    return _stream_completion(_build_task_helper_messages(user_message, goal_name, goal_deadline, task_list), 'task_helper')
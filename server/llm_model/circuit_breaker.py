@@ -0,0 +1,82 @@
+# llm_model/circuit_breaker.py
+import logging
+import os
+import threading
+import time
+
+
+class CircuitOpenError(Exception):
+    """斷路器斷開，呼叫被拒絕"""
+
+
+class CircuitBreaker:
+    """
+    簡單的斷路器：連續失敗達門檻後「斷開」一段時間，期間直接拒絕呼叫；
+    冷卻時間過後放行一次試探呼叫（half-open），成功即恢復。
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        """
+        :param name: 名稱（用於日誌）
+        :param failure_threshold: 連續失敗幾次後斷開
+        :param reset_timeout: 斷開後多久（秒）允許試探呼叫
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    @property
+    def is_open(self):
+        """斷路器是否處於斷開狀態（half-open 視為未斷開，允許試探）"""
+        return self.state == 'open'
+
+    def allow(self):
+        """是否允許這次呼叫；half-open 時只放行一個試探呼叫"""
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logging.info(f"斷路器 {self.name} 恢復")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                logging.warning(f"斷路器 {self.name} 斷開（連續失敗 {self._failures} 次）")
+
+
+# Mistral API 共用的斷路器
+mistral_breaker = CircuitBreaker(
+    'mistral',
+    failure_threshold=int(os.getenv('LLM_BREAKER_THRESHOLD', '5')),
+    reset_timeout=float(os.getenv('LLM_BREAKER_RESET', '30'))
+)
@@ -0,0 +1,162 @@
+# llm_model/context_builder.py
+import hashlib
+import logging
+import os
+import unicodedata
+
+from dotenv import load_dotenv
+
+from utils.cache import TTLCache
+
+load_dotenv()
+
+# 各端點的上下文 token 預算（不含回覆的 max_tokens）
+CONTEXT_BUDGETS = {
+    'chat': int(os.getenv('CHAT_CONTEXT_BUDGET', '3000')),
+    'chat_stream': int(os.getenv('CHAT_STREAM_CONTEXT_BUDGET', os.getenv('CHAT_CONTEXT_BUDGET', '3000'))),
+}
+DEFAULT_CONTEXT_BUDGET = int(os.getenv('DEFAULT_CONTEXT_BUDGET', '3000'))
+
+KEEP_RECENT_TURNS = int(os.getenv('CHAT_KEEP_RECENT_TURNS', '6'))  # 永遠原文保留的最近訊息數
+SUMMARY_REFRESH_TURNS = int(os.getenv('CHAT_SUMMARY_REFRESH_TURNS', '6'))  # 累積多少則新舊訊息才重新摘要
+
+# 對話摘要快取：'{對話識別鍵}:{摘要涵蓋的訊息前綴雜湊}' -> 摘要文字
+_summary_cache = TTLCache(
+    maxsize=int(os.getenv('CHAT_SUMMARY_CACHE_SIZE', '1000')),
+    ttl=int(os.getenv('CHAT_SUMMARY_CACHE_TTL', str(6 * 3600)))
+)
+
+_MESSAGE_OVERHEAD_TOKENS = 4  # 每則訊息的角色與分隔符
+
+
+def count_tokens(text):
+    """
+    在本地估算 token 數（不需呼叫 API）
+
+    中日韓文字大約一字一個 token，其他文字大約每 4 個字元一個 token。
+    """
+    if not text:
+        return 0
+    wide = 0
+    other = 0
+    for ch in text:
+        if unicodedata.east_asian_width(ch) in ('W', 'F'):
+            wide += 1
+        else:
+            other += 1
+    return wide + (other + 3) // 4
+
+
+def count_message_tokens(message):
+    return count_tokens(message.get('content', '')) + _MESSAGE_OVERHEAD_TOKENS
+
+
+def _prefix_digests(turns):
+    """逐則累加雜湊，回傳前 1..n 則訊息各自的雜湊（內容以長度前綴分隔，不會互相混淆）"""
+    hasher = hashlib.sha1()
+    digests = []
+    for turn in turns:
+        content = turn.get('content', '')
+        hasher.update(f"{turn['role']}:{len(content)}:{content}".encode('utf-8'))
+        digests.append(hasher.hexdigest()[:16])
+    return digests
+
+
+def _format_turns(turns):
+    return '\n'.join(
+        f"{'用戶' if turn['role'] == 'user' else '助手'}：{turn.get('content', '')}" for turn in turns
+    )
+
+
+def _get_summary(key, older_turns, summarize):
+    """
+    取得較舊訊息的滾動摘要；只有在累積足夠多的新舊訊息時才重新產生
+
+    摘要以它涵蓋的完整訊息前綴雜湊為鍵，只有前綴逐字相同的對話才會共用；
+    對話被截斷或改寫過時自然找不到舊摘要。
+
+    :return: (摘要文字, 摘要涵蓋的訊息數)
+    """
+    digests = _prefix_digests(older_turns) if key else []
+    covered, summary = 0, ''
+    for length in range(len(digests), 0, -1):
+        cached = _summary_cache.get(f'{key}:{digests[length - 1]}')
+        if cached is not None:
+            covered, summary = length, cached
+            break
+
+    pending = older_turns[covered:]
+    if len(pending) >= SUMMARY_REFRESH_TURNS:
+        try:
+            summary = summarize(summary, _format_turns(pending))
+            covered = len(older_turns)
+            if key:
+                _summary_cache.set(f'{key}:{digests[-1]}', summary)
+        except Exception as e:
+            logging.warning(f"對話摘要產生失敗，沿用舊摘要: {str(e)}")
+
+    return summary, covered
+
+
+def build_context(system_prompt, chat_history, user_message, endpoint='chat', key=None, summarize=None):
+    """
+    在 token 預算內組合送給 LLM 的訊息列表
+
+    - 系統提示詞與最新訊息一定保留
+    - 最近 KEEP_RECENT_TURNS 則訊息原文保留
+    - 更早的訊息折疊成快取的滾動摘要；尚未摘要的部分在預算允許時原文保留
+
+    :param system_prompt: 系統提示詞
+    :param chat_history: 之前的對話歷史 [{"role": "user"/"assistant", "content": "message"}, ...]
+    :param user_message: 最新的用戶訊息
+    :param endpoint: 端點名稱，用來查詢 CONTEXT_BUDGETS
+    :param key: 摘要快取的命名空間（使用者ID或伺服器端對話），None 時不使用快取
+    :param summarize: 摘要函式 summarize(舊摘要, 新訊息文字) -> 新摘要，None 時直接捨棄舊訊息
+    :return: 訊息列表
+    """
+    budget = CONTEXT_BUDGETS.get(endpoint, DEFAULT_CONTEXT_BUDGET)
+    turns = [msg for msg in (chat_history or []) if msg.get('role') in ('user', 'assistant')]
+
+    system_message = {'role': 'system', 'content': system_prompt}
+    latest_message = {'role': 'user', 'content': user_message}
+    used = count_message_tokens(system_message) + count_message_tokens(latest_message)
+
+    recent = turns[-KEEP_RECENT_TURNS:] if KEEP_RECENT_TURNS else []
+    older = turns[:len(turns) - len(recent)]
+
+    summary, covered = ('', 0)
+    if older and summarize:
+        summary, covered = _get_summary(key, older, summarize)
+
+    summary_message = None
+    if summary:
+        summary_message = {'role': 'system', 'content': f'先前對話摘要：\n{summary}'}
+        used += count_message_tokens(summary_message)
+
+    # 由新到舊放入訊息，超出預算的較舊訊息捨棄
+    kept = []
+    for msg in reversed(recent):
+        cost = count_message_tokens(msg)
+        if used + cost > budget:
+            break
+        kept.append(msg)
+        used += cost
+    else:
+        for msg in reversed(older[covered:]):
+            cost = count_message_tokens(msg)
+            if used + cost > budget:
+                break
+            kept.append(msg)
+            used += cost
+
+    kept.reverse()
+    dropped = len(turns) - len(kept) - covered
+    if dropped > 0:
+        logging.info(f"上下文超出預算({budget} tokens)，略過 {dropped} 則較舊訊息")
+
+    messages = [system_message]
+    if summary_message:
+        messages.append(summary_message)
+    messages.extend({'role': msg['role'], 'content': msg.get('content', '')} for msg in kept)
+    messages.append(latest_message)
+    return messages
@@ -0,0 +1,361 @@
+# llm_model/gateway.py
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+import httpx
+from dotenv import load_dotenv
+from mistralai import Mistral
+
+from llm_model.circuit_breaker import mistral_breaker
+from llm_model.single_flight import SingleFlight, payload_key
+from llm_model import model_router
+from llm_model.context_builder import count_message_tokens
+from monitoring.metrics import DEPENDENCY_ERRORS, observe_llm
+
+load_dotenv()
+
+DEFAULT_MODEL = "open-mistral-nemo"
+
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '8'))            # 全域同時呼叫上限
+LLM_MODEL_CONCURRENCY = int(os.getenv('LLM_MODEL_CONCURRENCY', '4'))        # 每個模型的預設上限
+LLM_MODEL_LIMITS = os.getenv('LLM_MODEL_LIMITS', '')                        # 個別模型上限，如 "open-mistral-7b=2,open-mistral-nemo=6"
+LLM_RATE_PER_SEC = float(os.getenv('LLM_RATE_PER_SEC', '5'))                # 權杖桶補充速率（次/秒）
+LLM_RATE_BURST = int(os.getenv('LLM_RATE_BURST', '10'))                     # 權杖桶容量
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', '60'))             # 排隊等待上限（秒）
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '3'))
+LLM_BACKOFF_BASE = float(os.getenv('LLM_BACKOFF_BASE', '0.5'))
+LLM_BACKOFF_CAP = float(os.getenv('LLM_BACKOFF_CAP', '20'))
+LLM_HTTP_TIMEOUT = float(os.getenv('LLM_HTTP_TIMEOUT', '120'))
+LLM_HTTP_POOL_SIZE = int(os.getenv('LLM_HTTP_POOL_SIZE', str(LLM_MAX_CONCURRENCY * 2)))
+
+_RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+class GatewayBusyError(Exception):
+    """排隊等待 LLM 呼叫名額逾時"""
+
+
+class _TokenBucket:
+    """權杖桶限速；收到 429 時可依 Retry-After 暫停發放"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline):
+        """取得一個權杖，必要時等待；超過 deadline 回傳 False"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+
+def _parse_model_limits(spec):
+    limits = {}
+    for item in spec.split(','):
+        if '=' in item:
+            name, value = item.split('=', 1)
+            limits[name.strip()] = int(value)
+    return limits
+
+
+# 共用的連線池與客戶端：所有 Mistral 呼叫重用同一組 keep-alive 連線
+_http_client = httpx.Client(
+    timeout=LLM_HTTP_TIMEOUT,
+    limits=httpx.Limits(max_connections=LLM_HTTP_POOL_SIZE, max_keepalive_connections=LLM_HTTP_POOL_SIZE)
+)
+client = Mistral(api_key=os.getenv("MISTRAL_API_KEY"), client=_http_client)
+
+_global_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+_model_limits = _parse_model_limits(LLM_MODEL_LIMITS)
+_model_slots = {}
+_bucket = _TokenBucket(LLM_RATE_PER_SEC, LLM_RATE_BURST)
+_langchain_llm = None
+_single_flight = SingleFlight()
+
+_stats = {
+    'waiting': 0,          # 目前排隊中的呼叫
+    'in_flight': 0,        # 目前執行中的呼叫
+    'in_flight_by_model': {},
+    'calls': 0,
+    'failures': 0,         # 計入斷路器的上游失敗
+    'client_errors': 0,    # 請求本身有誤的 4xx（不計入斷路器）
+    'retries': 0,
+    'rate_limited': 0,     # 收到 429 的次數
+    'busy_rejections': 0,  # 排隊逾時被拒絕的次數
+    'admitted': 0,         # 取得名額的呼叫（含重試）
+    'total_wait_ms': 0.0,
+}
+_lock = threading.Lock()
+
+
+def _get_model_slots(model):
+    with _lock:
+        if model not in _model_slots:
+            _model_slots[model] = threading.BoundedSemaphore(_model_limits.get(model, LLM_MODEL_CONCURRENCY))
+        return _model_slots[model]
+
+
+@contextmanager
+def _slot(model):
+    """依序取得全域名額、模型名額與限速權杖，並記錄排隊與執行中的數量"""
+    deadline = time.monotonic() + LLM_QUEUE_TIMEOUT
+    model_slots = _get_model_slots(model)
+    started = time.monotonic()
+    with _lock:
+        _stats['waiting'] += 1
+
+    acquired = []
+    try:
+        for semaphore in (_global_slots, model_slots):
+            if not semaphore.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                raise GatewayBusyError(f'LLM 呼叫排隊逾時（{model}）')
+            acquired.append(semaphore)
+        if not _bucket.acquire(deadline):
+            raise GatewayBusyError(f'LLM 呼叫排隊逾時（{model}）')
+    except GatewayBusyError:
+        for semaphore in reversed(acquired):
+            semaphore.release()
+        with _lock:
+            _stats['waiting'] -= 1
+            _stats['busy_rejections'] += 1
+        raise
+
+    with _lock:
+        _stats['waiting'] -= 1
+        _stats['in_flight'] += 1
+        _stats['admitted'] += 1
+        _stats['in_flight_by_model'][model] = _stats['in_flight_by_model'].get(model, 0) + 1
+        _stats['total_wait_ms'] += (time.monotonic() - started) * 1000
+    try:
+        yield
+    finally:
+        with _lock:
+            _stats['in_flight'] -= 1
+            _stats['in_flight_by_model'][model] -= 1
+        model_slots.release()
+        _global_slots.release()
+
+
+def _status_code(error):
+    """從 Mistral SDK 或 httpx 的例外取出 HTTP 狀態碼"""
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        response = getattr(error, 'raw_response', None) or getattr(error, 'response', None)
+        status = getattr(response, 'status_code', None)
+    return status
+
+
+def _retry_after(error):
+    """讀取 429 回應的 Retry-After（秒），沒有時回傳 None"""
+    response = getattr(error, 'raw_response', None) or getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_retryable(error):
+    if isinstance(error, (httpx.TimeoutException, httpx.TransportError)):
+        return True
+    return _status_code(error) in _RETRYABLE_STATUS
+
+
+def _backoff(attempt, error, model):
+    """計算重試前的等待時間（指數退避 + 隨機抖動，429 時至少等到 Retry-After）並記錄統計"""
+    delay = random.uniform(0, min(LLM_BACKOFF_CAP, LLM_BACKOFF_BASE * 2 ** attempt))
+    if _status_code(error) == 429:
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            # 429 代表整個帳號被限速，暫停所有呼叫而非只有這一個
+            _bucket.pause(retry_after)
+            delay = max(delay, retry_after)
+        with _lock:
+            _stats['rate_limited'] += 1
+    with _lock:
+        _stats['retries'] += 1
+    logging.warning(f"LLM 呼叫失敗（{model}，第 {attempt + 1} 次）: {str(error)}，{delay:.2f} 秒後重試")
+    return delay
+
+
+def _observe(model, operation, elapsed_ms, usage):
+    """把實際耗時與 token 用量回報給指標與模型路由器"""
+    observe_llm(model, operation, elapsed_ms / 1000, usage)
+    if usage is not None:
+        model_router.observe(model, elapsed_ms, usage.prompt_tokens, usage.completion_tokens)
+
+
+def _resolve_model(model, endpoint, messages, expected_output_tokens, kwargs):
+    """未指定模型時，依端點、輸入大小與預期輸出交給模型路由器決定"""
+    if model is not None:
+        return model
+    prompt_tokens = sum(count_message_tokens(m) for m in messages)
+    if expected_output_tokens is None:
+        expected_output_tokens = kwargs.get('max_tokens', 500)
+    return model_router.route(endpoint, prompt_tokens, expected_output_tokens)
+
+
+def _is_upstream_failure(error):
+    """連線錯誤、逾時、429 與 5xx 代表上游不可用；其他 4xx 是請求本身的問題"""
+    if isinstance(error, (httpx.TimeoutException, httpx.TransportError)):
+        return True
+    status = _status_code(error)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def _record_failure(error):
+    """只有上游失敗才計入斷路器，避免少數格式錯誤的請求讓所有目標建立改走快速模式"""
+    upstream = _is_upstream_failure(error)
+    with _lock:
+        _stats['failures' if upstream else 'client_errors'] += 1
+    if upstream:
+        mistral_breaker.record_failure()
+
+
+def call(fn, *args, model=DEFAULT_MODEL, **kwargs):
+    """
+    在閘道的並行上限與限速下執行一次 LLM 呼叫，可重試的錯誤以指數退避（含隨機抖動）重試
+
+    :param fn: 實際發出請求的函式（如 client.chat.complete）
+    :param model: 模型名稱，用於每模型的並行上限
+    :raises GatewayBusyError: 排隊等待逾時
+    """
+    with _lock:
+        _stats['calls'] += 1
+
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            with _slot(model):
+                started = time.perf_counter()
+                result = fn(*args, **kwargs)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+            mistral_breaker.record_success()
+            _observe(model, getattr(fn, '__name__', 'call'), elapsed_ms, getattr(result, 'usage', None))
+            return result
+        except GatewayBusyError:
+            raise
+        except Exception as e:
+            DEPENDENCY_ERRORS.inc(dependency='mistral', operation=getattr(fn, '__name__', 'call'))
+            if attempt >= LLM_MAX_RETRIES or not _is_retryable(e):
+                _record_failure(e)
+                raise
+            time.sleep(_backoff(attempt, e, model))
+
+
+def complete(messages, model=None, endpoint=None, expected_output_tokens=None, coalesce=True, **kwargs):
+    """
+    經由閘道呼叫 client.chat.complete
+
+    :param model: 指定模型；None 時由模型路由器依 endpoint 決定
+    :param endpoint: 端點名稱，用於模型路由（見 model_router.ENDPOINT_ROUTES）
+    :param expected_output_tokens: 預期輸出 token 數，未提供時以 max_tokens 估算
+    :param coalesce: 是否與進行中、內容完全相同的請求共用同一次上游呼叫
+        （例如使用者重複送出）；需要每次取得不同取樣結果時傳入 False
+    """
+    model = _resolve_model(model, endpoint, messages, expected_output_tokens, kwargs)
+    if not coalesce:
+        return call(client.chat.complete, model=model, messages=messages, **kwargs)
+    key = payload_key(model=model, messages=messages, **kwargs)
+    return _single_flight.do(key, call, client.chat.complete, model=model, messages=messages, **kwargs)
+
+
+def stream(messages, model=None, endpoint=None, expected_output_tokens=None, **kwargs):
+    """
+    經由閘道呼叫 client.chat.stream，產生上游的串流事件（模型選擇同 complete）
+
+    只有建立串流的請求會重試（已開始輸出後不重試，避免內容重複）；
+    整個串流期間都佔用一個呼叫名額，呼叫端關閉此產生器時會釋放名額並關閉上游連線。
+    """
+    model = _resolve_model(model, endpoint, messages, expected_output_tokens, kwargs)
+    with _lock:
+        _stats['calls'] += 1
+
+    with ExitStack() as stack:
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            attempt_stack = ExitStack()
+            try:
+                attempt_stack.enter_context(_slot(model))
+                events = attempt_stack.enter_context(client.chat.stream(model=model, messages=messages, **kwargs))
+            except GatewayBusyError:
+                raise
+            except Exception as e:
+                attempt_stack.close()
+                DEPENDENCY_ERRORS.inc(dependency='mistral', operation='stream')
+                if attempt >= LLM_MAX_RETRIES or not _is_retryable(e):
+                    _record_failure(e)
+                    raise
+                time.sleep(_backoff(attempt, e, model))
+                continue
+            stack.enter_context(attempt_stack)
+            break
+
+        started = time.perf_counter()
+        usage = None
+        try:
+            for event in events:
+                usage = getattr(event.data, 'usage', None) or usage
+                yield event
+        except Exception as e:
+            _record_failure(e)
+            raise
+        mistral_breaker.record_success()
+        _observe(model, 'stream', (time.perf_counter() - started) * 1000, usage)
+
+
+def get_langchain_llm():
+    """共用的 ChatMistralAI（重試交由閘道處理）"""
+    global _langchain_llm
+    with _lock:
+        if _langchain_llm is None:
+            from langchain_mistralai import ChatMistralAI
+            _langchain_llm = ChatMistralAI(
+                mistral_api_key=os.getenv("MISTRAL_API_KEY"),
+                model=DEFAULT_MODEL,
+                temperature=0.1,
+                max_retries=0,
+            )
+        return _langchain_llm
+
+
+def invoke_langchain(prompt):
+    """經由閘道呼叫共用的 ChatMistralAI"""
+    llm = get_langchain_llm()
+    return call(llm.invoke, prompt, model=llm.model)
+
+
+def get_gateway_stats():
+    """回傳排隊深度、執行中數量與重試統計"""
+    with _lock:
+        stats = {**_stats, 'in_flight_by_model': dict(_stats['in_flight_by_model'])}
+    total_wait_ms = stats.pop('total_wait_ms')
+    stats['avg_wait_ms'] = round(total_wait_ms / stats['admitted'], 1) if stats['admitted'] else 0.0
+    stats['limits'] = {
+        'global': LLM_MAX_CONCURRENCY,
+        'per_model': {**{m: LLM_MODEL_CONCURRENCY for m in _model_slots}, **_model_limits},
+        'rate_per_sec': LLM_RATE_PER_SEC,
+        'burst': LLM_RATE_BURST,
+    }
+    stats['single_flight'] = _single_flight.stats()
+    return stats
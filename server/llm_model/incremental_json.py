@@ -0,0 +1,67 @@
+# llm_model/incremental_json.py
+import json
+import logging
+
+
+class TaskArrayParser:
+    """
+    增量解析串流中的 JSON，每當任務陣列中的一個物件完整出現就立即取出
+
+    支援 {"tasks": [{...}, ...]} 與直接輸出的 [{...}, ...] 兩種形式：
+    只取「父層為陣列、且陣列位於最外層或最外層物件之下」的物件。
+    只掃描新進的文字，不重複解析已處理的部分。
+    """
+
+    def __init__(self):
+        self._text = ''
+        self._pos = 0
+        self._stack = []        # 目前開啟中的 '{' / '['
+        self._in_string = False
+        self._escaped = False
+        self._item_start = None  # 目前任務物件在 _text 中的起點
+
+    @property
+    def text(self):
+        """目前收到的完整文字"""
+        return self._text
+
+    def feed(self, chunk):
+        """
+        加入新的文字片段
+
+        :return: 這次新完成的任務物件列表
+        """
+        self._text += chunk
+        items = []
+        text = self._text
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == '\\':
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                if ch == '{' and self._stack and self._stack[-1] == '[' and len(self._stack) <= 2:
+                    self._item_start = i
+                self._stack.append(ch)
+            elif ch in '}]':
+                if not self._stack:
+                    continue
+                self._stack.pop()
+                if ch == '}' and self._item_start is not None and self._stack and self._stack[-1] == '[' \
+                        and len(self._stack) <= 2:
+                    raw = text[self._item_start:i + 1]
+                    self._item_start = None
+                    try:
+                        items.append(json.loads(raw))
+                    except json.JSONDecodeError:
+                        logging.warning(f"略過無法解析的任務片段: {raw[:80]}")
+        self._pos = len(text)
+        return items
@@ -1,15 +1,126 @@
 # llm_model/llm_services.py
 import os
 import json
+import logging
 from datetime import datetime
-from mistralai import Mistral
 from flask import jsonify
 from dotenv import load_dotenv
+from llm_model.response_cache import make_cache_key, get_cached_tasks, store_tasks
+from llm_model.circuit_breaker import mistral_breaker, CircuitOpenError
+from llm_model import gateway
+from llm_model.model_router import expected_task_output_tokens
+from llm_model.incremental_json import TaskArrayParser
+from llm_model.task_repair import (
+    StreamingTaskRepairer,
+    UnrecoverableOutputError,
+    build_reask_message,
+    record_result,
+    repair_output,
+    validate_output,
+)
 
 load_dotenv()
 
-# 初始化 Mistral 客戶端
-client = Mistral(api_key=os.getenv("MISTRAL_API_KEY"))
+# 任務拆解預設的 JSON 結構
+DEFAULT_TASK_SCHEMA = {
+    "tasks": [
+        {
+            "task_name": "string",
+            "due_date": "YYYY-MM-DD",
+            "priority": "high/medium/low",
+            "dependencies": ["string"],
+        }
+    ]
+}
+
+
+def _complete_json(messages: list, endpoint: str, expected_output_tokens: int) -> str:
+    """經由閘道呼叫 Mistral（JSON 模式，模型由路由器決定），回傳原始文字"""
+    response = gateway.complete(
+        messages,
+        endpoint=endpoint,
+        expected_output_tokens=expected_output_tokens,
+        response_format={"type": "json_object"}
+    )
+    return response.choices[0].message.content
+
+
+def _parse_and_repair(content: str, json_schema: dict, created_date, deadline_date):
+    """解析 JSON、本地修復並以編譯後的結構驗證；無法修復時拋出 UnrecoverableOutputError"""
+    try:
+        result = json.loads(content)
+    except json.JSONDecodeError as e:
+        raise UnrecoverableOutputError([f"JSON 解析失敗: {str(e)}"])
+
+    result, repairs = repair_output(result, created_date, deadline_date)
+    errors = validate_output(result, json_schema)
+    if errors:
+        raise UnrecoverableOutputError(errors)
+    return result, repairs
+
+
+def _build_habits_prompt(user_habits):
+    """組織使用者習慣資訊（系統提示詞用）"""
+    habits_prompt = ""
+    if user_habits and len(user_habits) > 0:
+        habits_prompt = "使用者習慣資訊：\n"
+        for habit in user_habits:
+            habits_prompt += f"- 習慣名稱：{habit.get('name', '')}\n"
+            if 'frequency' in habit:
+                habits_prompt += f"  頻率：{habit.get('frequency', '')}\n"
+            if 'intensity' in habit:
+                habits_prompt += f"  強度：{habit.get('intensity', '')}\n"
+            if 'description' in habit:
+                habits_prompt += f"  描述：{habit.get('description', '')}\n"
+        habits_prompt += "\n"
+    return habits_prompt
+
+
+def _build_habits_summary(user_habits):
+    """組織使用者習慣資訊的簡短摘要（使用者提示詞用）"""
+    habits_summary = ""
+    if user_habits and len(user_habits) > 0:
+        habits_summary = "User Habits:\n"
+        for habit in user_habits:
+            habits_summary += f"- {habit.get('name', '')}: {habit.get('frequency', '')} frequency, {habit.get('intensity', '')} intensity\n"
+    return habits_summary
+
+
+def _build_task_messages(event_name, event_deadline, created_date, event_description, user_habits, json_schema):
+    """組合任務拆解的系統提示詞與使用者提示詞"""
+    # 組織使用者習慣資訊
+    habits_prompt = _build_habits_prompt(user_habits)
+
+    # 組合提示詞 (包含創建時間和使用者習慣)
+    system_prompt = f"""你是一位專業任務規劃助理。請根據下方的 eventDescription，嚴格拆解出每日任務，並只以純 JSON 格式回傳（不要有任何說明文字）。
+
+eventDescription: "{event_description}"
+
+{habits_prompt}請參考上述使用者習慣，讓任務安排與使用者的習慣保持一致。
+
+請嚴格遵守以下 JSON 結構：
+{json.dumps(json_schema, indent=2, ensure_ascii=False)}
+
+規則：
+1. 只允許輸出 JSON，不能有其他文字。
+2. 每個任務必須能從 eventDescription 找到依據。
+3. 每個任務的 due_date 必須介於目標創建時間 ({created_date.strftime('%Y-%m-%d')}) 和截止日期 ({event_deadline}) 之間，且格式為 YYYY-MM-DD。
+4. 任務名稱務必用中文。
+5. 任務規劃應考慮用戶習慣，調整任務的安排以適應用戶的生活習慣。"""
+
+    # 組織使用者習慣資訊的簡短摘要
+    habits_summary = _build_habits_summary(user_habits)
+
+    user_prompt = f"""
+            Goal Name: {event_name}
+            Deadline: {event_deadline}
+            Description: {event_description}
+            {habits_summary}"""
+
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
 
 
 def generate_structured_output(
@@ -41,88 +152,241 @@ def generate_structured_output(
         if created_date >= deadline_date:
             raise ValueError("截止日期必須晚於創建時間")
 
-        default_schema = {
-            "tasks": [
-                {
-                    "task_name": "string",
-                    "due_date": "YYYY-MM-DD",
-                    "priority": "high/medium/low",
-                    "dependencies": ["string"],
-                }
+        json_schema = json_schema or DEFAULT_TASK_SCHEMA
+
+        # 相同（正規化後）輸入直接使用快取結果，任務日期平移到這次的創建日期
+        cache_key = make_cache_key(
+            event_name,
+            event_description,
+            (deadline_date - created_date).days,
+            user_habits,
+            json_schema
+        )
+        cached = get_cached_tasks(cache_key, created_date)
+        if cached is not None:
+            return cached
+
+        # 斷路器斷開時不呼叫 API，讓呼叫端改用備援方案
+        if not mistral_breaker.allow():
+            return {"error": "LLM 服務暫時無法使用（斷路器已斷開）", "circuit_open": True}
+
+        messages = _build_task_messages(
+            event_name, event_deadline, created_date, event_description, user_habits, json_schema
+        )
+        # 預期輸出大小依截止日期距離（任務數）估算，供模型路由使用
+        expected_output = expected_task_output_tokens((deadline_date - created_date).days)
+        content = _complete_json(messages, 'goal_breakdown', expected_output)
+
+        # 先在本地驗證並修復（日期夾回範圍、優先級正規化、移除循環依賴等）
+        try:
+            result, repairs = _parse_and_repair(content, json_schema, created_date, deadline_date)
+            record_result(repairs)
+        except UnrecoverableOutputError as e:
+            # 無法修復時才重問一次，且只要求修正具體問題
+            logging.warning(f"LLM 輸出無法修復，重問: {e.errors[:5]}")
+            messages += [
+                {"role": "assistant", "content": content},
+                {"role": "user", "content": build_reask_message(e.errors)}
             ]
-        }
-        json_schema = json_schema or default_schema
-
-        # 組織使用者習慣資訊
-        habits_prompt = ""
-        if user_habits and len(user_habits) > 0:
-            habits_prompt = "使用者習慣資訊：\n"
-            for habit in user_habits:
-                habits_prompt += f"- 習慣名稱：{habit.get('name', '')}\n"
-                if 'frequency' in habit:
-                    habits_prompt += f"  頻率：{habit.get('frequency', '')}\n"
-                if 'intensity' in habit:
-                    habits_prompt += f"  強度：{habit.get('intensity', '')}\n"
-                if 'description' in habit:
-                    habits_prompt += f"  描述：{habit.get('description', '')}\n"
-            habits_prompt += "\n"
-
-        # 組合提示詞 (包含創建時間和使用者習慣)
-        system_prompt = f"""你是一位專業任務規劃助理。請根據下方的 eventDescription，嚴格拆解出每日任務，並只以純 JSON 格式回傳（不要有任何說明文字）。
+            try:
+                result, repairs = _parse_and_repair(_complete_json(messages, 'goal_breakdown', expected_output), json_schema, created_date, deadline_date)
+                record_result(repairs, unrecoverable=True, reasked=True)
+            except UnrecoverableOutputError as retry_error:
+                record_result(unrecoverable=True, reasked=True, reask_failed=True)
+                return {"error": f"任務輸出無法修復: {str(retry_error)}"}
 
-eventDescription: "{event_description}"
+        store_tasks(cache_key, created_date, result)
+        return result
 
-{habits_prompt}請參考上述使用者習慣，讓任務安排與使用者的習慣保持一致。
+    except json.JSONDecodeError as e:
+        return {"error": f"JSON 解析失敗: {str(e)}"}
+    except Exception as e:
+        return {"error": f"API 呼叫失敗: {str(e)}"}
 
-請嚴格遵守以下 JSON 結構：
-{json.dumps(json_schema, indent=2, ensure_ascii=False)}
+def stream_structured_output(
+        event_name: str,
+        event_deadline: str,
+        created_at: datetime,
+        event_description: str,
+        user_habits: list = None
+):
+    """
+    串流版的 generate_structured_output：LLM 每輸出完一個任務物件就立即修復並產生，不等整份 JSON
+
+    產生的事件：
+    - {"type": "task", "task": {...}}：一個已修復的任務
+    - {"type": "done", "repairs": {...}, "cached": bool}：全部完成
+
+    :raises CircuitOpenError: 斷路器斷開
+    :raises UnrecoverableOutputError: 整份輸出沒有任何可用的任務
+    """
+    deadline_date = datetime.strptime(event_deadline, "%Y-%m-%d").date()
+    created_date = created_at.date()
+    if created_date >= deadline_date:
+        raise ValueError("截止日期必須晚於創建時間")
+
+    cache_key = make_cache_key(
+        event_name,
+        event_description,
+        (deadline_date - created_date).days,
+        user_habits,
+        DEFAULT_TASK_SCHEMA
+    )
+    cached = get_cached_tasks(cache_key, created_date)
+    if cached is not None:
+        for task in cached.get('tasks', []):
+            yield {"type": "task", "task": task}
+        yield {"type": "done", "repairs": {}, "cached": True}
+        return
+
+    if not mistral_breaker.allow():
+        raise CircuitOpenError("LLM 服務暫時無法使用（斷路器已斷開）")
+
+    messages = _build_task_messages(
+        event_name, event_deadline, created_date, event_description, user_habits, DEFAULT_TASK_SCHEMA
+    )
+    parser = TaskArrayParser()
+    repairer = StreamingTaskRepairer(created_date, deadline_date)
+    stream = gateway.stream(
+        messages,
+        endpoint='goal_breakdown',
+        expected_output_tokens=expected_task_output_tokens((deadline_date - created_date).days),
+        response_format={"type": "json_object"}
+    )
+    try:
+        for event in stream:
+            chunk = event.data
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            for raw in parser.feed(chunk.choices[0].delta.content):
+                task = repairer.repair(raw)
+                if task is not None:
+                    yield {"type": "task", "task": task}
+    finally:
+        stream.close()
+
+    if not repairer.tasks:
+        record_result(unrecoverable=True)
+        raise UnrecoverableOutputError(['沒有任何可用的任務'])
+
+    record_result(repairer.repairs)
+    store_tasks(cache_key, created_date, {"tasks": repairer.tasks})
+    yield {"type": "done", "repairs": repairer.repairs, "cached": False}
+
+
+def generate_packed_structured_output(goals: list, created_at: datetime, user_habits: list = None) -> list:
+    """
+    把多個小目標合併成一次 LLM 呼叫拆解（批次匯入用）
+
+    每個目標的結果各自經過本地修復與驗證並寫入快取；
+    合併輸出中缺少或無法修復的目標，改為單獨呼叫 generate_structured_output。
+
+    :param goals: [{"eventName", "eventDeadLine", "eventDescription"}, ...]
+    :param created_at: 目標創建時間 (datetime物件)
+    :param user_habits: 使用者的習慣列表
+    :return: 與 goals 順序相同的結果列表，格式同 generate_structured_output
+    """
+    created_date = created_at.date()
+    results = [None] * len(goals)
+    pending = []  # (位置, 截止日期, 快取鍵)
+    for i, goal in enumerate(goals):
+        deadline_date = datetime.strptime(goal['eventDeadLine'], "%Y-%m-%d").date()
+        if created_date >= deadline_date:
+            results[i] = {"error": "截止日期必須晚於創建時間"}
+            continue
+        cache_key = make_cache_key(
+            goal['eventName'],
+            goal['eventDescription'],
+            (deadline_date - created_date).days,
+            user_habits,
+            DEFAULT_TASK_SCHEMA
+        )
+        cached = get_cached_tasks(cache_key, created_date)
+        if cached is not None:
+            results[i] = cached
+        else:
+            pending.append((i, deadline_date, cache_key))
+
+    def generate_single(i):
+        return generate_structured_output(
+            event_name=goals[i]['eventName'],
+            event_deadline=goals[i]['eventDeadLine'],
+            created_at=created_at,
+            event_description=goals[i]['eventDescription'],
+            user_habits=user_habits
+        )
+
+    if len(pending) == 1:
+        results[pending[0][0]] = generate_single(pending[0][0])
+    if len(pending) <= 1:
+        return results
+
+    if not mistral_breaker.allow():
+        for i, _, _ in pending:
+            results[i] = {"error": "LLM 服務暫時無法使用（斷路器已斷開）", "circuit_open": True}
+        return results
+
+    goals_prompt = "\n".join(
+        f"- goal_index: {n}\n"
+        f"  eventName: \"{goals[i]['eventName']}\"\n"
+        f"  deadline: {goals[i]['eventDeadLine']}\n"
+        f"  eventDescription: \"{goals[i]['eventDescription']}\""
+        for n, (i, _, _) in enumerate(pending)
+    )
+    system_prompt = f"""你是一位專業任務規劃助理。請分別為下列每一個目標，依其 eventDescription 嚴格拆解出每日任務，並只以純 JSON 格式回傳（不要有任何說明文字）。
+
+{_build_habits_prompt(user_habits)}請參考上述使用者習慣，讓任務安排與使用者的習慣保持一致。
+
+請嚴格遵守以下 JSON 結構（goals 中每個目標各一項，goal_index 對應輸入的編號）：
+{json.dumps({"goals": [{"goal_index": 0, **DEFAULT_TASK_SCHEMA}]}, indent=2, ensure_ascii=False)}
 
 規則：
 1. 只允許輸出 JSON，不能有其他文字。
-2. 每個任務必須能從 eventDescription 找到依據。
-3. 每個任務的 due_date 必須介於目標創建時間 ({created_date.strftime('%Y-%m-%d')}) 和截止日期 ({event_deadline}) 之間，且格式為 YYYY-MM-DD。
+2. 每個任務必須能從該目標的 eventDescription 找到依據，不同目標的任務不可混用。
+3. 每個任務的 due_date 必須介於目標創建時間 ({created_date.strftime('%Y-%m-%d')}) 和該目標的截止日期之間，且格式為 YYYY-MM-DD。
 4. 任務名稱務必用中文。
 5. 任務規劃應考慮用戶習慣，調整任務的安排以適應用戶的生活習慣。"""
 
-        # 組織使用者習慣資訊的簡短摘要
-        habits_summary = ""
-        if user_habits and len(user_habits) > 0:
-            habits_summary = "User Habits:\n"
-            for habit in user_habits:
-                habits_summary += f"- {habit.get('name', '')}: {habit.get('frequency', '')} frequency, {habit.get('intensity', '')} intensity\n"
-        
-        user_prompt = f"""
-            Goal Name: {event_name}
-            Deadline: {event_deadline}
-            Description: {event_description}
-            {habits_summary}"""
+    user_prompt = f"""
+            Goals:
+{goals_prompt}
+            {_build_habits_summary(user_habits)}"""
 
-        # 呼叫 Mistral API
-        response = client.chat.complete(
-            model="open-mistral-nemo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            response_format={"type": "json_object"}
-        )
+    try:
+        content = _complete_json([
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ], 'goal_breakdown_bulk', sum(
+            expected_task_output_tokens((deadline_date - created_date).days) for _, deadline_date, _ in pending
+        ))
+        packed = json.loads(content).get('goals', [])
+    except Exception as e:
+        logging.warning(f"合併拆解失敗，改為逐一拆解: {str(e)}")
+        packed = []
 
-        # 解析 JSON
-        result = json.loads(response.choices[0].message.content)
+    by_index = {}
+    for entry in packed if isinstance(packed, list) else []:
+        if isinstance(entry, dict) and isinstance(entry.get('goal_index'), int):
+            by_index.setdefault(entry['goal_index'], entry)
 
-        # 驗證時間區間
-        for task in result.get('tasks', []):
-            task_date = datetime.strptime(task['due_date'], "%Y-%m-%d").date()
-            if not (created_date <= task_date <= deadline_date):
-                raise ValueError(f"任務 '{task['task_name']}' 的日期超出有效範圍")
-            
+    for n, (i, deadline_date, cache_key) in enumerate(pending):
+        entry = by_index.get(n)
+        try:
+            if entry is None:
+                raise UnrecoverableOutputError(['合併輸出缺少此目標'])
+            result, repairs = repair_output({'tasks': entry.get('tasks')}, created_date, deadline_date)
+            errors = validate_output(result, DEFAULT_TASK_SCHEMA)
+            if errors:
+                raise UnrecoverableOutputError(errors)
+            record_result(repairs)
+            store_tasks(cache_key, created_date, result)
+            results[i] = result
+        except UnrecoverableOutputError as e:
+            logging.warning(f"合併輸出中目標 #{i} 無法使用，改為單獨拆解: {e.errors[:3]}")
+            results[i] = generate_single(i)
 
-        return result
+    return results
 
-    except json.JSONDecodeError as e:
-        return {"error": f"JSON 解析失敗: {str(e)}"}
-    except Exception as e:
-        return {"error": f"API 呼叫失敗: {str(e)}"}
 
 def generate_tasks_for_habit_building(habit_name: str, frequency: str, intensity: str, created_at: datetime, deadline: str) -> dict:
     """
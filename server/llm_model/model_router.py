@@ -0,0 +1,169 @@
+# llm_model/model_router.py
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 各模型的靜態特性：上下文長度，以及在正常負載下的延遲估算參數
+#   base_ms：固定開銷；prompt_ms_per_token / output_ms_per_token：每個輸入/輸出 token 的耗時
+MODEL_PROFILES = {
+    'open-mistral-nemo': {'context': 128000, 'base_ms': 400, 'prompt_ms_per_token': 0.05, 'output_ms_per_token': 14},
+    'open-mistral-7b': {'context': 32000, 'base_ms': 250, 'prompt_ms_per_token': 0.03, 'output_ms_per_token': 8},
+}
+
+# 各端點的首選模型與延遲目標（毫秒）
+ENDPOINT_ROUTES = {
+    'goal_breakdown': {'primary': 'open-mistral-nemo', 'slo_ms': 60000},
+    'goal_breakdown_bulk': {'primary': 'open-mistral-nemo', 'slo_ms': 90000},
+    'chat': {'primary': 'open-mistral-nemo', 'slo_ms': 12000},
+    'chat_stream': {'primary': 'open-mistral-nemo', 'slo_ms': 15000},
+    'chat_summary': {'primary': 'open-mistral-nemo', 'slo_ms': 8000},
+    'task_helper': {'primary': 'open-mistral-nemo', 'slo_ms': 12000},
+    'schedule': {'primary': 'open-mistral-7b', 'slo_ms': 20000},
+}
+DEFAULT_ROUTE = {'primary': 'open-mistral-nemo', 'slo_ms': 30000}
+
+LLM_ROUTER_SLOS = os.getenv('LLM_ROUTER_SLOS', '')                    # 覆寫延遲目標，如 "chat=8000,schedule=15000"
+LLM_ROUTER_WINDOW = int(os.getenv('LLM_ROUTER_WINDOW', '200'))         # 每個模型保留的最近觀測數
+LLM_ROUTER_MIN_SAMPLES = int(os.getenv('LLM_ROUTER_MIN_SAMPLES', '20'))  # 觀測數達到此值才使用 p95
+LLM_ROUTER_MAX_AGE = int(os.getenv('LLM_ROUTER_MAX_AGE', '600'))       # 秒；超過此時間的觀測不再計入
+LLM_ROUTER_RECENT = int(os.getenv('LLM_ROUTER_RECENT', '100'))         # 保留最近多少筆路由決策
+
+_TOKENS_PER_TASK = 40
+
+
+def _parse_slos(spec):
+    slos = {}
+    for item in spec.split(','):
+        if '=' in item:
+            name, value = item.split('=', 1)
+            slos[name.strip()] = int(value)
+    return slos
+
+
+_slo_overrides = _parse_slos(LLM_ROUTER_SLOS)
+# 每個模型的 (觀測時間, 實際耗時 / 靜態估算) ，用來反映目前的實際速度；
+# 流量被導離的模型不會有新的觀測，舊觀測過期後才會重新評估
+_slowdowns = {model: deque(maxlen=LLM_ROUTER_WINDOW) for model in MODEL_PROFILES}
+_decision_counts = {}
+_recent_decisions = deque(maxlen=LLM_ROUTER_RECENT)
+_lock = threading.Lock()
+
+
+def expected_task_output_tokens(span_days):
+    """依截止日期距離估算任務拆解的輸出 token 數（大約一天一個任務，上限 60 個）"""
+    return 50 + max(1, min(span_days, 60)) * _TOKENS_PER_TASK
+
+
+def _estimate_ms(model, prompt_tokens, output_tokens):
+    profile = MODEL_PROFILES[model]
+    return (profile['base_ms']
+            + prompt_tokens * profile['prompt_ms_per_token']
+            + output_tokens * profile['output_ms_per_token'])
+
+
+def _p95(values):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(len(ordered) * 0.95) - 1)]
+
+
+def _slowdown(model, now=None):
+    """目前的 p95 慢化倍數；過期的觀測先移除，觀測不足時視為 1（需持有鎖）"""
+    samples = _slowdowns.get(model)
+    if not samples:
+        return 1.0
+    cutoff = (now or time.monotonic()) - LLM_ROUTER_MAX_AGE
+    while samples and samples[0][0] < cutoff:
+        samples.popleft()
+    if len(samples) < LLM_ROUTER_MIN_SAMPLES:
+        return 1.0
+    return max(1.0, _p95([ratio for _, ratio in samples]))
+
+
+def predict_ms(model, prompt_tokens, output_tokens):
+    """以靜態估算乘上觀測到的 p95 慢化倍數，預測這次呼叫的 p95 耗時"""
+    with _lock:
+        slowdown = _slowdown(model)
+    return _estimate_ms(model, prompt_tokens, output_tokens) * slowdown
+
+
+def observe(model, elapsed_ms, prompt_tokens, output_tokens):
+    """記錄一次實際呼叫的耗時（由閘道在呼叫完成後回報）"""
+    if model not in MODEL_PROFILES or elapsed_ms <= 0:
+        return
+    estimate = _estimate_ms(model, prompt_tokens or 0, output_tokens or 0)
+    with _lock:
+        _slowdowns[model].append((time.monotonic(), elapsed_ms / estimate))
+
+
+def route(endpoint, prompt_tokens, expected_output_tokens):
+    """
+    為一次呼叫選擇模型
+
+    1. 上下文放不下的模型不考慮
+    2. 首選模型的預測 p95 耗時在延遲目標內時使用首選模型
+    3. 否則改用預測耗時在目標內的最快模型；都超過時使用最快的模型
+
+    :param endpoint: 端點名稱（見 ENDPOINT_ROUTES）
+    :param prompt_tokens: 估算的輸入 token 數
+    :param expected_output_tokens: 預期的輸出 token 數
+    :return: 模型名稱
+    """
+    config = ENDPOINT_ROUTES.get(endpoint, DEFAULT_ROUTE)
+    primary = config['primary']
+    slo_ms = _slo_overrides.get(endpoint, config['slo_ms'])
+
+    needed = prompt_tokens + expected_output_tokens
+    fits = [m for m, profile in MODEL_PROFILES.items() if profile['context'] >= needed] or [primary]
+    predictions = {m: predict_ms(m, prompt_tokens, expected_output_tokens) for m in fits}
+
+    if primary in predictions and predictions[primary] <= slo_ms:
+        model, reason = primary, 'primary'
+    else:
+        within = [m for m in fits if predictions[m] <= slo_ms]
+        if primary not in predictions:
+            reason = 'context'
+        elif within:
+            reason = 'primary_slow'
+        else:
+            reason = 'over_slo'
+        model = min(within or fits, key=lambda m: predictions[m])
+
+    decision = {
+        'endpoint': endpoint,
+        'model': model,
+        'reason': reason,
+        'prompt_tokens': prompt_tokens,
+        'expected_output_tokens': expected_output_tokens,
+        'slo_ms': slo_ms,
+        'predicted_ms': {m: round(ms) for m, ms in predictions.items()},
+    }
+    with _lock:
+        key = (endpoint, model, reason)
+        _decision_counts[key] = _decision_counts.get(key, 0) + 1
+        _recent_decisions.append(decision)
+
+    log = logging.info if reason == 'primary' else logging.warning
+    log(f"模型路由 {endpoint} -> {model}（{reason}，預測 {decision['predicted_ms']} ms，目標 {slo_ms} ms）")
+    return model
+
+
+def get_router_stats():
+    """回傳各模型的觀測統計與路由決策"""
+    with _lock:
+        models = {}
+        for model, samples in _slowdowns.items():
+            slowdown = _slowdown(model)  # 先移除過期觀測
+            models[model] = {'samples': len(samples), 'p95_slowdown': round(slowdown, 2)}
+        decisions = [
+            {'endpoint': endpoint, 'model': model, 'reason': reason, 'count': count}
+            for (endpoint, model, reason), count in sorted(_decision_counts.items())
+        ]
+        recent = list(_recent_decisions)
+    return {'models': models, 'decisions': decisions, 'recent': recent}
@@ -0,0 +1,176 @@
+# llm_model/response_cache.py
+import copy
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+
+from utils.cache import TTLCache
+
+load_dotenv()
+
+LLM_CACHE_SIZE = int(os.getenv('LLM_CACHE_SIZE', '512'))
+LLM_CACHE_TTL = int(os.getenv('LLM_CACHE_TTL', str(24 * 3600)))  # 秒
+LLM_CACHE_DB = os.getenv('LLM_CACHE_DB')  # 設定路徑即啟用 SQLite 磁碟快取
+
+_memory_cache = TTLCache(maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL)
+_disk_lock = threading.Lock()
+_disk_ready = False
+_counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0}
+_counters_lock = threading.Lock()
+
+
+def _count(name):
+    with _counters_lock:
+        _counters[name] += 1
+
+
+def _normalize_text(text):
+    """統一全半形、大小寫與空白，讓幾乎相同的輸入得到同一個鍵"""
+    text = unicodedata.normalize('NFKC', str(text or '')).casefold()
+    return ' '.join(text.split())
+
+
+def make_cache_key(event_name, event_description, deadline_offset_days, user_habits=None, json_schema=None):
+    """
+    以正規化後的輸入計算內容定址的快取鍵
+
+    :param event_name: 目標名稱
+    :param event_description: 目標描述
+    :param deadline_offset_days: 截止日期距離創建日期的天數
+    :param user_habits: 使用者習慣列表
+    :param json_schema: 輸出 JSON 結構
+    :return: SHA-256 十六進位字串
+    """
+    habits_summary = sorted(
+        (
+            _normalize_text(habit.get('name')),
+            _normalize_text(habit.get('frequency')),
+            _normalize_text(habit.get('intensity')),
+            _normalize_text(habit.get('description')),
+        )
+        for habit in (user_habits or [])
+    )
+    material = json.dumps([
+        _normalize_text(event_name),
+        _normalize_text(event_description),
+        int(deadline_offset_days),
+        habits_summary,
+        json_schema,
+    ], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def _connect_disk():
+    global _disk_ready
+    conn = sqlite3.connect(LLM_CACHE_DB, timeout=10, isolation_level=None)
+    if not _disk_ready:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                created_date TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        _disk_ready = True
+    return conn
+
+
+def _shift_result(entry, created_date):
+    """把快取中的任務日期平移到新的創建日期"""
+    offset = created_date - datetime.strptime(entry['created_date'], '%Y-%m-%d').date()
+    result = copy.deepcopy(entry['result'])
+    if offset:
+        for task in result.get('tasks', []):
+            try:
+                due = datetime.strptime(task['due_date'], '%Y-%m-%d').date()
+                task['due_date'] = (due + timedelta(days=offset.days)).strftime('%Y-%m-%d')
+            except (KeyError, TypeError, ValueError):
+                continue
+    return result
+
+
+def get_cached_tasks(key, created_date):
+    """
+    查詢快取（先記憶體、後磁碟），命中時回傳日期已平移的結果
+
+    :param key: make_cache_key 產生的鍵
+    :param created_date: 這次請求的創建日期 (date)
+    :return: 任務字典，未命中則回傳 None
+    """
+    entry = _memory_cache.get(key)
+    if entry is not None:
+        _count('memory_hits')
+        return _shift_result(entry, created_date)
+
+    if LLM_CACHE_DB:
+        try:
+            with _disk_lock:
+                conn = _connect_disk()
+                try:
+                    row = conn.execute(
+                        'SELECT created_date, payload, expires_at FROM llm_cache WHERE key = ?', (key,)
+                    ).fetchone()
+                finally:
+                    conn.close()
+            if row and row[2] > time.time():
+                entry = {'created_date': row[0], 'result': json.loads(row[1])}
+                _memory_cache.set(key, entry, ttl=row[2] - time.time())
+                _count('disk_hits')
+                return _shift_result(entry, created_date)
+        except Exception as e:
+            logging.warning(f"LLM 磁碟快取讀取失敗: {str(e)}")
+
+    _count('misses')
+    return None
+
+
+def store_tasks(key, created_date, result):
+    """
+    寫入快取（僅應存放已通過驗證的結果）
+
+    :param key: make_cache_key 產生的鍵
+    :param created_date: 產生此結果時的創建日期 (date)
+    :param result: LLM 解析後的任務字典
+    """
+    entry = {'created_date': created_date.strftime('%Y-%m-%d'), 'result': copy.deepcopy(result)}
+    _memory_cache.set(key, entry)
+    _count('stores')
+
+    if LLM_CACHE_DB:
+        try:
+            with _disk_lock:
+                conn = _connect_disk()
+                try:
+                    conn.execute(
+                        'INSERT OR REPLACE INTO llm_cache (key, created_date, payload, expires_at) VALUES (?, ?, ?, ?)',
+                        (key, entry['created_date'], json.dumps(result, ensure_ascii=False),
+                         time.time() + LLM_CACHE_TTL)
+                    )
+                    conn.execute('DELETE FROM llm_cache WHERE expires_at <= ?', (time.time(),))
+                finally:
+                    conn.close()
+        except Exception as e:
+            logging.warning(f"LLM 磁碟快取寫入失敗: {str(e)}")
+
+
+def get_cache_stats():
+    """回傳快取命中/未命中計數"""
+    with _counters_lock:
+        counters = dict(_counters)
+    lookups = counters['memory_hits'] + counters['disk_hits'] + counters['misses']
+    hits = counters['memory_hits'] + counters['disk_hits']
+    return {
+        **counters,
+        'hit_ratio': round(hits / lookups, 4) if lookups else 0.0,
+        'memory': _memory_cache.stats(),
+        'disk_enabled': bool(LLM_CACHE_DB),
+    }
@@ -0,0 +1,64 @@
+# llm_model/single_flight.py
+import hashlib
+import json
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    合併同時進行中的相同呼叫：同一個 key 只有第一個呼叫者（leader）真正執行，
+    其餘呼叫者等待並取得相同的結果；leader 拋出例外時，所有等待者都會收到同一個例外。
+    呼叫完成後立即移除，不做結果快取。
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {'executed': 0, 'coalesced': 0}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._stats['coalesced'] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._stats['executed'] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'in_flight_keys': len(self._calls)}
+
+
+def payload_key(**payload):
+    """以正規化後的請求內容（鍵排序、緊湊 JSON）產生 key"""
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
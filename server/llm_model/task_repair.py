@@ -0,0 +1,348 @@
+# llm_model/task_repair.py
+import json
+import re
+import threading
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+# 修復與重問的統計
+_stats = {
+    'validated': 0,       # 驗證過的回應數
+    'clean': 0,           # 不需修復即通過的回應數
+    'repaired': 0,        # 經修復後可用的回應數
+    'unrecoverable': 0,   # 無法修復、需要重問的回應數
+    'reasks': 0,          # 重問次數
+    'reask_failures': 0,  # 重問後仍無法使用的次數
+    'repairs': {},        # 各類修復的次數
+}
+_stats_lock = threading.Lock()
+
+_PRIORITY_ALIASES = {
+    'high': 'high', 'h': 'high', '高': 'high', 'urgent': 'high', 'critical': 'high', 'important': 'high',
+    'medium': 'medium', 'm': 'medium', 'mid': 'medium', 'normal': 'medium', '中': 'medium', '普通': 'medium',
+    'low': 'low', 'l': 'low', '低': 'low', 'minor': 'low',
+}
+_DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%Y.%m.%d', '%Y%m%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S')
+_CJK_DATE = re.compile(r'(\d{4})\s*年\s*(\d{1,2})\s*月\s*(\d{1,2})\s*日?')
+
+
+class UnrecoverableOutputError(ValueError):
+    """LLM 輸出無法在本地修復"""
+
+    def __init__(self, errors):
+        super().__init__('；'.join(errors))
+        self.errors = errors
+
+
+# ---------- 編譯後的結構驗證 ----------
+
+def _compile_node(example):
+    """
+    把範例形式的結構（如 {"tasks": [{"due_date": "YYYY-MM-DD"}]}）編譯成驗證函式，
+    驗證函式回傳錯誤訊息列表
+    """
+    if isinstance(example, dict):
+        fields = [(key, _compile_node(value)) for key, value in example.items()]
+
+        def check_object(value, path):
+            if not isinstance(value, dict):
+                return [f'{path} 應為物件']
+            errors = []
+            for key, check in fields:
+                if key not in value:
+                    errors.append(f'{path}.{key} 缺少')
+                else:
+                    errors.extend(check(value[key], f'{path}.{key}'))
+            return errors
+        return check_object
+
+    if isinstance(example, list):
+        item_check = _compile_node(example[0]) if example else (lambda value, path: [])
+
+        def check_list(value, path):
+            if not isinstance(value, list):
+                return [f'{path} 應為陣列']
+            errors = []
+            for i, item in enumerate(value):
+                errors.extend(item_check(item, f'{path}[{i}]'))
+            return errors
+        return check_list
+
+    if example == 'YYYY-MM-DD':
+        def check_date(value, path):
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+                return []
+            except (TypeError, ValueError):
+                return [f'{path} 應為 YYYY-MM-DD 日期']
+        return check_date
+
+    if isinstance(example, str) and '/' in example:
+        choices = tuple(example.split('/'))
+
+        def check_enum(value, path):
+            return [] if value in choices else [f'{path} 應為 {"/".join(choices)} 之一']
+        return check_enum
+
+    def check_string(value, path):
+        return [] if isinstance(value, str) and value.strip() else [f'{path} 應為非空字串']
+    return check_string
+
+
+@lru_cache(maxsize=32)
+def _compiled_validator(schema_json):
+    return _compile_node(json.loads(schema_json))
+
+
+def validate_output(result, json_schema):
+    """
+    以編譯後（並快取）的驗證器檢查 LLM 輸出
+
+    :return: 錯誤訊息列表，空列表代表通過
+    """
+    validator = _compiled_validator(json.dumps(json_schema, sort_keys=True, ensure_ascii=False))
+    return validator(result, '$')
+
+
+# ---------- 修復 ----------
+
+def _parse_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    match = _CJK_DATE.search(value)
+    if match:
+        try:
+            return datetime(int(match.group(1)), int(match.group(2)), int(match.group(3))).date()
+        except ValueError:
+            return None
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value[:19], fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _break_cycles(tasks, note):
+    """移除會形成循環的依賴（依任務順序做 DFS，刪除回邊）"""
+    graph = {task['task_name']: task for task in tasks}
+    state = {}  # name -> 'visiting' / 'done'
+
+    def visit(name):
+        state[name] = 'visiting'
+        task = graph[name]
+        kept = []
+        for dep in task['dependencies']:
+            if state.get(dep) == 'visiting':
+                note('dependency_cycle')
+                continue
+            if dep not in state:
+                visit(dep)
+            kept.append(dep)
+        task['dependencies'] = kept
+        state[name] = 'done'
+
+    for task in tasks:
+        if task['task_name'] not in state:
+            visit(task['task_name'])
+
+
+def _normalize_task(raw, seen_names, note):
+    """
+    正規化單一任務的名稱、優先級、日期格式與依賴欄位（日期可能為 None，尚未夾回範圍）
+
+    :return: 任務字典，無法使用時回傳 None
+    """
+    if not isinstance(raw, dict):
+        note('dropped_invalid_task')
+        return None
+
+    name = raw.get('task_name') or raw.get('name') or raw.get('title')
+    if not isinstance(name, str) or not name.strip():
+        note('dropped_unnamed_task')
+        return None
+    name = name.strip()
+    if name in seen_names:
+        name = f'{name} ({len(seen_names) + 1})'
+        note('renamed_duplicate')
+    seen_names.add(name)
+
+    priority = str(raw.get('priority', '')).strip().lower()
+    normalized_priority = _PRIORITY_ALIASES.get(priority)
+    if normalized_priority is None:
+        normalized_priority = 'medium'
+        note('filled_priority')
+    elif normalized_priority != raw.get('priority'):
+        note('normalized_priority')
+
+    due = _parse_date(raw.get('due_date'))
+    if due is not None and raw.get('due_date') != due.strftime('%Y-%m-%d'):
+        note('normalized_date')
+
+    dependencies = raw.get('dependencies', [])
+    if isinstance(dependencies, str):
+        dependencies = [dependencies]
+        note('normalized_dependencies')
+    elif not isinstance(dependencies, list):
+        dependencies = []
+        note('normalized_dependencies')
+
+    return {
+        **raw,
+        'task_name': name,
+        'priority': normalized_priority,
+        'due_date': due,
+        'dependencies': [d.strip() for d in dependencies if isinstance(d, str) and d.strip()],
+    }
+
+
+def _clamp_date(due, created_date, deadline_date, note):
+    if due < created_date:
+        note('clamped_date')
+        return created_date
+    if due > deadline_date:
+        note('clamped_date')
+        return deadline_date
+    return due
+
+
+def repair_output(result, created_date, deadline_date):
+    """
+    在本地修復 LLM 的任務輸出
+
+    - 優先級大小寫與同義詞正規化，無法辨識時補 medium
+    - 日期格式正規化，缺少或無法解析時依前後任務插補，超出範圍時夾回 [創建日, 截止日]
+    - 缺少名稱的任務刪除；名稱重複時加上序號
+    - 依賴正規化為陣列，移除不存在、指向自己或形成循環的依賴
+
+    :param result: LLM 解析後的 JSON
+    :param created_date: 創建日期 (date)
+    :param deadline_date: 截止日期 (date)
+    :return: (修復後的結果, {修復種類: 次數})
+    :raises UnrecoverableOutputError: 結構無法修復或沒有任何可用任務
+    """
+    repairs = {}
+
+    def note(kind):
+        repairs[kind] = repairs.get(kind, 0) + 1
+
+    if isinstance(result, list):
+        result = {'tasks': result}
+        note('wrapped_task_list')
+    if not isinstance(result, dict) or not isinstance(result.get('tasks'), list):
+        raise UnrecoverableOutputError(['輸出缺少 tasks 陣列'])
+
+    tasks = []
+    seen_names = set()
+    for raw in result['tasks']:
+        task = _normalize_task(raw, seen_names, note)
+        if task is not None:
+            tasks.append(task)
+
+    if not tasks:
+        raise UnrecoverableOutputError(['沒有任何可用的任務'])
+
+    # 缺少日期的任務：取前後已知日期的中點（頭尾以創建日/截止日為界）
+    for i, task in enumerate(tasks):
+        if task['due_date'] is None:
+            prev_date = next((t['due_date'] for t in reversed(tasks[:i]) if t['due_date']), created_date)
+            next_date = next((t['due_date'] for t in tasks[i + 1:] if t['due_date']), deadline_date)
+            if next_date < prev_date:
+                next_date = prev_date
+            task['due_date'] = prev_date + timedelta(days=(next_date - prev_date).days // 2)
+            note('filled_date')
+
+    # 夾回有效範圍
+    for task in tasks:
+        task['due_date'] = _clamp_date(task['due_date'], created_date, deadline_date, note).strftime('%Y-%m-%d')
+
+    # 依賴只能指向其他存在的任務
+    names = {task['task_name'] for task in tasks}
+    for task in tasks:
+        valid = [d for d in task['dependencies'] if d in names and d != task['task_name']]
+        if len(valid) != len(task['dependencies']):
+            note('dropped_dependency')
+        task['dependencies'] = list(dict.fromkeys(valid))
+    _break_cycles(tasks, note)
+
+    return {**result, 'tasks': tasks}, repairs
+
+
+class StreamingTaskRepairer:
+    """
+    串流模式下逐一修復任務（任務一完成解析就修復，不等整份輸出）
+
+    與 repair_output 的差異：看不到後面的任務，因此缺少日期時沿用前一個任務的日期，
+    依賴只保留指向已出現任務的部分（因此不會形成循環）。
+    """
+
+    def __init__(self, created_date, deadline_date):
+        self.created_date = created_date
+        self.deadline_date = deadline_date
+        self.repairs = {}
+        self.tasks = []
+        self._seen_names = set()
+
+    def _note(self, kind):
+        self.repairs[kind] = self.repairs.get(kind, 0) + 1
+
+    def repair(self, raw):
+        """
+        :return: 修復後的任務，無法使用時回傳 None
+        """
+        task = _normalize_task(raw, self._seen_names, self._note)
+        if task is None:
+            return None
+
+        if task['due_date'] is None:
+            previous = self.tasks[-1]['due_date'] if self.tasks else None
+            task['due_date'] = datetime.strptime(previous, '%Y-%m-%d').date() if previous else self.created_date
+            self._note('filled_date')
+        task['due_date'] = _clamp_date(task['due_date'], self.created_date, self.deadline_date,
+                                       self._note).strftime('%Y-%m-%d')
+
+        known = {t['task_name'] for t in self.tasks}
+        valid = [d for d in task['dependencies'] if d in known]
+        if len(valid) != len(task['dependencies']):
+            self._note('dropped_dependency')
+        task['dependencies'] = list(dict.fromkeys(valid))
+
+        self.tasks.append(task)
+        return task
+
+
+def build_reask_message(errors):
+    """針對具體錯誤產生重問的訊息，只要求修正而非重新規劃"""
+    problems = '\n'.join(f'- {error}' for error in errors[:20])
+    return (
+        "你上一次的輸出無法使用，問題如下：\n"
+        f"{problems}\n"
+        "請只修正上述問題，保留其他內容，並依照同樣的 JSON 結構只輸出 JSON。"
+    )
+
+
+def record_result(repairs=None, unrecoverable=False, reasked=False, reask_failed=False):
+    """記錄一次驗證的結果"""
+    with _stats_lock:
+        _stats['validated'] += 1
+        if reasked:
+            _stats['reasks'] += 1
+        if reask_failed:
+            _stats['reask_failures'] += 1
+        if unrecoverable:
+            _stats['unrecoverable'] += 1
+        if repairs:
+            _stats['repaired'] += 1
+            for kind, count in repairs.items():
+                _stats['repairs'][kind] = _stats['repairs'].get(kind, 0) + count
+        elif not unrecoverable:
+            _stats['clean'] += 1
+
+
+def get_repair_stats():
+    """回傳修復與重問的統計"""
+    with _stats_lock:
+        return {**_stats, 'repairs': dict(_stats['repairs'])}
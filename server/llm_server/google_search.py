@@ -3,13 +3,15 @@ from dotenv import load_dotenv
 import requests
 import logging
 
+from monitoring.metrics import time_dependency
+
 load_dotenv()  # 讀取 .env 檔案
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 SEARCH_ENGINE_ID = os.getenv("SEARCH_ENGINE_ID")
 
 
-def get_learning_links_from_google(query, max_results=3):
+def get_learning_links_from_google(query, max_results=3, timeout=10):
     try:
         url = "https://www.googleapis.com/customsearch/v1"
         params = {
@@ -18,8 +20,9 @@ def get_learning_links_from_google(query, max_results=3):
             "q": query,
             "num": max_results
         }
-        response = requests.get(url, params=params)
-        response.raise_for_status()
+        with time_dependency('google_cse', 'search'):
+            response = requests.get(url, params=params, timeout=timeout)
+            response.raise_for_status()
         results = response.json().get("items", [])
 
         links = [{"title": item["title"], "link": item["link"]} for item in results]
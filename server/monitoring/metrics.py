@@ -0,0 +1,258 @@
+# monitoring/metrics.py
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import Response, g, request
+
+# 延遲直方圖的預設區間（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    """只增不減的計數器"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram:
+    """
+    延遲直方圖；觀測時只遞增落點的區間，輸出時才累加成 Prometheus 的累積區間
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [各區間次數..., +Inf 次數, 總和]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', bound)])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {series[-1]}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+HTTP_LATENCY = Histogram(
+    'http_request_duration_seconds', '各路由的處理時間（到回應開始送出為止）',
+    ('method', 'route', 'status')
+)
+HTTP_ERRORS = Counter(
+    'http_request_errors_total', '各路由回應 4xx/5xx 的次數',
+    ('method', 'route', 'status')
+)
+DEPENDENCY_LATENCY = Histogram(
+    'dependency_duration_seconds', '外部依賴（Firestore、Mistral、Google CSE）的呼叫時間',
+    ('dependency', 'operation')
+)
+DEPENDENCY_ERRORS = Counter(
+    'dependency_errors_total', '外部依賴呼叫失敗的次數',
+    ('dependency', 'operation')
+)
+LLM_LATENCY = Histogram(
+    'llm_request_duration_seconds', '各模型的 LLM 呼叫時間',
+    ('model', 'operation')
+)
+LLM_TOKENS = Counter(
+    'llm_tokens_total', 'LLM 呼叫使用的 token 數',
+    ('model', 'kind')
+)
+
+
+@contextmanager
+def time_dependency(dependency, operation):
+    """記錄一次外部依賴呼叫的耗時，發生例外時另計錯誤次數"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        DEPENDENCY_ERRORS.inc(dependency=dependency, operation=operation)
+        raise
+    finally:
+        DEPENDENCY_LATENCY.observe(time.perf_counter() - started, dependency=dependency, operation=operation)
+
+
+def observe_llm(model, operation, seconds, usage=None):
+    """記錄一次 LLM 呼叫的耗時與 token 用量"""
+    DEPENDENCY_LATENCY.observe(seconds, dependency='mistral', operation=operation)
+    LLM_LATENCY.observe(seconds, model=model, operation=operation)
+    if usage is not None:
+        LLM_TOKENS.inc(usage.prompt_tokens or 0, model=model, kind='prompt')
+        LLM_TOKENS.inc(usage.completion_tokens or 0, model=model, kind='completion')
+
+
+def render_metrics():
+    """以 Prometheus 文字格式輸出所有指標"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# ---------- Firestore ----------
+
+# Firestore 的所有讀寫最後都經過這些 RPC，在此量測可避免高階 API 互相呼叫造成重複計算
+_FIRESTORE_RPCS = {
+    'get_document': 'firestore_read',
+    'batch_get_documents': 'firestore_read',
+    'run_query': 'firestore_read',
+    'run_aggregation_query': 'firestore_read',
+    'list_documents': 'firestore_read',
+    'commit': 'firestore_write',
+    'batch_write': 'firestore_write',
+    'begin_transaction': 'firestore_write',
+    'rollback': 'firestore_write',
+}
+
+
+class _TimedStream:
+    """串流型 RPC 的回應：讀完（或出錯）時才記錄耗時"""
+
+    def __init__(self, stream, started, dependency, operation):
+        self._stream = stream
+        self._iterator = iter(stream)
+        self._started = started
+        self._labels = {'dependency': dependency, 'operation': operation}
+        self._recorded = False
+
+    def _record(self, failed=False):
+        if not self._recorded:
+            self._recorded = True
+            if failed:
+                DEPENDENCY_ERRORS.inc(**self._labels)
+            DEPENDENCY_LATENCY.observe(time.perf_counter() - self._started, **self._labels)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            self._record()
+            raise
+        except Exception:
+            self._record(failed=True)
+            raise
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def _wrap_rpc(original, operation, dependency):
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = original(*args, **kwargs)
+        except Exception:
+            DEPENDENCY_ERRORS.inc(dependency=dependency, operation=operation)
+            DEPENDENCY_LATENCY.observe(time.perf_counter() - started, dependency=dependency, operation=operation)
+            raise
+        if hasattr(result, '__next__'):
+            return _TimedStream(result, started, dependency, operation)
+        DEPENDENCY_LATENCY.observe(time.perf_counter() - started, dependency=dependency, operation=operation)
+        return result
+
+    wrapper.__wrapped__ = original
+    wrapper.__name__ = getattr(original, '__name__', operation)
+    return wrapper
+
+
+def instrument_firestore():
+    """在 Firestore 的 RPC 層量測每次讀寫；未安裝或版本不符時略過"""
+    try:
+        from google.cloud.firestore_v1.services.firestore.client import FirestoreClient
+    except ImportError:
+        logging.warning("找不到 Firestore RPC 客戶端，略過 Firestore 指標")
+        return False
+
+    for operation, dependency in _FIRESTORE_RPCS.items():
+        original = getattr(FirestoreClient, operation, None)
+        if original is None or hasattr(original, '__wrapped__'):
+            continue
+        setattr(FirestoreClient, operation, _wrap_rpc(original, operation, dependency))
+    return True
+
+
+# ---------- Flask ----------
+
+def init_app(app):
+    """為所有路由加上延遲與錯誤指標，並提供 /metrics（不加 /api 前綴）"""
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop('_metrics_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            if route != '/metrics':
+                labels = {'method': request.method, 'route': route, 'status': response.status_code}
+                HTTP_LATENCY.observe(time.perf_counter() - started, **labels)
+                if response.status_code >= 400:
+                    HTTP_ERRORS.inc(**labels)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+    instrument_firestore()
@@ -0,0 +1,46 @@
+# monitoring/routes.py
+from flask import Blueprint, jsonify
+from llm_model.response_cache import get_cache_stats
+from llm_model.task_repair import get_repair_stats
+from llm_model.gateway import get_gateway_stats
+from llm_model.model_router import get_router_stats
+from utils.read_cache import get_read_cache_stats
+from utils.live_view import get_live_view_stats
+
+monitoring_bp = Blueprint('monitoring', __name__)
+
+
+@monitoring_bp.route('/stats/llm_cache', methods=['GET'])
+def llm_cache_stats():
+    """LLM 任務生成快取的命中/未命中統計"""
+    return jsonify(get_cache_stats()), 200
+
+
+@monitoring_bp.route('/stats/llm_repair', methods=['GET'])
+def llm_repair_stats():
+    """LLM 任務輸出的本地修復與重問統計"""
+    return jsonify(get_repair_stats()), 200
+
+
+@monitoring_bp.route('/stats/llm_gateway', methods=['GET'])
+def llm_gateway_stats():
+    """LLM 閘道的排隊深度、執行中數量與重試統計"""
+    return jsonify(get_gateway_stats()), 200
+
+
+@monitoring_bp.route('/stats/llm_router', methods=['GET'])
+def llm_router_stats():
+    """模型路由的決策統計與各模型觀測到的 p95 慢化倍數"""
+    return jsonify(get_router_stats()), 200
+
+
+@monitoring_bp.route('/stats/read_cache', methods=['GET'])
+def read_cache_stats():
+    """目標、任務與習慣讀取快取的容量與命中統計"""
+    return jsonify(get_read_cache_stats()), 200
+
+
+@monitoring_bp.route('/stats/live_view', methods=['GET'])
+def live_view_stats():
+    """即時監聽副本的數量、命中/回退次數與各使用者的快照讀取時間"""
+    return jsonify(get_live_view_stats()), 200
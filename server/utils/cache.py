@@ -0,0 +1,185 @@
+# utils/cache.py
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """執行緒安全的記憶體快取，結合 LRU 與 TTL 淘汰"""
+
+    def __init__(self, maxsize=256, ttl=3600):
+        """
+        :param maxsize: 最多保留的項目數，超過時淘汰最久未使用的項目
+        :param ttl: 預設存活秒數
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (到期時間, 值)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """回傳命中、未命中與淘汰次數"""
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class ByteBudgetCache:
+    """
+    以總位元組數為上限的 LRU + TTL 快取，值為預先序列化的 bytes
+
+    每個項目可帶多個標籤，以 invalidate(tag) 精準清除；
+    讀取前以 generation(tags) 取得版本，寫入時若標籤已被清除過就不存，避免把清除前讀到的舊資料放回快取。
+    """
+
+    def __init__(self, maxbytes=32 * 1024 * 1024, ttl=300, max_entry_bytes=None):
+        """
+        :param maxbytes: 所有值的總位元組上限，超過時淘汰最久未使用的項目
+        :param ttl: 預設存活秒數
+        :param max_entry_bytes: 單一項目的上限，超過的不快取（預設為總上限的 1/8）
+        """
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes or maxbytes // 8
+        self._data = OrderedDict()  # key -> (到期時間, 值, 標籤)
+        self._tags = {}             # tag -> {key, ...}
+        self._generations = {}      # tag -> 被清除的次數
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _remove(self, key):
+        _, value, tags = self._data.pop(key)
+        self._bytes -= len(value)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+
+            if entry[0] <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def generation(self, tags):
+        """取得標籤目前的版本，傳給 set() 作為寫入條件"""
+        with self._lock:
+            return tuple(self._generations.get(tag, 0) for tag in tags)
+
+    def set(self, key, value, tags=(), generation=None, ttl=None):
+        """
+        :param generation: generation(tags) 的結果；標籤在此之後被清除過時不寫入
+        :return: 是否寫入
+        """
+        tags = tuple(tags)
+        if len(value) > self.max_entry_bytes:
+            return False
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if generation is not None and generation != tuple(self._generations.get(tag, 0) for tag in tags):
+                return False
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (expires_at, value, tags)
+            self._bytes += len(value)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while self._bytes > self.maxbytes:
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+        return True
+
+    def invalidate(self, *tags):
+        """清除帶有任一標籤的項目"""
+        with self._lock:
+            for tag in tags:
+                self._generations[tag] = self._generations.get(tag, 0) + 1
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """回傳容量、命中、未命中、淘汰與清除次數"""
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'bytes': self._bytes,
+                'maxbytes': self.maxbytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
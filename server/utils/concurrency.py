@@ -0,0 +1,65 @@
+# utils/concurrency.py
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+# 共用的 I/O 執行緒池，供單一請求內的多個獨立 I/O 步驟並行使用
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('FANOUT_WORKERS', '16')),
+    thread_name_prefix='fanout'
+)
+
+
+class Branch:
+    """一個已提交到執行緒池的 I/O 分支"""
+
+    def __init__(self, name, future, started_at):
+        self.name = name
+        self._future = future
+        self._started_at = started_at
+        self._finished_at = None
+        future.add_done_callback(self._mark_finished)
+
+    def _mark_finished(self, _future):
+        self._finished_at = time.perf_counter()
+
+    def result(self, timeout=None, default=None):
+        """
+        等待分支結果；逾時或發生例外時回傳 default，不會中斷主流程
+
+        :param timeout: 從分支開始執行起算的時間上限秒數（None 代表不限）
+        :param default: 逾時或失敗時的替代值
+        :return: 分支結果或 default
+        """
+        if timeout is not None:
+            timeout = max(0.0, self._started_at + timeout - time.perf_counter())
+        try:
+            value = self._future.result(timeout=timeout)
+            outcome = 'ok'
+        except FutureTimeoutError:
+            self._future.cancel()
+            value = default
+            outcome = 'timeout'
+        except Exception as e:
+            logging.warning(f"分支 {self.name} 失敗: {str(e)}", exc_info=True)
+            value = default
+            outcome = 'error'
+
+        # 以分支實際完成時間計算耗時（逾時則計到放棄等待為止）
+        finished_at = self._finished_at or time.perf_counter()
+        elapsed_ms = (finished_at - self._started_at) * 1000
+        log = logging.info if outcome == 'ok' else logging.warning
+        log(f"分支 {self.name} {outcome}，耗時 {elapsed_ms:.1f} ms")
+        return value
+
+
+def start_branch(name, fn, *args, **kwargs):
+    """
+    將函式提交到共用執行緒池並立即返回，之後以 Branch.result() 取得結果
+
+    :param name: 分支名稱（用於日誌）
+    :param fn: 要執行的函式
+    :return: Branch 物件
+    """
+    return Branch(name, _executor.submit(fn, *args, **kwargs), time.perf_counter())
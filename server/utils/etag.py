@@ -0,0 +1,89 @@
+# utils/etag.py
+import hashlib
+import logging
+from datetime import datetime
+from functools import wraps
+
+from firebase_admin import firestore
+from flask import Response, make_response, request
+
+from utils.read_cache import pin_versions, is_unversioned
+
+# 回應內容還取決於當天日期的版本欄位（目標的 overdueTasks 在讀取時依日期計算）
+_DATED_SCOPES = {'goals'}
+
+
+def _versions_ref(db, user_id):
+    return db.document(f'users/{user_id}/meta/versions')
+
+
+def get_versions(user_id, scopes):
+    """讀取使用者的版本計數器（只讀一份文件）"""
+    snapshot = _versions_ref(firestore.client(), user_id).get()
+    data = snapshot.to_dict() or {}
+    return [data.get(scope, 0) for scope in scopes]
+
+
+def bump_versions(writer, db, user_id, *scopes):
+    """
+    在資料寫入的同一個 batch／交易中遞增版本計數器
+
+    版本與資料一起提交或一起失敗，ETag 不會在資料已改變後仍維持舊值。
+
+    :param writer: WriteBatch 或 Transaction
+    :param scopes: 這次寫入影響的版本欄位（goals、habits、reminders、working_habits、files）
+    """
+    writer.set(_versions_ref(db, user_id), {scope: firestore.Increment(1) for scope in scopes}, merge=True)
+
+
+def conditional_get(*scopes):
+    """
+    為 GET 路由加上強 ETag 與 If-None-Match 支援
+
+    ETag 由使用者的版本計數器、路徑與查詢參數組成；版本未變時直接回 304，
+    不呼叫路由函式，也就不讀取整個集合。版本必須在讀取資料之前取得，
+    確保 ETag 不會比回應內容還新：讀取快取以讀到的版本分鍵，
+    來自即時副本（可能落後於其他行程的寫入）的回應則不加 ETag。
+    使用者的即時副本已同步時改以監聽器的 read_time 為版本，副本命中的請求不需任何 Firestore 往返，也能回 304。
+
+    使用者ID取自路由參數 user_id，或查詢參數 ?user_id=。
+
+    :param scopes: 回應內容依賴的版本欄位（goals、habits、reminders、working_habits、files）
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            user_id = kwargs.get('user_id') or request.args.get('user_id')
+            if not user_id:
+                return view(*args, **kwargs)
+            from utils import live_view
+            versions = live_view.version_token(user_id, scopes)
+            if versions is None:
+                try:
+                    versions = get_versions(user_id, scopes)
+                except Exception as e:
+                    logging.warning(f"讀取版本失敗，略過 ETag: {str(e)}")
+                    return view(*args, **kwargs)
+
+            if _DATED_SCOPES.intersection(scopes):
+                # 過了午夜（UTC）即使沒有寫入，ETag 與讀取快取也要換新
+                versions = [*versions, datetime.utcnow().strftime('%Y-%m-%d')]
+            variant = f"{user_id}|{request.path}|{sorted(request.args.items(multi=True))}|{versions}"
+            etag = hashlib.sha256(variant.encode('utf-8')).hexdigest()[:32]
+            # 壓縮後的回應在 ETag 後加上編碼（見 utils/json_codec），三種都視為同一版本
+            for candidate in (etag, f'{etag}-gzip', f'{etag}-br'):
+                if request.if_none_match.contains(candidate):
+                    not_modified = Response(status=304)
+                    not_modified.set_etag(candidate)
+                    not_modified.vary.add('Accept-Encoding')
+                    return not_modified
+
+            pin_versions(versions)
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                if not is_unversioned():
+                    response.set_etag(etag)
+                response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,78 @@
+# utils/firestore_queries.py
+import base64
+import binascii
+
+# 文件ID範圍的上下界（Firestore 依路徑逐段比較）
+_MIN_ID = '\u0000'
+_MAX_ID = '\uf8ff'
+
+
+def user_collection_group(db, user_id, parent_collection, group, first_parent_id=None, last_parent_id=None):
+    """
+    只查詢某位使用者底下的 collection group
+
+    例如 user_collection_group(db, uid, 'goalBreakdown', 'tasks') 取得
+    users/{uid}/goalBreakdown/*/tasks/* 的所有任務，一次查詢取代逐一目標的子集合查詢。
+    以 __name__ 的範圍限定在 users/{uid}/{parent_collection} 底下；
+    可再以 first_parent_id / last_parent_id 縮小到部分父文件的ID區間
+    （只適用於依文件ID排序的分頁，否則一頁的ID區間幾乎涵蓋所有父文件）。
+
+    :return: Query（依 __name__ 排序）
+    """
+    parent = db.collection(f'users/{user_id}/{parent_collection}')
+    start = parent.document(first_parent_id if first_parent_id is not None else _MIN_ID)
+    end = parent.document(last_parent_id + _MAX_ID if last_parent_id is not None else _MAX_ID)
+    return (db.collection_group(group)
+            .where('__name__', '>=', start)
+            .where('__name__', '<', end))
+
+
+def encode_cursor(path):
+    """把最後一筆文件的路徑編成不透明的游標"""
+    return base64.urlsafe_b64encode(path.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, user_id):
+    """
+    解回游標中的文件路徑，並確認屬於該使用者
+
+    :raises ValueError: 游標格式錯誤或不屬於該使用者
+    """
+    try:
+        path = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError('無效的游標')
+    if not path.startswith(f'users/{user_id}/'):
+        raise ValueError('無效的游標')
+    return path
+
+
+def paginate(db, query, user_id, limit, cursor=None, filter_docs=None):
+    """
+    以游標分頁執行查詢（多取一筆判斷是否還有下一頁）
+
+    :param query: 已設定排序的 Query
+    :param cursor: 上一頁回傳的 next_cursor
+    :param filter_docs: 過濾一批文件的函式（如略過已刪除的目標）；被濾掉的文件不佔名額，
+        會繼續往後讀到湊滿一頁或沒有資料為止
+    :return: (文件快照列表, next_cursor 或 None)
+    :raises ValueError: 游標無效或指向不存在的文件
+    """
+    start = None
+    if cursor:
+        start = db.document(decode_cursor(cursor, user_id)).get()
+        if not start.exists:
+            raise ValueError('無效的游標')
+
+    page = []
+    while True:
+        wanted = limit + 1 - len(page)
+        docs = list((query.start_after(start) if start is not None else query).limit(wanted).stream())
+        page.extend(filter_docs(docs) if filter_docs is not None else docs)
+        if len(page) > limit or len(docs) < wanted:
+            break
+        start = docs[-1]
+
+    if len(page) > limit:
+        return page[:limit], encode_cursor(page[limit - 1].reference.path)
+    return page, None
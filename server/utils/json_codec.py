@@ -0,0 +1,174 @@
+# utils/json_codec.py
+import gzip
+import json
+import logging
+import os
+import zlib
+from datetime import date, datetime
+
+from dotenv import load_dotenv
+
+try:
+    import orjson
+except ImportError:  # 未安裝時退回標準函式庫
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+load_dotenv()
+
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))       # 小於此大小的回應不壓縮
+COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', '6'))
+COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', '4'))
+JSON_STREAM_MIN_ITEMS = int(os.getenv('JSON_STREAM_MIN_ITEMS', '200'))  # 列表項目達此數量才分段輸出
+JSON_STREAM_BATCH = int(os.getenv('JSON_STREAM_BATCH', '50'))           # 每段包含的項目數
+
+# 可壓縮的內容類型；SSE 與 NDJSON 需要逐筆送出，不在此壓縮
+_COMPRESSIBLE_MIMETYPES = ('application/json', 'text/plain', 'text/html', 'text/csv')
+
+
+def _default(obj):
+    """標準函式庫與 orjson 都無法直接處理的型別（Firestore 的時間戳為 datetime 子類別）"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f'無法序列化 {type(obj).__name__}')
+
+
+def _orjson_default(obj):
+    """
+    orjson 只原生處理 datetime 本身；Firestore 時間戳是子類別，
+    轉回 datetime 交給 orjson 格式化，比在 Python 裡呼叫 isoformat() 快
+    """
+    if isinstance(obj, datetime):
+        return datetime(obj.year, obj.month, obj.day, obj.hour, obj.minute, obj.second,
+                        obj.microsecond, obj.tzinfo)
+    return _default(obj)
+
+
+def encode_json(obj):
+    """
+    序列化為 UTF-8 JSON bytes
+
+    有 orjson 時使用 orjson（datetime 原生輸出為 ISO 8601），否則使用 json 模組；
+    兩者對 datetime 的輸出相同，中文都不轉義。
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def iter_json_list(obj, key, batch=JSON_STREAM_BATCH):
+    """
+    分段輸出 {"key": [...], ...}：先輸出其他欄位，再每 batch 個項目輸出一段
+
+    回應可以在整份 JSON 組好之前開始送出，也不必同時保留整份序列化結果。
+    """
+    items = obj[key]
+    rest = encode_json({k: v for k, v in obj.items() if k != key})
+    head = rest[:-1] + (b',' if len(rest) > 2 else b'')
+    yield head + encode_json(key) + b':['
+    for start in range(0, len(items), batch):
+        chunk = b','.join(encode_json(item) for item in items[start:start + batch])
+        yield (b',' if start else b'') + chunk
+    yield b']}'
+
+
+def choose_encoding(accept_encoding):
+    """依 Accept-Encoding 選擇壓縮方式（br 優先於 gzip）；不接受任何壓縮時回傳 None"""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in (('br',) if brotli is not None else ()) + ('gzip',):
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body, encoding):
+    """一次壓縮整份內容"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL)
+
+
+def iter_compress(chunks, encoding):
+    """逐段壓縮串流內容"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        process, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        data = process(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield finish()
+
+
+# ---------- Flask ----------
+
+def json_response(obj, status=200, stream_key=None):
+    """
+    建立 JSON 回應；stream_key 指向的列表夠長時改為分段輸出
+
+    :param stream_key: 可分段輸出的列表欄位，如 'goals'
+    """
+    from flask import Response
+
+    if stream_key and len(obj.get(stream_key) or ()) >= JSON_STREAM_MIN_ITEMS:
+        return Response(iter_json_list(obj, stream_key), status=status, mimetype='application/json')
+    return Response(encode_json(obj), status=status, mimetype='application/json')
+
+
+def init_app(app):
+    """以 encode_json 取代 jsonify 的序列化，並依 Accept-Encoding 壓縮較大的回應"""
+    from flask import request
+
+    try:
+        from flask.json.provider import DefaultJSONProvider
+    except ImportError:
+        logging.warning("Flask 版本不支援自訂 JSON provider，jsonify 維持預設序列化")
+    else:
+        class _FastJSONProvider(DefaultJSONProvider):
+            def dumps(self, obj, **kwargs):
+                return encode_json(obj).decode('utf-8')
+
+        app.json = _FastJSONProvider(app)
+
+    @app.after_request
+    def _compress_response(response):
+        if (response.status_code != 200 or 'Content-Encoding' in response.headers or response.direct_passthrough
+                or response.mimetype not in _COMPRESSIBLE_MIMETYPES or request.method == 'HEAD'):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = iter_compress(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            if len(body) < COMPRESS_MIN_BYTES:
+                return response
+            response.set_data(compress(body, encoding))
+
+        response.headers['Content-Encoding'] = encoding
+        # 強 ETag 必須隨內容編碼不同而不同
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(f'{etag}-{encoding}')
+        return response
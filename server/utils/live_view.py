@@ -0,0 +1,381 @@
+# utils/live_view.py
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from dotenv import load_dotenv
+from firebase_admin import firestore
+
+from goal_breakdown.progress import with_overdue
+from utils.firestore_queries import user_collection_group
+from utils.read_cache import on_invalidate, mark_unversioned, pinned_versions
+
+load_dotenv()
+
+LIVE_VIEW_ENABLED = os.getenv('LIVE_VIEW_ENABLED', '0') == '1'
+LIVE_VIEW_MAX_USERS = int(os.getenv('LIVE_VIEW_MAX_USERS', '20'))        # 每位使用者 5 個監聽器
+LIVE_VIEW_IDLE_SECONDS = int(os.getenv('LIVE_VIEW_IDLE_SECONDS', '600'))  # 閒置超過此秒數即關閉監聽
+LIVE_VIEW_SWEEP_SECONDS = int(os.getenv('LIVE_VIEW_SWEEP_SECONDS', '30'))
+
+# 各檢視需要哪些監聽器都已同步
+_VIEW_LISTENERS = {
+    'goals': ('goals', 'goal_tasks'),
+    'habits': ('habits', 'habit_tasks'),
+    'reminders': ('reminders',),
+}
+# ETag 的版本欄位 -> 副本中對應的檢視（files、working_habits 不在副本中）
+_SCOPE_VIEWS = {'goals': 'goals', 'habits': 'habits', 'reminders': 'reminders'}
+LIVE_VERSION_MARK = 'live'  # 以副本 read_time 組成的版本以此開頭，與版本計數器區分
+# 讀取快取的標籤前綴 -> 受影響的檢視（寫入後要等監聽器追上才從副本回應）
+_TAG_VIEWS = {'goals': 'goals', 'goal': 'goals', 'habits': 'habits', 'reminders': 'reminders'}
+# invalidate(collections=...) 的集合 -> 監聽器
+_COLLECTION_LISTENERS = {
+    'goalBreakdown': 'goals',
+    'goalBreakdown/tasks': 'goal_tasks',
+    'habit_building': 'habits',
+    'habit_building/tasks': 'habit_tasks',
+    'articleReminders': 'reminders',
+}
+
+
+class _Listener:
+    """單一查詢的 on_snapshot 監聽器，以變更增量維護 文件路徑 -> (父文件ID, 文件ID, 資料)"""
+
+    def __init__(self, query, lock):
+        self.docs = {}
+        self.read_time = None  # 最後一次快照的讀取時間（Firestore 伺服器時間）
+        self._lock = lock
+        self._watch = query.on_snapshot(self._on_snapshot)
+
+    def _on_snapshot(self, docs, changes, read_time):
+        with self._lock:
+            for change in changes:
+                doc = change.document
+                if change.type.name == 'REMOVED':
+                    self.docs.pop(doc.reference.path, None)
+                else:
+                    parent = doc.reference.parent.parent
+                    self.docs[doc.reference.path] = (parent.id if parent else None, doc.id, doc.to_dict())
+            self.read_time = read_time
+
+    @property
+    def active(self):
+        return getattr(self._watch, 'is_active', True)
+
+    def close(self):
+        try:
+            self._watch.unsubscribe()
+        except Exception as e:
+            logging.warning(f"關閉監聽器失敗: {str(e)}")
+
+
+class _UserReplica:
+    """一位使用者的記憶體副本；讀取時才組成與對應服務相同的回應格式（時間戳由回應層序列化）"""
+
+    def __init__(self, db, user_id):
+        self.user_id = user_id
+        self.last_access = time.monotonic()
+        self._lock = threading.Lock()
+        self._pending_writes = {}  # 監聽器 -> [(提交時間, 記錄時的 read_time), ...]
+        self._listeners = {}
+        try:
+            queries = {
+                'goals': db.collection(f'users/{user_id}/goalBreakdown'),
+                'goal_tasks': user_collection_group(db, user_id, 'goalBreakdown', 'tasks'),
+                'habits': db.collection(f'users/{user_id}/habit_building'),
+                'habit_tasks': user_collection_group(db, user_id, 'habit_building', 'tasks'),
+                'reminders': db.collection(f'users/{user_id}/articleReminders'),
+            }
+            for name, query in queries.items():
+                self._listeners[name] = _Listener(query, self._lock)
+        except Exception:
+            self.close()
+            raise
+
+    def note_write(self, names, commit_time):
+        """
+        記錄本行程寫入了哪些監聽器的資料；各監聽器要看到這次寫入才算同步
+
+        :param commit_time: Firestore 的提交時間；包含這次寫入的快照 read_time 必定不早於它。
+            取不到時改為要求監聽器收到記錄之後的新快照
+        """
+        with self._lock:
+            for name in names:
+                self._pending_writes.setdefault(name, []).append(
+                    (commit_time, self._listeners[name].read_time)
+                )
+
+    @staticmethod
+    def _has_seen(listener, commit_time, baseline):
+        if commit_time is not None:
+            return listener.read_time >= commit_time
+        return baseline is None or listener.read_time > baseline
+
+    def _synced(self, view):
+        """檢視的每個監聽器都已收到快照、仍在運作，且各自看到本行程寫入它的資料"""
+        synced = True
+        for name in _VIEW_LISTENERS[view]:
+            listener = self._listeners[name]
+            if listener.read_time is None or not listener.active:
+                return False
+            pending = [write for write in self._pending_writes.get(name, ())
+                       if not self._has_seen(listener, *write)]
+            if pending:
+                self._pending_writes[name] = pending
+                synced = False
+            else:
+                self._pending_writes.pop(name, None)
+        return synced
+
+    def version_token(self, views):
+        """檢視都已同步時，以其監聽器的 read_time 作為版本；否則回傳 None"""
+        with self._lock:
+            self.last_access = time.monotonic()
+            if not all(self._synced(view) for view in views):
+                return None
+            names = sorted({name for view in views for name in _VIEW_LISTENERS[view]})
+            return [LIVE_VERSION_MARK, *(f'{name}@{self._listeners[name].read_time.isoformat()}' for name in names)]
+
+    def _children(self, name):
+        grouped = {}
+        for parent_id, doc_id, data in sorted(self._listeners[name].docs.values(), key=lambda d: (d[0], d[1])):
+            grouped.setdefault(parent_id, []).append((doc_id, data))
+        return grouped
+
+    def read(self, view, *args):
+        """
+        從副本組出回應；尚未同步時回傳 None
+
+        :param view: goals、goal、tasks、habits 或 reminders
+        """
+        with self._lock:
+            self.last_access = time.monotonic()
+            if not self._synced('goals' if view in ('goal', 'tasks') else view):
+                return None
+
+            if view == 'goals':
+                tasks = self._children('goal_tasks')
+                return {'goals': [
+                    {
+                        'id': doc_id,
+                        **with_overdue(dict(data)),
+                        'tasks': [{'id': task_id, **task}
+                                  for task_id, task in tasks.get(doc_id, [])]
+                    }
+                    for _, doc_id, data in sorted(self._listeners['goals'].docs.values(), key=lambda d: d[1])
+                    if not data.get('deletedAt')
+                ]}
+
+            # 已標記刪除的目標交給服務回應 404
+            entry = self._listeners['goals'].docs.get(f'users/{self.user_id}/goalBreakdown/{args[0]}') \
+                if view in ('goal', 'tasks') else None
+            if entry and entry[2].get('deletedAt'):
+                return None
+
+            if view == 'goal':
+                return with_overdue(dict(entry[2])) if entry else None
+
+            if view == 'tasks':
+                tasks = self._children('goal_tasks').get(args[0], [])
+                return {'tasks': [{'id': task_id, **task}
+                                  for task_id, task in tasks]}
+
+            if view == 'habits':
+                tasks = self._children('habit_tasks')
+                return {'habits': [
+                    {
+                        'id': doc_id,
+                        'name': data.get('name'),
+                        'frequency': data.get('frequency'),
+                        'intensity': data.get('intensity'),
+                        'createAt': data.get('createAt'),
+                        'tasks': [{**task, 'id': task_id} for task_id, task in tasks.get(doc_id, [])]
+                    }
+                    for _, doc_id, data in sorted(self._listeners['habits'].docs.values(), key=lambda d: d[1])
+                ]}
+
+            if view == 'reminders':
+                reminders = []
+                for _, doc_id, data in sorted(self._listeners['reminders'].docs.values(), key=lambda d: d[1]):
+                    data = dict(data)
+                    if isinstance(data.get('eventDeadLine'), datetime):
+                        data['eventDeadLine'] = data['eventDeadLine'].strftime('%Y-%m-%d')
+                    data['id'] = doc_id
+                    reminders.append(data)
+                return {'reminders': reminders}
+
+            raise ValueError(f'未知的檢視: {view}')
+
+    def stats(self):
+        with self._lock:
+            return {
+                'idleSeconds': round(time.monotonic() - self.last_access),
+                'documents': sum(len(listener.docs) for listener in self._listeners.values()),
+                'readTimes': {
+                    name: listener.read_time.isoformat() if listener.read_time else None
+                    for name, listener in self._listeners.items()
+                },
+                'pendingWrites': sorted(self._pending_writes),
+            }
+
+    def close(self):
+        for listener in self._listeners.values():
+            listener.close()
+
+
+_replicas = OrderedDict()  # user_id -> _UserReplica（最近使用的在後）
+_replicas_lock = threading.Lock()
+_sweeper = None
+_counters = {'hits': 0, 'fallbacks': 0, 'attached': 0, 'evicted': 0, 'rejected': 0}
+
+
+def _evict_idle(now):
+    """移除閒置過久的副本並回傳（需持有鎖，關閉監聽器則在鎖外進行）"""
+    closed = [_replicas.pop(user_id) for user_id, replica in list(_replicas.items())
+              if now - replica.last_access > LIVE_VIEW_IDLE_SECONDS]
+    _counters['evicted'] += len(closed)
+    return closed
+
+
+def _sweep_loop():
+    while True:
+        time.sleep(LIVE_VIEW_SWEEP_SECONDS)
+        with _replicas_lock:
+            closed = _evict_idle(time.monotonic())
+        for replica in closed:
+            replica.close()
+
+
+def _attach(user_id):
+    """為使用者建立副本；名額已滿且沒有可淘汰的閒置副本時放棄"""
+    global _sweeper
+    with _replicas_lock:
+        now = time.monotonic()
+        closed = _evict_idle(now)
+        # 名額已滿時讓出最久未使用、且最近一輪清理期間都沒有讀取的副本
+        if len(_replicas) >= LIVE_VIEW_MAX_USERS:
+            oldest_id, oldest = next(iter(_replicas.items()))
+            if now - oldest.last_access > LIVE_VIEW_SWEEP_SECONDS:
+                closed.append(_replicas.pop(oldest_id))
+                _counters['evicted'] += 1
+        full = len(_replicas) >= LIVE_VIEW_MAX_USERS
+        if _sweeper is None:
+            _sweeper = threading.Thread(target=_sweep_loop, name='live-view-sweeper', daemon=True)
+            _sweeper.start()
+    for replica in closed:
+        replica.close()
+    if full:
+        _counters['rejected'] += 1
+        return
+
+    try:
+        replica = _UserReplica(firestore.client(), user_id)
+    except Exception as e:
+        logging.warning(f"建立使用者 {user_id} 的即時副本失敗: {str(e)}")
+        return
+
+    with _replicas_lock:
+        if user_id in _replicas or len(_replicas) >= LIVE_VIEW_MAX_USERS:
+            duplicate = True
+        else:
+            _replicas[user_id] = replica
+            _counters['attached'] += 1
+            duplicate = False
+    if duplicate:
+        replica.close()
+
+
+def read(user_id, view, *args):
+    """
+    從使用者的即時副本回應 GET 請求
+
+    沒有副本時建立一個（這次仍回傳 None，由呼叫端直接讀 Firestore），
+    副本尚未同步或看不到本行程剛寫入的資料時也回傳 None。
+
+    :param view: goals、goal（goal_id）、tasks（goal_id）、habits 或 reminders
+    :return: 與對應服務相同格式的結果，或 None
+    """
+    if not LIVE_VIEW_ENABLED:
+        return None
+
+    with _replicas_lock:
+        replica = _replicas.get(user_id)
+        if replica is not None:
+            _replicas.move_to_end(user_id)
+
+    if replica is None:
+        _attach(user_id)
+        result = None
+    else:
+        result = replica.read(view, *args)
+
+    with _replicas_lock:
+        _counters['hits' if result is not None else 'fallbacks'] += 1
+    if result is not None and (pinned_versions() or ())[:1] != (LIVE_VERSION_MARK,):
+        # 副本可能還沒看到其他行程的寫入，不能搭配從版本計數器讀到的 ETag
+        mark_unversioned()
+    return result
+
+
+def version_token(user_id, scopes):
+    """
+    使用者的副本已同步時，以監聽器的 read_time 取代版本計數器（不需讀取 Firestore）
+
+    read_time 只在監聽器收到變更後前進，副本內容不會比它舊；
+    改由 Firestore 讀取的回應只會比它新，ETag 最多讓用戶端多收一次 200。
+
+    :param scopes: conditional_get 的版本欄位
+    :return: 版本列表；未啟用、沒有副本、尚未同步或有欄位不在副本中時回傳 None
+    """
+    if not LIVE_VIEW_ENABLED:
+        return None
+    views = [_SCOPE_VIEWS.get(scope) for scope in scopes]
+    if None in views:
+        return None
+    with _replicas_lock:
+        replica = _replicas.get(user_id)
+        if replica is not None:
+            _replicas.move_to_end(user_id)
+    return replica.version_token(views) if replica is not None else None
+
+
+def _on_write(tags, commit_time=None, collections=None):
+    """讀取快取被清除時，標記受影響的監聽器有尚未同步的寫入"""
+    written = {_COLLECTION_LISTENERS[c] for c in collections if c in _COLLECTION_LISTENERS} \
+        if collections is not None else None
+    names_by_user = {}
+    for tag in tags:
+        prefix, _, rest = tag.partition(':')
+        view = _TAG_VIEWS.get(prefix)
+        if view is None:
+            continue
+        names = set(_VIEW_LISTENERS[view])
+        if written is not None:
+            names &= written
+        names_by_user.setdefault(rest.split(':', 1)[0], set()).update(names)
+
+    for user_id, names in names_by_user.items():
+        with _replicas_lock:
+            replica = _replicas.get(user_id)
+        if replica is not None and names:
+            replica.note_write(sorted(names), commit_time)
+
+
+on_invalidate(_on_write)
+
+
+def get_live_view_stats():
+    """回傳副本數量、命中/回退次數與各使用者的同步狀態"""
+    with _replicas_lock:
+        replicas = dict(_replicas)
+        counters = dict(_counters)
+    return {
+        'enabled': LIVE_VIEW_ENABLED,
+        'maxUsers': LIVE_VIEW_MAX_USERS,
+        'users': len(replicas),
+        **counters,
+        'replicas': {user_id: replica.stats() for user_id, replica in replicas.items()},
+    }
@@ -0,0 +1,163 @@
+# utils/read_cache.py
+import json
+import os
+
+from dotenv import load_dotenv
+from flask import Response, g, has_request_context
+
+from utils.cache import ByteBudgetCache
+from utils.json_codec import encode_json, json_response
+
+load_dotenv()
+
+READ_CACHE_ENABLED = os.getenv('READ_CACHE_ENABLED', '1') == '1'
+READ_CACHE_MAX_BYTES = int(os.getenv('READ_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+READ_CACHE_TTL = int(os.getenv('READ_CACHE_TTL', '300'))  # 秒；多個行程時其他行程的寫入最多延遲這麼久才看得到
+
+_cache = ByteBudgetCache(maxbytes=READ_CACHE_MAX_BYTES, ttl=READ_CACHE_TTL)
+_invalidation_listeners = []
+
+
+# ---------- 標籤：寫入時依此精準清除 ----------
+
+def goals_tag(user_id):
+    """使用者的目標列表（含任務）"""
+    return f'goals:{user_id}'
+
+
+def goal_tag(user_id, goal_id):
+    """單一目標及其任務"""
+    return f'goal:{user_id}:{goal_id}'
+
+
+def habits_tag(user_id):
+    """使用者的習慣養成列表"""
+    return f'habits:{user_id}'
+
+
+def working_habits_tag(user_id):
+    """使用者的工作習慣"""
+    return f'working_habits:{user_id}'
+
+
+def reminders_tag(user_id):
+    """使用者的文章提醒"""
+    return f'reminders:{user_id}'
+
+
+def files_tag(user_id):
+    """使用者上傳的檔案"""
+    return f'files:{user_id}'
+
+
+def on_invalidate(callback):
+    """
+    註冊在每次 invalidate 後呼叫的函式（例如即時副本用來追蹤尚未同步的寫入）
+
+    :param callback: callback(tags, commit_time, collections)
+    """
+    _invalidation_listeners.append(callback)
+
+
+def invalidate(*tags, commit_time=None, collections=None):
+    """
+    寫入完成後清除相關的快取項目
+
+    :param commit_time: 這次寫入在 Firestore 的提交時間（batch / transaction 的 commit_time
+        或 WriteResult.update_time），即時副本據此判斷監聽器是否已看到這次寫入；
+        取不到時（如舊版 SDK 的交易）傳 None
+    :param collections: 實際寫入的集合，如 ('goalBreakdown', 'goalBreakdown/tasks')；
+        省略時視為標籤對應的所有集合
+    """
+    _cache.invalidate(*tags)
+    for callback in _invalidation_listeners:
+        callback(tags, commit_time, collections)
+
+
+# ---------- 與 ETag 協調（utils/etag） ----------
+
+def pin_versions(versions):
+    """
+    記下本次請求產生 ETag 時讀到的版本計數器；之後的快取讀寫都以此版本分鍵，
+    避免其他行程寫入後，本行程仍以舊的快取內容搭配新版本的 ETag 回應
+    """
+    g.read_cache_versions = tuple(versions)
+
+
+def pinned_versions():
+    """本次請求以 pin_versions 記下的版本；沒有時回傳 None"""
+    return g.get('read_cache_versions') if has_request_context() else None
+
+
+def mark_unversioned():
+    """本次回應的內容來源無法對應到版本計數器（如即時副本），不應加上版本 ETag"""
+    if has_request_context():
+        g.read_cache_unversioned = True
+
+
+def is_unversioned():
+    return has_request_context() and g.get('read_cache_unversioned', False)
+
+
+def _versioned_key(key):
+    versions = pinned_versions()
+    return key if versions is None else (key, versions)
+
+
+# ---------- 讀取 ----------
+
+def cached_response(key, tags, loader, stream_key=None):
+    """
+    以快取包住回傳 (result, status) 的服務，直接回傳預先序列化的 JSON 回應
+
+    只快取 200 的結果；快取停用時，stream_key 指向的長列表改為分段輸出。
+
+    :param key: 快取鍵（需包含使用者ID與影響結果的參數）
+    :param tags: 這筆結果依賴的標籤
+    :param loader: 無參數的函式，呼叫服務並回傳 (result, status)
+    :param stream_key: 可分段輸出的列表欄位，如 'goals'
+    """
+    key = _versioned_key(key)
+    if READ_CACHE_ENABLED:
+        body = _cache.get(key)
+        if body is not None:
+            return Response(body, status=200, mimetype='application/json')
+
+    if not READ_CACHE_ENABLED:
+        result, status = loader()
+        return json_response(result, status, stream_key=stream_key)
+
+    generation = _cache.generation(tags)
+    result, status = loader()
+    body = encode_json(result)
+    if status == 200:
+        _cache.set(key, body, tags=tags, generation=generation)
+    return Response(body, status=status, mimetype='application/json')
+
+
+def cached_value(key, tags, loader):
+    """
+    以快取包住回傳一般資料的函式（可在請求以外的執行緒使用）
+
+    快取中存的是 JSON，每次命中都解出新的物件，呼叫端修改結果不會影響快取。
+    """
+    key = _versioned_key(key)
+    if READ_CACHE_ENABLED:
+        body = _cache.get(key)
+        if body is not None:
+            return json.loads(body)
+
+    generation = _cache.generation(tags)
+    value = loader()
+    if READ_CACHE_ENABLED:
+        try:
+            body = encode_json(value)
+        except TypeError:
+            return value  # 含無法序列化的值時不快取
+        _cache.set(key, body, tags=tags, generation=generation)
+    return value
+
+
+def get_read_cache_stats():
+    """回傳讀取快取的容量與命中統計"""
+    return _cache.stats()
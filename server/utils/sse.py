@@ -0,0 +1,13 @@
+# utils/sse.py
+import json
+
+# SSE 回應標頭：停用快取與反向代理緩衝，確保事件即時送達
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no',
+}
+
+
+def format_sse(event, data):
+    """組成一則 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
@@ -0,0 +1,90 @@
+# working_habits/migrate.py
+"""
+把使用者文檔中的 working_habits 欄位搬到 users/{user_id}/working_habits 子集合
+
+每位使用者在一個交易中處理：子集合中尚未存在的習慣才寫入（已存在的以子集合為準），
+最後刪除使用者文檔的 working_habits 欄位。可重複執行，已搬移的使用者會被略過。
+
+在 server/ 目錄下執行：python -m working_habits.migrate [--user USER_ID] [--dry-run]
+"""
+import argparse
+import logging
+
+import firebase_admin
+from firebase_admin import credentials, firestore
+
+from utils.etag import bump_versions
+from utils.read_cache import invalidate, working_habits_tag
+from working_habits.services import LEGACY_FIELD, _habits_ref
+
+DEFAULT_CREDENTIALS = 'molting-llm-firebase-adminsdk-fbsvc-f5642adbc4.json'
+
+
+def migrate_user(db, user_id, dry_run=False):
+    """
+    搬移一位使用者的工作習慣
+
+    :return: 搬移的習慣數（已在子集合中的不計）
+    """
+    user_ref = db.collection('users').document(user_id)
+
+    @firestore.transactional
+    def migrate(transaction):
+        user_doc = user_ref.get(field_paths=[LEGACY_FIELD], transaction=transaction)
+        legacy = (user_doc.to_dict() or {}).get(LEGACY_FIELD) if user_doc.exists else None
+        if not legacy:
+            return 0
+
+        refs = [_habits_ref(db, user_id).document(habit_id) for habit_id in legacy]
+        existing = {doc.id for doc in transaction.get_all(refs) if doc.exists}
+        moved = [ref for ref in refs if ref.id not in existing]
+        if dry_run:
+            return len(moved)
+
+        for ref in moved:
+            transaction.set(ref, legacy[ref.id])
+        transaction.update(user_ref, {LEGACY_FIELD: firestore.DELETE_FIELD})
+        bump_versions(transaction, db, user_id, 'working_habits')
+        return len(moved)
+
+    moved = migrate(db.transaction())
+    if moved and not dry_run:
+        invalidate(working_habits_tag(user_id))
+    return moved
+
+
+def migrate_all(db, user_ids=None, dry_run=False):
+    """
+    搬移指定（或全部）使用者的工作習慣；全部時只投影讀取 working_habits 欄位
+
+    :return: {"users": 有搬移的使用者數, "habits": 搬移的習慣數, "failed": [使用者ID, ...]}
+    """
+    if user_ids is None:
+        user_ids = [doc.id for doc in db.collection('users').select([LEGACY_FIELD]).stream()
+                    if (doc.to_dict() or {}).get(LEGACY_FIELD)]
+
+    summary = {'users': 0, 'habits': 0, 'failed': []}
+    for user_id in user_ids:
+        try:
+            moved = migrate_user(db, user_id, dry_run)
+        except Exception as e:
+            logging.error(f"使用者 {user_id} 的工作習慣搬移失敗: {str(e)}", exc_info=True)
+            summary['failed'].append(user_id)
+            continue
+        if moved:
+            summary['users'] += 1
+            summary['habits'] += moved
+            logging.info(f"使用者 {user_id}：{'將' if dry_run else '已'}搬移 {moved} 個工作習慣")
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--user', action='append', dest='users', help='只處理指定使用者（可重複指定）')
+    parser.add_argument('--dry-run', action='store_true', help='只計算要搬移的數量，不寫入')
+    parser.add_argument('--credentials', default=DEFAULT_CREDENTIALS, help='Firebase 服務帳戶金鑰')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    firebase_admin.initialize_app(credentials.Certificate(args.credentials))
+    print(migrate_all(firestore.client(), args.users, args.dry_run))
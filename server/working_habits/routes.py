@@ -1,6 +1,7 @@
 # working_habits/routes.py
 from flask import Blueprint, request, jsonify
 from working_habits import services
+from utils.etag import conditional_get
 import logging
 
 # 建立藍圖
@@ -27,6 +28,7 @@ def create_habits():
         return jsonify({'error': str(e)}), 500
 
 @working_habits_bp.route('/habits', methods=['GET'])
+@conditional_get('working_habits')
 def retrieve_habits():
     user_id = request.args.get('user_id')  # 從 URL 取得 ?user_id=xxxx
     # 如果沒有提供 user_id，回傳錯誤訊息
@@ -1,42 +1,38 @@
 # working_habits/services.py
 from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
 from datetime import datetime
 import uuid
+from utils.etag import bump_versions
+from utils.read_cache import cached_value, invalidate, working_habits_tag
+
+# 每個工作習慣存成 users/{user_id}/working_habits/{habit_id} 一份文件；
+# 舊資料存在使用者文檔的 working_habits 欄位（{habit_id: 習慣}），讀取時一併合併，
+# 更新時逐筆搬到子集合，也可用 working_habits/migrate.py 一次搬移
+LEGACY_FIELD = 'working_habits'
+
+
+def _habits_ref(db, user_id):
+    return db.collection('users').document(user_id).collection('working_habits')
+
 
 def create_working_habit(user_id, working_habit_data):
     """
-    建立工作習慣記錄
+    建立工作習慣記錄（直接寫入一份新文件，不需先讀取）
     
     :param user_id: 使用者ID
     :param working_habit_data: 習慣資料
     :return: 成功與否的訊息與習慣ID
     """
     db = firestore.client()
-    # 獲取用戶文檔引用
-    user_ref = db.collection('users').document(user_id)
-    
-    # 獲取用戶文檔當前數據
-    user_doc = user_ref.get()
-    
-    # 生成唯一ID作為習慣的鍵
+
+    # 生成唯一ID作為習慣的文件ID
     habit_id = str(uuid.uuid4())
-    
-    # 確保working_habits欄位存在
-    if user_doc.exists:
-        user_data = user_doc.to_dict()
-        working_habits = user_data.get('working_habits', {})
-    else:
-        # 如果用戶文檔不存在，創建一個空的文檔
-        working_habits = {}
-        user_ref.set({})
-    
-    # 添加新習慣到用戶的working_habits欄位
-    working_habits[habit_id] = working_habit_data
-    
-    # 更新用戶文檔
-    user_ref.update({
-        'working_habits': working_habits
-    })
+    batch = db.batch()
+    batch.set(_habits_ref(db, user_id).document(habit_id), working_habit_data)
+    bump_versions(batch, db, user_id, 'working_habits')
+    batch.commit()
+    invalidate(working_habits_tag(user_id))
     
     return {
         'message': f'工作習慣建立成功',
@@ -45,31 +41,38 @@ def create_working_habit(user_id, working_habit_data):
 
 def get_working_habits(user_id):
     """
-    獲取使用者的所有工作習慣
+    獲取使用者的所有工作習慣（經過讀取快取）
     
     :param user_id: 使用者ID
     :return: 工作習慣列表
     """
+    return cached_value(('working_habits', user_id), [working_habits_tag(user_id)],
+                        lambda: _load_working_habits(user_id))
+
+def _load_working_habits(user_id):
+    """
+    從 Firestore 讀取使用者的工作習慣
+
+    子集合的習慣之外，使用者文檔只投影讀取尚未搬移的 working_habits 欄位，
+    不會讀到文檔中的其他資料；同一個ID兩邊都有時以子集合為準。
+    """
     db = firestore.client()
-    # 獲取用戶文檔
-    user_doc = db.collection('users').document(user_id).get()
-    
-    result = []
-    
-    if user_doc.exists:
-        user_data = user_doc.to_dict()
-        working_habits = user_data.get('working_habits', {})
-        
-        # 將字典轉換為列表，每個習慣添加ID
-        for habit_id, habit_data in working_habits.items():
-            habit_data['id'] = habit_id
-            result.append(habit_data)
-    
-    return result
+    user_doc = db.collection('users').document(user_id).get(field_paths=[LEGACY_FIELD])
+    legacy = (user_doc.to_dict() or {}).get(LEGACY_FIELD) if user_doc.exists else None
+
+    habits = dict(legacy or {})
+    for doc in _habits_ref(db, user_id).stream():
+        habits[doc.id] = doc.to_dict()
+
+    # 將字典轉換為列表，每個習慣添加ID
+    return [{**habit_data, 'id': habit_id} for habit_id, habit_data in habits.items()]
 
 def update_working_habit(user_id, habit_id, working_habit_data):
     """
     更新工作習慣
+
+    已在子集合的習慣直接以 update 寫入要更新的欄位（文件不存在時 Firestore 會拒絕整個 batch），不需先讀取；
+    仍在舊欄位的習慣則在交易中搬到子集合後再更新。
     
     :param user_id: 使用者ID
     :param habit_id: 習慣ID
@@ -77,34 +80,49 @@ def update_working_habit(user_id, habit_id, working_habit_data):
     :return: 成功與否的訊息
     """
     db = firestore.client()
-    # 獲取用戶文檔引用
-    user_ref = db.collection('users').document(user_id)
-    
-    # 獲取用戶文檔
-    user_doc = user_ref.get()
-    
-    if not user_doc.exists:
-        return {'error': f'找不到用戶 {user_id}'}
-    
-    user_data = user_doc.to_dict()
-    working_habits = user_data.get('working_habits', {})
-    
-    # 檢查習慣ID是否存在
-    if habit_id not in working_habits:
-        return {'error': f'找不到習慣 {habit_id}'}
-    
-    # 更新習慣數據
-    existing_habit = working_habits[habit_id]
-    # 保留原有數據並更新新數據
-    existing_habit.update(working_habit_data)
-    
-    # 更新用戶文檔
-    user_ref.update({
-        f'working_habits.{habit_id}': existing_habit
-    })
+    habit_ref = _habits_ref(db, user_id).document(habit_id)
+
+    batch = db.batch()
+    batch.update(habit_ref, working_habit_data)
+    bump_versions(batch, db, user_id, 'working_habits')
+    try:
+        batch.commit()
+    except NotFound:
+        if not _migrate_and_update(db, user_id, habit_id, working_habit_data):
+            return {'error': f'找不到習慣 {habit_id}'}
+    invalidate(working_habits_tag(user_id))
     
     return {'message': f'習慣更新成功'}
 
+def _migrate_and_update(db, user_id, habit_id, working_habit_data):
+    """
+    把舊欄位中的一個習慣搬到子集合並套用更新
+
+    :return: 舊欄位中是否有這個習慣
+    """
+    user_ref = db.collection('users').document(user_id)
+    habit_ref = _habits_ref(db, user_id).document(habit_id)
+    legacy_path = firestore.FieldPath(LEGACY_FIELD, habit_id).to_api_repr()
+
+    @firestore.transactional
+    def migrate(transaction):
+        habit_doc = habit_ref.get(transaction=transaction)
+        if habit_doc.exists:
+            # 在這之間已被搬移
+            transaction.update(habit_ref, working_habit_data)
+            bump_versions(transaction, db, user_id, 'working_habits')
+            return True
+        user_doc = user_ref.get(field_paths=[legacy_path], transaction=transaction)
+        legacy = ((user_doc.to_dict() or {}).get(LEGACY_FIELD) or {}).get(habit_id) if user_doc.exists else None
+        if legacy is None:
+            return False
+        transaction.set(habit_ref, {**legacy, **working_habit_data})
+        transaction.update(user_ref, {legacy_path: firestore.DELETE_FIELD})
+        bump_versions(transaction, db, user_id, 'working_habits')
+        return True
+
+    return migrate(db.transaction())
+
 def create_habit_develop(user_id, data):
     """
     在habitsDevelop集合中建立習慣